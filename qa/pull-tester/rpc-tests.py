@@ -0,0 +1,278 @@
+#!/usr/bin/env python2
+# Copyright (c) 2017 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# Runs the RPC tests in qa/rpc-tests, several at a time.
+#
+# To use:
+# - ./qa/pull-tester/rpc-tests.py                  (run the standard tests)
+# - ./qa/pull-tester/rpc-tests.py -extended        (also run the extended tests)
+# - ./qa/pull-tester/rpc-tests.py wallet.py        (run only the given tests)
+# - ./qa/pull-tester/rpc-tests.py -j8 ...          (run up to 8 tests at once)
+#
+# The cached chains are built first, by create_cache.py. Each running test is
+# then given its own --portseed, so that the nodes of different tests listen
+# on disjoint ports. The longest tests are started first, using the durations
+# recorded by earlier runs. With more than one job, each test's output is
+# shown once it finishes; otherwise it is shown as the test runs. Other
+# options are passed on to the test scripts.
+#
+
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+
+TEST_SCRIPTS = [
+    'paymentdisclosure.py',
+    'prioritisetransaction.py',
+    'wallet_treestate.py',
+    'wallet_protectcoinbase.py',
+    'wallet_shieldcoinbase.py',
+    'wallet.py',
+    'wallet_nullifiers.py',
+    'wallet_1941.py',
+    'listtransactions.py',
+    'mempool_resurrect_test.py',
+    'txn_doublespend.py',
+    'txn_doublespend.py --mineblock',
+    'getchaintips.py',
+    'rawtransactions.py',
+    'rest.py',
+    'mempool_spendcoinbase.py',
+    'mempool_coinbase_spends.py',
+    'mempool_tx_input_limit.py',
+    'httpbasics.py',
+    'zapwallettxes.py',
+    'proxy_test.py',
+    'merkle_blocks.py',
+    'fundrawtransaction.py',
+    'signrawtransactions.py',
+    'walletbackup.py',
+    'key_import_export.py',
+    'nodehandling.py',
+    'reindex.py',
+    'decodescript.py',
+    'disablewallet.py',
+    'zcjoinsplit.py',
+    'zcjoinsplitdoublespend.py',
+    'getblocktemplate.py',
+    'bip65-cltv-p2p.py',
+    'bipdersig-p2p.py',
+]
+
+TEST_SCRIPTS_EXT = [
+    'getblocktemplate_longpoll.py',
+    'getblocktemplate_proposals.py',
+    'pruning.py',
+    'forknotify.py',
+    'hardforkdetection.py',
+    'invalidateblock.py',
+    'keypool.py',
+    'receivedby.py',
+    'rpcbind_test.py',
+    # 'script_test.py',
+    'smartfees.py',
+    'maxblocksinflight.py',
+    'invalidblockrequest.py',
+    'p2p-acceptblock.py',
+]
+
+EXTENDED_ARG = '-extended'
+
+
+def read_config(path):
+    # Reads the NAME=value assignments of tests-config.sh, expanding
+    # references to earlier ones
+    config = {}
+    with open(path) as f:
+        for line in f:
+            m = re.match(r'^(\w+)="?(.*?)"?$', line.strip())
+            if m:
+                config[m.group(1)] = re.sub(
+                    r'\$\{?(\w+)\}?', lambda v: config.get(v.group(1), ''), m.group(2))
+    return config
+
+
+def parse_args(argv):
+    jobs = 1
+    durations_file = None
+    names = []
+    pass_on = []
+    extended = False
+    for arg in argv:
+        m = re.match(r'^(?:-j|--jobs=)(\d+)$', arg)
+        if m:
+            jobs = int(m.group(1))
+            if jobs < 1:
+                sys.exit("%s: the number of jobs must be at least 1" % arg)
+        elif arg.startswith('--durations='):
+            durations_file = arg[len('--durations='):]
+        elif arg == EXTENDED_ARG:
+            extended = True
+        elif arg.startswith('-'):
+            pass_on.append(arg)
+        else:
+            names.append(arg)
+    return (jobs, durations_file, names, extended, pass_on)
+
+
+def select_tests(names, extended, config):
+    scripts = list(TEST_SCRIPTS)
+    if config.get('ENABLE_ZMQ') == '1':
+        scripts.append('zmq_test.py')
+    if config.get('ENABLE_PROTON') == '1':
+        scripts.append('proton_test.py')
+    if not names:
+        return scripts + (TEST_SCRIPTS_EXT if extended else [])
+    return [t for t in scripts + TEST_SCRIPTS_EXT
+            if t in names or t in [name + '.py' for name in names]]
+
+
+def load_durations(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_durations(path, durations):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(durations, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+class TestJob(object):
+    def __init__(self, test, command, slot, port_seed, buffered):
+        # Output is buffered only when tests run in parallel, so that a
+        # single test's output is still shown as it runs
+        self.test = test
+        self.slot = slot
+        self.log = tempfile.TemporaryFile() if buffered else None
+        self.start = time.time()
+        self.process = subprocess.Popen(
+            command + ['--portseed=%d' % port_seed],
+            stdout=self.log, stderr=subprocess.STDOUT if buffered else None)
+
+    def output(self):
+        if self.log is None:
+            return ''
+        self.log.seek(0)
+        return self.log.read()
+
+
+def decode_status(status):
+    # Converts an os.wait() status to a Popen-style returncode
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_tests(tests, jobs, config, pass_on, durations):
+    rpc_tests = os.path.join(config['BUILDDIR'], 'qa', 'rpc-tests')
+    srcdir = os.path.join(config['BUILDDIR'], 'src')
+    sys.path.insert(0, rpc_tests)
+    from test_framework.util import PORT_SEEDS
+
+    def command(test):
+        return ([os.path.join(rpc_tests, test.split()[0])] + test.split()[1:] +
+                ['--srcdir', srcdir] + pass_on)
+
+    # Each running job holds a slot, and its port seed is its slot number
+    # offset by this run's base seed. Seeds are taken modulo the number of
+    # disjoint port ranges, so no two running jobs can share a range.
+    jobs = min(jobs, PORT_SEEDS)
+    base_seed = os.getpid() % PORT_SEEDS
+    free_slots = range(jobs)
+
+    # Build the cached chains once, before any test runs, so that
+    # every job count uses the same cache. If that fails, no test is run.
+    status = subprocess.call(command('create_cache.py') + ['--portseed=%d' % base_seed])
+    if status != 0:
+        print("!!! FAIL: create_cache.py failed with exit code %d !!!" % status)
+        print("")
+        return ([], ['create_cache.py'])
+
+    # Tests that mine in a solver pool share the CPUs between the jobs that
+    # run at once
+    os.environ['ZCASH_RPC_TEST_JOBS'] = str(jobs)
+
+    # Longest first; tests that have not been timed yet are assumed to be long
+    queue = sorted(tests, key=lambda t: -durations.get(t, float('inf')))
+    running = {}
+    successes = []
+    failures = []
+    while queue or running:
+        while queue and len(running) < jobs:
+            test = queue.pop(0)
+            if jobs == 1:
+                print("=== Running testscript %s ===" % test)
+                sys.stdout.flush()
+            slot = free_slots.pop(0)
+            job = TestJob(test, command(test), slot,
+                          (base_seed + slot) % PORT_SEEDS, jobs > 1)
+            running[job.process.pid] = job
+
+        (pid, status) = os.wait()
+        job = running.pop(pid, None)
+        if job is None:
+            continue
+        job.process.returncode = decode_status(status)
+        durations[job.test] = time.time() - job.start
+        free_slots.append(job.slot)
+
+        if jobs > 1:
+            print("=== Running testscript %s ===" % job.test)
+            sys.stdout.write(job.output())
+        if job.process.returncode == 0:
+            successes.append(job.test)
+            print("--- Success: %s ---" % job.test)
+        else:
+            failures.append(job.test)
+            print("!!! FAIL: %s !!!" % job.test)
+        print("")
+        sys.stdout.flush()
+    return (successes, failures)
+
+
+def main():
+    (jobs, durations_file, names, extended, pass_on) = parse_args(sys.argv[1:])
+    config = read_config(os.path.join(CURDIR, 'tests-config.sh'))
+    if not (config.get('ENABLE_BITCOIND') == config.get('ENABLE_UTILS') ==
+            config.get('ENABLE_WALLET') == '1'):
+        print("No rpc tests to run. Wallet, utils, and bitcoind must all be enabled")
+        return
+
+    os.environ['BITCOINCLI'] = os.path.join(config['BUILDDIR'], 'qa', 'pull-tester', 'run-bitcoin-cli')
+    os.environ['BITCOIND'] = config['REAL_BITCOIND']
+
+    if durations_file is None:
+        durations_file = os.path.join('cache', 'rpc-test-durations.json')
+    durations = load_durations(durations_file)
+
+    start = time.time()
+    (successes, failures) = run_tests(
+        select_tests(names, extended, config), jobs, config, pass_on, durations)
+    save_durations(durations_file, durations)
+
+    print("\n\nTests completed: %d" % (len(successes) + len(failures)))
+    print("successes %d; failures: %d" % (len(successes), len(failures)))
+    print("Total time: %d s with %d jobs" % (time.time() - start, jobs))
+
+    if failures:
+        print("\nFailing tests: %s" % " ".join(failures))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
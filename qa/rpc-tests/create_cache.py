@@ -0,0 +1,24 @@
+#!/usr/bin/env python2
+# Copyright (c) 2017 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# Helper script to create the cache of regtest chains, so that tests run in
+# parallel by qa/pull-tester/rpc-tests.py do not all try to build it
+#
+
+from test_framework.test_framework import BitcoinTestFramework
+
+
+class CreateCache(BitcoinTestFramework):
+
+    def setup_network(self):
+        # setup_chain has created the cache; no nodes are needed
+        self.nodes = []
+
+    def run_test(self):
+        pass
+
+if __name__ == '__main__':
+    CreateCache().main()
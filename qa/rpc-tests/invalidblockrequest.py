@@ -7,7 +7,7 @@
 from test_framework.test_framework import ComparisonTestFramework
 from test_framework.util import assert_equal
 from test_framework.comptool import TestManager, TestInstance
-from test_framework.mininode import NetworkThread
+from test_framework.mininode import NetworkThread, start_solver_pool
 from test_framework.blocktools import create_block, create_coinbase, create_transaction
 
 import copy
@@ -30,6 +30,12 @@ class InvalidBlockRequestTest(ComparisonTestFramework):
     def __init__(self):
         self.num_nodes = 1
 
+    def setup_chain(self):
+        # Blocks are solved in parallel, by workers forked before any
+        # connections are opened
+        self.solver_workers = start_solver_pool()
+        ComparisonTestFramework.setup_chain(self)
+
     def run_test(self):
         test = TestManager(self, self.options.tmpdir)
         test.add_all_connections(self.nodes)
@@ -48,7 +54,7 @@ class InvalidBlockRequestTest(ComparisonTestFramework):
         '''
         block = create_block(self.tip, create_coinbase(), self.block_time)
         self.block_time += 1
-        block.solve()
+        block.solve(workers=self.solver_workers)
         # Save the coinbase for later
         self.block1 = block
         self.tip = block.sha256
@@ -60,7 +66,7 @@ class InvalidBlockRequestTest(ComparisonTestFramework):
         test = TestInstance(sync_every_block=False)
         for i in xrange(100):
             block = create_block(self.tip, create_coinbase(), self.block_time)
-            block.solve()
+            block.solve(workers=self.solver_workers)
             self.tip = block.sha256
             self.block_time += 1
             test.blocks_and_transactions.append([block, True])
@@ -83,7 +89,7 @@ class InvalidBlockRequestTest(ComparisonTestFramework):
         block2.vtx.extend([tx1, tx2])
         block2.hashMerkleRoot = block2.calc_merkle_root()
         block2.rehash()
-        block2.solve()
+        block2.solve(workers=self.solver_workers)
         orig_hash = block2.sha256
         block2_orig = copy.deepcopy(block2)
 
@@ -106,7 +112,7 @@ class InvalidBlockRequestTest(ComparisonTestFramework):
         block3.vtx[0].calc_sha256()
         block3.hashMerkleRoot = block3.calc_merkle_root()
         block3.rehash()
-        block3.solve()
+        block3.solve(workers=self.solver_workers)
 
         yield TestInstance([[block3, False]])
 
@@ -9,7 +9,8 @@
 
 from test_framework.authproxy import JSONRPCException
 from test_framework.util import check_json_precision, initialize_chain, \
-    start_nodes, start_node, stop_nodes, wait_bitcoinds, bitcoind_processes
+    start_nodes, start_node, stop_nodes, wait_bitcoinds, bitcoind_processes, \
+    PortSeed
 
 import os
 import sys
@@ -83,8 +84,12 @@ def main():
                       help="Source directory containing bitcoind/bitcoin-cli (default: %default%)")
     parser.add_option("--tmpdir", dest="tmpdir", default=tempfile.mkdtemp(prefix="test"),
                       help="Root directory for datadirs")
+    parser.add_option("--portseed", dest="port_seed", default=os.getpid(), type='int',
+                      help="The seed to use for assigning port numbers (default: current process id)")
     (options, args) = parser.parse_args()
 
+    PortSeed.n = options.port_seed
+
     os.environ['PATH'] = options.srcdir+":"+os.environ['PATH']
 
     check_json_precision()
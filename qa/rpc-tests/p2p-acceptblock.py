@@ -6,7 +6,7 @@
 
 from test_framework.mininode import CBlockHeader, CInv, NodeConn, NodeConnCB, \
     NetworkThread, msg_block, msg_headers, msg_inv, msg_ping, msg_pong, \
-    mininode_lock
+    mininode_lock, start_solver_pool
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import assert_equal, initialize_chain_clean, \
     start_node, p2p_port
@@ -119,6 +119,9 @@ class AcceptBlockTest(BitcoinTestFramework):
                           help="bitcoind binary to test")
 
     def setup_chain(self):
+        # Blocks are solved in parallel, by workers forked before any
+        # connections are opened
+        self.solver_workers = start_solver_pool()
         initialize_chain_clean(self.options.tmpdir, 2)
 
     def setup_network(self):
@@ -159,7 +162,7 @@ class AcceptBlockTest(BitcoinTestFramework):
         block_time = time.time() + 1
         for i in xrange(2):
             blocks_h2.append(create_block(tips[i], create_coinbase(), block_time))
-            blocks_h2[i].solve()
+            blocks_h2[i].solve(workers=self.solver_workers)
             block_time += 1
         test_node.send_message(msg_block(blocks_h2[0]))
         white_node.send_message(msg_block(blocks_h2[1]))
@@ -173,7 +176,7 @@ class AcceptBlockTest(BitcoinTestFramework):
         blocks_h2f = []  # Blocks at height 2 that fork off the main chain
         for i in xrange(2):
             blocks_h2f.append(create_block(tips[i], create_coinbase(), blocks_h2[i].nTime+1))
-            blocks_h2f[i].solve()
+            blocks_h2f[i].solve(workers=self.solver_workers)
         test_node.send_message(msg_block(blocks_h2f[0]))
         white_node.send_message(msg_block(blocks_h2f[1]))
 
@@ -192,7 +195,7 @@ class AcceptBlockTest(BitcoinTestFramework):
         blocks_h3 = []
         for i in xrange(2):
             blocks_h3.append(create_block(blocks_h2f[i].sha256, create_coinbase(), blocks_h2f[i].nTime+1))
-            blocks_h3[i].solve()
+            blocks_h3[i].solve(workers=self.solver_workers)
         test_node.send_message(msg_block(blocks_h3[0]))
         white_node.send_message(msg_block(blocks_h3[1]))
 
@@ -223,7 +226,7 @@ class AcceptBlockTest(BitcoinTestFramework):
         for j in xrange(2):
             for i in xrange(288):
                 next_block = create_block(tips[j].sha256, create_coinbase(), tips[j].nTime+1)
-                next_block.solve()
+                next_block.solve(workers=self.solver_workers)
                 if j==0:
                     test_node.send_message(msg_block(next_block))
                     all_blocks.append(next_block)
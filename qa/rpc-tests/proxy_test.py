@@ -5,10 +5,10 @@
 
 from test_framework.socks5 import Socks5Configuration, Socks5Command, Socks5Server, AddressType
 from test_framework.test_framework import BitcoinTestFramework
-from test_framework.util import assert_equal, start_nodes
+from test_framework.util import assert_equal, start_nodes, \
+    PortSeed, PORT_MIN, PORT_RANGE
 
 import socket
-import os
 
 '''
 Test plan:
@@ -34,23 +34,26 @@ addnode connect to onion
 addnode connect to generic DNS name
 '''
 
+# Start after the p2p and rpc port ranges
+RANGE_BEGIN = PORT_MIN + 2 * PORT_RANGE
+
 class ProxyTest(BitcoinTestFramework):        
-    def __init__(self):
+    def setup_proxies(self):
         # Create two proxies on different ports
         # ... one unauthenticated
         self.conf1 = Socks5Configuration()
-        self.conf1.addr = ('127.0.0.1', 13000 + (os.getpid() % 1000))
+        self.conf1.addr = ('127.0.0.1', RANGE_BEGIN + (PortSeed.n % 1000))
         self.conf1.unauth = True
         self.conf1.auth = False
         # ... one supporting authenticated and unauthenticated (Tor)
         self.conf2 = Socks5Configuration()
-        self.conf2.addr = ('127.0.0.1', 14000 + (os.getpid() % 1000))
+        self.conf2.addr = ('127.0.0.1', RANGE_BEGIN + 1000 + (PortSeed.n % 1000))
         self.conf2.unauth = True
         self.conf2.auth = True
         # ... one on IPv6 with similar configuration
         self.conf3 = Socks5Configuration()
         self.conf3.af = socket.AF_INET6
-        self.conf3.addr = ('::1', 15000 + (os.getpid() % 1000))
+        self.conf3.addr = ('::1', RANGE_BEGIN + 2000 + (PortSeed.n % 1000))
         self.conf3.unauth = True
         self.conf3.auth = True
 
@@ -62,6 +65,8 @@ class ProxyTest(BitcoinTestFramework):
         self.serv3.start()
 
     def setup_nodes(self):
+        # The proxies' ports depend on --portseed, which is only known here
+        self.setup_proxies()
         # Note: proxies are not used to connect to local nodes
         # this is because the proxy to use is based on CService.GetNetwork(), which return NET_UNROUTABLE for localhost
         return start_nodes(4, self.options.tmpdir, extra_args=[
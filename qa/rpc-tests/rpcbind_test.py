@@ -9,7 +9,7 @@
 
 from test_framework.util import assert_equal, check_json_precision, \
     initialize_chain, start_nodes, stop_nodes, wait_bitcoinds, \
-    bitcoind_processes, rpc_port
+    bitcoind_processes, rpc_port, PortSeed
 from test_framework.authproxy import AuthServiceProxy
 from test_framework.netutil import addr_to_hex, get_bind_addrs, all_interfaces
 
@@ -113,8 +113,12 @@ def main():
                       help="Source directory containing bitcoind/bitcoin-cli (default: %default%)")
     parser.add_option("--tmpdir", dest="tmpdir", default=tempfile.mkdtemp(prefix="test"),
                       help="Root directory for datadirs")
+    parser.add_option("--portseed", dest="port_seed", default=os.getpid(), type='int',
+                      help="The seed to use for assigning port numbers (default: current process id)")
     (options, args) = parser.parse_args()
 
+    PortSeed.n = options.port_seed
+
     os.environ['PATH'] = options.srcdir+":"+os.environ['PATH']
 
     check_json_precision()
@@ -7,6 +7,9 @@
 
   - HTTP connections persist for the life of the AuthServiceProxy object
     (if server supports HTTP/1.1)
+  - keeps a pool of connections, so one proxy can be used from several
+    threads, and can run calls concurrently (call_async, map)
+  - sends many calls in one HTTP request with batch()
   - sends protocol 'version', per JSON-RPC 1.1
   - sends proper, incrementing 'id'
   - sends Basic HTTP authentication headers
@@ -40,8 +43,15 @@ except ImportError:
     import httplib
 import base64
 import decimal
+import itertools
 import json
 import logging
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 try:
     import urllib.parse as urlparse
 except ImportError:
@@ -51,30 +61,286 @@ USER_AGENT = "AuthServiceProxy/0.1"
 
 HTTP_TIMEOUT = 600
 
+# Batches with more calls than this are split into several HTTP requests
+BATCH_MAX_SIZE = 1000
+
 log = logging.getLogger("BitcoinRPC")
 
+# If set, every RPC exchange is reported to metrics_hook.record(method,
+# elapsed, request_bytes, response_bytes, retries). See rpcmetrics.py.
+metrics_hook = None
+
+def set_metrics_hook(hook):
+    global metrics_hook
+    metrics_hook = hook
+
 class JSONRPCException(Exception):
     def __init__(self, rpc_error):
         Exception.__init__(self)
         self.error = rpc_error
 
 
+# Decimal parsing is slow, and amounts in large responses (listunspent,
+# getrawmempool true, verbose getblock) repeat a lot, so parsed values are
+# memoized. Decimals are immutable, so they can be shared.
+DECIMAL_CACHE_SIZE = 100000
+_decimal_cache = {}
+
+def ParseDecimal(s):
+    try:
+        return _decimal_cache[s]
+    except KeyError:
+        if len(_decimal_cache) >= DECIMAL_CACHE_SIZE:
+            _decimal_cache.clear()
+        d = _decimal_cache[s] = decimal.Decimal(s)
+        return d
+
 def EncodeDecimal(o):
     if isinstance(o, decimal.Decimal):
         return round(o, 8)
     raise TypeError(repr(o) + " is not JSON serializable")
 
+class RPCFuture(object):
+    """
+    The eventual result of an RPC call made with AuthServiceProxy.call_async
+    or in an RPCBatch. Waiting for it gives up after timeout seconds, which
+    defaults to the timeout of the proxy.
+    """
+    def __init__(self, timeout=HTTP_TIMEOUT):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._timeout = timeout
+        # Set while the call is held in a batch that has not been executed
+        self._queued = False
+
+    def set_result(self, result):
+        self._result = result
+        self._queued = False
+        self._done.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._queued = False
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        if self._queued:
+            raise RuntimeError("RPC call is in a batch that has not been executed")
+        if timeout is None:
+            timeout = self._timeout
+        # An untimed wait cannot be interrupted with Ctrl-C in Python 2
+        if not self._done.wait(timeout):
+            raise RuntimeError("RPC call did not complete within %s seconds" % timeout)
+        return self._exception
+
+    def result(self, timeout=None):
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+class ConnectionPool(object):
+    """
+    Up to size keep-alive HTTP connections to one server, shared by an
+    AuthServiceProxy and its child proxies. A connection is used by one
+    request at a time. Calls made with call_async are run by up to one
+    daemon worker thread per connection. Workers are started when calls are
+    submitted, and exit as soon as there are no more calls to run, so an
+    idle pool has no threads.
+    """
+    def __init__(self, url, size, timeout):
+        self.url = url
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._count = 0
+        self._lock = threading.Lock()
+        self._tasks = queue.Queue()
+        self._workers = []
+
+    def _connect(self):
+        if self.url.port is None:
+            port = 80
+        else:
+            port = self.url.port
+        if self.url.scheme == 'https':
+            return httplib.HTTPSConnection(self.url.hostname, port,
+                                           None, None, False,
+                                           self.timeout)
+        else:
+            return httplib.HTTPConnection(self.url.hostname, port,
+                                          False, self.timeout)
+
+    def add(self, conn):
+        with self._lock:
+            self._count += 1
+        self._idle.put(conn)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._count < self.size
+            if create:
+                self._count += 1
+        if create:
+            return self._connect()
+        return self._idle.get()
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    def submit(self, fn, args):
+        future = RPCFuture(self.timeout)
+        # Workers only exit with the lock held and no calls queued, so a
+        # queued call always has a worker to run it
+        with self._lock:
+            self._tasks.put((future, fn, args))
+            if len(self._workers) < self.size:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+        return future
+
+    def close(self):
+        """
+        Wait for the calls already submitted to finish, and close the idle
+        connections. The pool can still be used afterwards; connections are
+        reopened as needed.
+        """
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            worker.join()
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for conn in idle:
+            # httplib reconnects a closed connection on its next request
+            conn.close()
+            self._idle.put(conn)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                try:
+                    task = self._tasks.get_nowait()
+                except queue.Empty:
+                    self._workers.remove(threading.current_thread())
+                    return
+            (future, fn, args) = task
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+class RPCBatch(object):
+    """
+    Collects RPC calls made on it, and sends them in as few HTTP requests as
+    possible when the with block ends (or execute() is called):
+
+        with proxy.batch() as b:
+            hashes = [b.getblockhash(i) for i in range(10000)]
+        hashes = [h.result() for h in hashes]
+
+    Each call returns an RPCFuture. An error for one call is raised only
+    when its result is read. Reading a result before the batch is executed
+    raises RuntimeError, and so does reading any result of a batch whose
+    with block raised an exception.
+    """
+    def __init__(self, proxy, max_size=BATCH_MAX_SIZE):
+        self._proxy = proxy
+        self._max_size = max_size
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            # Python internal stuff
+            raise AttributeError
+        def call(*args):
+            future = self._proxy._future()
+            future._queued = True
+            self._calls.append((self._proxy._rpc_request(name, args), future))
+            return future
+        return call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+            return
+        # Fail the calls, so that no other thread waits for them forever
+        calls, self._calls = self._calls, []
+        for (_, future) in calls:
+            future.set_exception(RuntimeError(
+                "RPC batch was not executed, as its with block raised %s"
+                % exc_type.__name__))
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        for (_, future) in calls:
+            future._queued = False
+        chunks = [calls[i:i+self._max_size]
+                  for i in range(0, len(calls), self._max_size)]
+        if not chunks:
+            return
+        # Any further chunks are sent concurrently if the proxy has several
+        # connections, while the first is sent from this thread
+        posts = [self._proxy._submit(self._proxy._batch,
+                                     ([request for (request, _) in chunk],))
+                 for chunk in chunks[1:]]
+        first = RPCFuture()
+        try:
+            first.set_result(self._proxy._batch([request for (request, _) in chunks[0]]))
+        except Exception as e:
+            first.set_exception(e)
+        for (chunk, post) in zip(chunks, [first] + posts):
+            try:
+                responses = post.result()
+            except Exception as e:
+                for (_, future) in chunk:
+                    future.set_exception(e)
+                continue
+            if isinstance(responses, list):
+                by_id = dict((response.get('id'), response) for response in responses)
+                missing = JSONRPCException({
+                    'code': -343, 'message': 'missing JSON-RPC result'})
+            else:
+                # The server rejected the whole batch
+                by_id = {}
+                missing = JSONRPCException(responses.get('error') or {
+                    'code': -343, 'message': 'invalid JSON-RPC batch response'})
+            for (request, future) in chunk:
+                response = by_id.get(request['id'])
+                if response is None:
+                    future.set_exception(missing)
+                elif response.get('error') is not None:
+                    future.set_exception(JSONRPCException(response['error']))
+                elif 'result' not in response:
+                    future.set_exception(JSONRPCException({
+                        'code': -343, 'message': 'missing JSON-RPC result'}))
+                else:
+                    future.set_result(response['result'])
+
 class AuthServiceProxy(object):
-    __id_count = 0
+    __id_count = itertools.count(1)
 
-    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None):
+    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None, pool_size=1, pool=None):
         self.__service_url = service_url
         self.__service_name = service_name
         self.__url = urlparse.urlparse(service_url)
-        if self.__url.port is None:
-            port = 80
-        else:
-            port = self.__url.port
         (user, passwd) = (self.__url.username, self.__url.password)
         try:
             user = user.encode('utf8')
@@ -87,16 +353,20 @@ class AuthServiceProxy(object):
         authpair = user + b':' + passwd
         self.__auth_header = b'Basic ' + base64.b64encode(authpair)
 
-        if connection:
-            # Callables re-use the connection of the original proxy
-            self.__conn = connection
-        elif self.__url.scheme == 'https':
-            self.__conn = httplib.HTTPSConnection(self.__url.hostname, port,
-                                                  None, None, False,
-                                                  timeout)
+        if pool is not None:
+            # Callables re-use the connections of the original proxy
+            self.__pool = pool
         else:
-            self.__conn = httplib.HTTPConnection(self.__url.hostname, port,
-                                                 False, timeout)
+            self.__pool = ConnectionPool(self.__url, pool_size, timeout)
+            if connection:
+                self.__pool.add(connection)
+
+    def close(self):
+        """
+        Wait for calls made with call_async, map and batch to finish, and
+        close the connections to the server
+        """
+        self.__pool.close()
 
     def __getattr__(self, name):
         if name.startswith('__') and name.endswith('__'):
@@ -104,9 +374,9 @@ class AuthServiceProxy(object):
             raise AttributeError
         if self.__service_name is not None:
             name = "%s.%s" % (self.__service_name, name)
-        return AuthServiceProxy(self.__service_url, name, connection=self.__conn)
+        return AuthServiceProxy(self.__service_url, name, pool=self.__pool)
 
-    def _request(self, method, path, postdata):
+    def _request(self, method, path, postdata, name=None):
         '''
         Do a HTTP request, with retry if we get disconnected (e.g. due to a timeout).
         This is a workaround for https://bugs.python.org/issue3566 which is fixed in Python 3.5.
@@ -115,32 +385,62 @@ class AuthServiceProxy(object):
                    'User-Agent': USER_AGENT,
                    'Authorization': self.__auth_header,
                    'Content-type': 'application/json'}
+        start = time.time()
+        retries = 0
+        conn = self.__pool.acquire()
         try:
-            self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
-        except Exception as e:
-            # If connection was closed, try again.
-            # Python 3.5+ raises BrokenPipeError instead of BadStatusLine when the connection was reset.
-            # ConnectionResetError happens on FreeBSD with Python 3.4.
-            # These classes don't exist in Python 2.x, so we can't refer to them directly.
-            if ((isinstance(e, httplib.BadStatusLine) and e.line == "''")
-                or e.__class__.__name__ in ('BrokenPipeError', 'ConnectionResetError')):
-                self.__conn.close()
-                self.__conn.request(method, path, postdata, headers)
-                return self._get_response()
-            else:
-                raise
+            try:
+                conn.request(method, path, postdata, headers)
+                (response, response_bytes) = self._get_response(conn)
+            except Exception as e:
+                # If connection was closed, try again.
+                # Python 3.5+ raises BrokenPipeError instead of BadStatusLine when the connection was reset.
+                # ConnectionResetError happens on FreeBSD with Python 3.4.
+                # These classes don't exist in Python 2.x, so we can't refer to them directly.
+                if ((isinstance(e, httplib.BadStatusLine) and e.line == "''")
+                    or e.__class__.__name__ in ('BrokenPipeError', 'ConnectionResetError')):
+                    conn.close()
+                    retries += 1
+                    conn.request(method, path, postdata, headers)
+                    (response, response_bytes) = self._get_response(conn)
+                else:
+                    raise
+        except:
+            # Don't leave a half-read response for the next request
+            conn.close()
+            raise
+        finally:
+            self.__pool.release(conn)
+        hook = metrics_hook
+        if hook is not None:
+            hook.record(name, time.time() - start, len(postdata), response_bytes, retries)
+        return response
+
+    def _rpc_request(self, name, args):
+        if self.__service_name is not None:
+            name = "%s.%s" % (self.__service_name, name)
+        return {'version': '1.1',
+                'method': name,
+                'params': args,
+                'id': next(AuthServiceProxy.__id_count)}
+
+    def _submit(self, fn, args):
+        return self.__pool.submit(fn, args)
+
+    def _future(self):
+        return RPCFuture(self.__pool.timeout)
 
     def __call__(self, *args):
-        AuthServiceProxy.__id_count += 1
+        call_id = next(AuthServiceProxy.__id_count)
 
-        log.debug("-%s-> %s %s"%(AuthServiceProxy.__id_count, self.__service_name,
-                                 json.dumps(args, default=EncodeDecimal)))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("-%s-> %s %s"%(call_id, self.__service_name,
+                                     json.dumps(args, default=EncodeDecimal)))
         postdata = json.dumps({'version': '1.1',
                                'method': self.__service_name,
                                'params': args,
-                               'id': AuthServiceProxy.__id_count}, default=EncodeDecimal)
-        response = self._request('POST', self.__url.path, postdata)
+                               'id': call_id}, default=EncodeDecimal)
+        response = self._request('POST', self.__url.path, postdata, self.__service_name)
         if response['error'] is not None:
             raise JSONRPCException(response['error'])
         elif 'result' not in response:
@@ -149,21 +449,50 @@ class AuthServiceProxy(object):
         else:
             return response['result']
 
+    def call_async(self, method, *args):
+        """
+        Start an RPC call on one of the pooled connections, and return an
+        RPCFuture for its result
+        """
+        return self.__pool.submit(getattr(self, method), args)
+
+    def map(self, method, arglists):
+        """
+        Call method once for each argument list, spreading the calls over the
+        pooled connections, and return the results in order. Raises the
+        exception of the first call that failed, if any.
+        """
+        futures = [self.call_async(method, *args) for args in arglists]
+        return [future.result() for future in futures]
+
+    def batch(self, max_size=BATCH_MAX_SIZE):
+        """
+        Return an RPCBatch that sends the calls made on it together
+        """
+        return RPCBatch(self, max_size)
+
     def _batch(self, rpc_call_list):
         postdata = json.dumps(list(rpc_call_list), default=EncodeDecimal)
-        log.debug("--> "+postdata)
-        return self._request('POST', self.__url.path, postdata)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("--> "+postdata)
+        return self._request('POST', self.__url.path, postdata, 'batch')
 
-    def _get_response(self):
-        http_response = self.__conn.getresponse()
+    def _get_response(self, conn):
+        http_response = conn.getresponse()
         if http_response is None:
             raise JSONRPCException({
                 'code': -342, 'message': 'missing HTTP response from server'})
 
-        responsedata = http_response.read().decode('utf8')
-        response = json.loads(responsedata, parse_float=decimal.Decimal)
-        if "error" in response and response["error"] is None:
-            log.debug("<-%s- %s"%(response["id"], json.dumps(response["result"], default=EncodeDecimal)))
-        else:
-            log.debug("<-- "+responsedata)
-        return response
+        responsedata = http_response.read()
+        response_bytes = len(responsedata)
+        if not isinstance(responsedata, str):
+            # Python 3 returns bytes. Python 2's json parses UTF-8 str
+            # directly, which avoids a unicode copy of large responses.
+            responsedata = responsedata.decode('utf8')
+        response = json.loads(responsedata, parse_float=ParseDecimal)
+        if log.isEnabledFor(logging.DEBUG):
+            if "error" in response and response["error"] is None:
+                log.debug("<-%s- %s"%(response["id"], json.dumps(response["result"], default=EncodeDecimal)))
+            else:
+                log.debug("<-- "+responsedata)
+        return (response, response_bytes)
@@ -3,7 +3,7 @@
 #             and for constructing a getheaders message
 #
 
-from mininode import CBlock, CBlockHeader, CBlockLocator, CTransaction, msg_block, msg_headers, msg_tx
+from mininode import CBlockHeader, CBlockLocator, CLazyBlock, CTransaction, msg_block, msg_headers, msg_tx, ser_uint256, uint256_from_str
 
 import sys
 import cStringIO
@@ -12,10 +12,21 @@ import dbm
 class BlockStore(object):
     def __init__(self, datadir):
         self.blockDB = dbm.open(datadir + "/blocks", 'c')
+        # Header index, so that answering getheaders and building locators
+        # never touches block bodies. Each entry maps a block hash to its
+        # serialized header, and is also kept in memory as
+        # hash -> (hashPrevBlock, serialized header).
+        self.headerDB = dbm.open(datadir + "/headers", 'c')
+        self.headerIndex = {}
+        for key in self.headerDB.keys():
+            header = self.headerDB[key]
+            self.headerIndex[long(key.rstrip("L"))] = (
+                uint256_from_str(header[4:36]), header)
         self.currentBlock = 0L
 
     def close(self):
         self.blockDB.close()
+        self.headerDB.close()
 
     def get(self, blockhash):
         serialized_block = None
@@ -23,46 +34,66 @@ class BlockStore(object):
             serialized_block = self.blockDB[repr(blockhash)]
         except KeyError:
             return None
+        # Transactions are only parsed if the caller looks at them
         f = cStringIO.StringIO(serialized_block)
-        ret = CBlock()
+        ret = CLazyBlock()
         ret.deserialize(f)
         ret.calc_sha256()
         return ret
 
-    # Note: this pulls full blocks out of the database just to retrieve
-    # the headers -- perhaps we could keep a separate data structure
-    # to avoid this overhead.
+    def get_header(self, blockhash):
+        try:
+            (prev, serialized_header) = self.headerIndex[blockhash]
+        except KeyError:
+            return None
+        ret = CBlockHeader()
+        ret.deserialize(cStringIO.StringIO(serialized_header))
+        ret.sha256 = blockhash
+        ret.hash = ser_uint256(blockhash)[::-1].encode('hex_codec')
+        return ret
+
+    # Hashes of blockhash and its ancestors in the store, newest first. The
+    # position of a block in the list is its depth below blockhash.
+    def ancestors(self, blockhash, stop=()):
+        hashes = []
+        entry = self.headerIndex.get(blockhash)
+        while entry is not None:
+            hashes.append(blockhash)
+            if blockhash in stop:
+                break
+            blockhash = entry[0]
+            entry = self.headerIndex.get(blockhash)
+        return hashes
+
     def headers_for(self, locator, hash_stop, current_tip=None):
         if current_tip is None:
             current_tip = self.currentBlock
-        current_block = self.get(current_tip)
-        if current_block is None:
+        if current_tip not in self.headerIndex:
             return None
 
         response = msg_headers()
-        headersList = [ CBlockHeader(current_block) ]
+        # Walk back to the first block in the locator, which is included
+        hashList = self.ancestors(current_tip, set(locator.vHave))
+        hashList.reverse()
         maxheaders = 2000
-        while (headersList[0].sha256 not in locator.vHave):
-            prevBlockHash = headersList[0].hashPrevBlock
-            prevBlock = self.get(prevBlockHash)
-            if prevBlock is not None:
-                headersList.insert(0, CBlockHeader(prevBlock))
-            else:
-                break
-        headersList = headersList[:maxheaders] # truncate if we have too many
-        hashList = [x.sha256 for x in headersList]
-        index = len(headersList)
+        hashList = hashList[:maxheaders] # truncate if we have too many
+        index = len(hashList)
         if (hash_stop in hashList):
             index = hashList.index(hash_stop)+1
-        response.headers = headersList[:index]
+        response.headers = [self.get_header(h) for h in hashList[:index]]
         return response
 
     def add_block(self, block):
         block.calc_sha256()
+        header = CBlockHeader.serialize(block)
         try:
             self.blockDB[repr(block.sha256)] = bytes(block.serialize())
+            self.headerDB[repr(block.sha256)] = header
         except TypeError as e:
             print "Unexpected error: ", sys.exc_info()[0], e.args
+            # Don't advertise a block that get() cannot return
+            return
+        self.headerIndex[block.sha256] = (uint256_from_str(header[4:36]), header)
         self.currentBlock = block.sha256
 
     def get_blocks(self, inv):
@@ -80,13 +111,11 @@ class BlockStore(object):
         r = []
         counter = 0
         step = 1
-        lastBlock = self.get(current_tip)
-        while lastBlock is not None:
-            r.append(lastBlock.hashPrevBlock)
-            for i in range(step):
-                lastBlock = self.get(lastBlock.hashPrevBlock)
-                if lastBlock is None:
-                    break
+        chain = self.ancestors(current_tip)
+        depth = 0
+        while depth < len(chain):
+            r.append(self.headerIndex[chain[depth]][0])
+            depth += step
             counter += 1
             if counter > 10:
                 step *= 2
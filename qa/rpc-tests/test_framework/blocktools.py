@@ -40,6 +40,13 @@ def serialize_script_num(value):
         r[-1] |= 0x80
     return r
 
+# The founders' reward script at every regtest height
+FOUNDERS_REWARD_SCRIPT = CScript([OP_HASH160,
+    bytearray([0x67, 0x08, 0xe6, 0x67, 0x0d, 0xb0, 0xb9, 0x50,
+               0xda, 0xc6, 0x80, 0x31, 0x02, 0x5c, 0xc5, 0xb6,
+               0x32, 0x13, 0xa4, 0x91]),
+    OP_EQUAL])
+
 counter=1
 # Create an anyone-can-spend coinbase transaction, assuming no miner fees
 def create_coinbase(heightAdjust = 0):
@@ -57,11 +64,29 @@ def create_coinbase(heightAdjust = 0):
     if halvings == 0: # regtest
         froutput = CTxOut()
         froutput.nValue = coinbaseoutput.nValue / 5
-        # regtest
-        fraddr = bytearray([0x67, 0x08, 0xe6, 0x67, 0x0d, 0xb0, 0xb9, 0x50,
-                            0xda, 0xc6, 0x80, 0x31, 0x02, 0x5c, 0xc5, 0xb6,
-                            0x32, 0x13, 0xa4, 0x91])
-        froutput.scriptPubKey = CScript([OP_HASH160, fraddr, OP_EQUAL])
+        froutput.scriptPubKey = FOUNDERS_REWARD_SCRIPT
+        coinbaseoutput.nValue -= froutput.nValue
+        coinbase.vout = [ coinbaseoutput, froutput ]
+    coinbase.calc_sha256()
+    return coinbase
+
+# Create the coinbase transaction that a regtest node mining the block at
+# height would, paying the block subsidy, less the founders' reward, to
+# scriptPubKey, assuming no miner fees
+def create_miner_coinbase(height, scriptPubKey):
+    coinbase = CTransaction()
+    coinbase.vin.append(CTxIn(COutPoint(0, 0xffffffff),
+                CScript([height, OP_0]), 0xffffffff))
+    coinbaseoutput = CTxOut()
+    coinbaseoutput.nValue = int(12.5*100000000)
+    halvings = int(height/150) # regtest
+    coinbaseoutput.nValue >>= halvings
+    coinbaseoutput.scriptPubKey = scriptPubKey
+    coinbase.vout = [ coinbaseoutput ]
+    if halvings == 0: # regtest
+        froutput = CTxOut()
+        froutput.nValue = coinbaseoutput.nValue / 5
+        froutput.scriptPubKey = FOUNDERS_REWARD_SCRIPT
         coinbaseoutput.nValue -= froutput.nValue
         coinbase.vout = [ coinbaseoutput, froutput ]
     coinbase.calc_sha256()
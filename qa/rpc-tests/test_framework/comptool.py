@@ -5,7 +5,8 @@
 #
 
 from mininode import CBlock, CTransaction, CInv, NodeConn, NodeConnCB, \
-    msg_inv, msg_getheaders, msg_ping, msg_mempool, mininode_lock, MAX_INV_SZ
+    msg_inv, msg_getheaders, msg_ping, msg_mempool, mininode_lock, \
+    mininode_event, MAX_INV_SZ
 from blockstore import BlockStore, TxStore
 from util import p2p_port
 
@@ -28,19 +29,22 @@ generator that returns TestInstance objects.  See below for definition.
 # on_getheaders: provide headers via BlockStore
 # on_getdata: provide blocks via BlockStore
 
+# Returns True once predicate() holds, or False if it still does not after
+# timeout seconds. The predicate is checked with mininode_lock held, and is
+# re-checked whenever a message is delivered or a connection closes, rather
+# than at fixed intervals. attempts is deprecated: it is the number of 50ms
+# polls this used to make, and limits the wait to 0.05*attempts seconds.
 def wait_until(predicate, attempts=float('inf'), timeout=float('inf')):
-    attempt = 0
-    elapsed = 0
-
-    while attempt < attempts and elapsed < timeout:
-        with mininode_lock:
-            if predicate():
-                return True
-        attempt += 1
-        elapsed += 0.05
-        time.sleep(0.05)
-
-    return False
+    deadline = time.time() + min(timeout, 0.05 * attempts)
+    with mininode_lock:
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            # An untimed wait cannot be interrupted with Ctrl-C in Python 2,
+            # so wake up at least once a second
+            mininode_event.wait(min(remaining, 1.0))
+        return True
 
 class TestNode(NodeConnCB):
 
@@ -192,7 +196,7 @@ class TestManager(object):
             )
 
         # --> error if not requested
-        if not wait_until(blocks_requested, attempts=20*num_blocks):
+        if not wait_until(blocks_requested, timeout=num_blocks):
             # print [ c.cb.block_request_map for c in self.connections ]
             raise AssertionError("Not all nodes requested block")
         # --> Answer request (we did this inline!)
@@ -207,7 +211,7 @@ class TestManager(object):
 
     # Analogous to sync_block (see above)
     def sync_transaction(self, txhash, num_events):
-        # Wait for nodes to request transaction (50ms sleep * 20 tries * num_events)
+        # Wait for nodes to request transaction (up to a second per event)
         def transaction_requested():
             return all(
                 txhash in node.tx_request_map and node.tx_request_map[txhash]
@@ -215,7 +219,7 @@ class TestManager(object):
             )
 
         # --> error if not requested
-        if not wait_until(transaction_requested, attempts=20*num_events):
+        if not wait_until(transaction_requested, timeout=num_events):
             # print [ c.cb.tx_request_map for c in self.connections ]
             raise AssertionError("Not all nodes requested transaction")
         # --> Answer request (we did this inline!)
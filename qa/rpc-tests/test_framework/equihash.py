@@ -1,5 +1,16 @@
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
 from operator import itemgetter
+import multiprocessing
 import struct
+import threading
+
+from pyblake2 import blake2b
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 DEBUG = False
 VERBOSE = False
@@ -8,8 +19,7 @@ VERBOSE = False
 word_size = 32
 word_mask = (1<<word_size)-1
 
-def expand_array(inp, out_len, bit_len, byte_pad=0):
-    assert bit_len >= 8 and word_size >= 7+bit_len
+def _expand_array_loop(inp, out_len, bit_len, byte_pad=0):
     bit_len_mask = (1<<bit_len)-1
 
     out_width = (bit_len+7)/8 + byte_pad
@@ -44,9 +54,7 @@ def expand_array(inp, out_len, bit_len, byte_pad=0):
 
     return out
 
-def compress_array(inp, out_len, bit_len, byte_pad=0):
-    assert bit_len >= 8 and word_size >= 7+bit_len
-
+def _compress_array_loop(inp, out_len, bit_len, byte_pad=0):
     in_width = (bit_len+7)/8 + byte_pad
     assert out_len == bit_len*len(inp)/(8*in_width)
     out = bytearray(out_len)
@@ -78,13 +86,132 @@ def compress_array(inp, out_len, bit_len, byte_pad=0):
 
     return out
 
+# Bit widths with table-driven codecs. These cover every collision length
+# (8-21 bits) and index width (9-22 bits) used by Zcash parameter sets.
+FAST_BIT_LENS = range(8, 23)
+
+_codec_tables = {}
+
+def _codec_table(bit_len):
+    # Bits are processed in groups that hold a whole number of bytes and a
+    # whole number of elements (a multiple of lcm(8, bit_len) bits), large
+    # enough to amortise the conversion to an integer. Returns the group
+    # length in bytes, and the shift of each element within a group.
+    table = _codec_tables.get(bit_len)
+    if table is None:
+        group_bits = bit_len
+        while group_bits % 8 or group_bits < 256:
+            group_bits += bit_len
+        shifts = range(group_bits - bit_len, -1, -bit_len)
+        table = _codec_tables[bit_len] = (group_bits/8, shifts)
+    return table
+
+def _pack_elements(values, width):
+    # Big-endian packing of each value into width <= 4 bytes.
+    if width == 1:
+        return bytearray(values)
+    if width == 2:
+        return bytearray(struct.pack('>%dH' % len(values), *values))
+    out = bytearray(struct.pack('>%dI' % len(values), *values))
+    if width == 3:
+        del out[::4]
+    return out
+
+def _unpack_elements(inp, num, width):
+    # Inverse of _pack_elements for the first num elements of inp.
+    if width == 1:
+        return list(inp[:num])
+    if width == 2:
+        return struct.unpack('>%dH' % num, bytes(inp[:2*num]))
+    words = bytearray(4*num)
+    for b in range(width):
+        words[4-width+b::4] = inp[b:width*num:width]
+    return struct.unpack('>%dI' % num, bytes(words))
+
+def _expand_array_table(inp, out_len, bit_len, byte_pad):
+    out_width = (bit_len+7)/8 + byte_pad
+    num = 8*len(inp)/bit_len
+    if bit_len % 8 == 0:
+        values = _unpack_elements(inp, num, bit_len/8)
+    else:
+        group_len, shifts = _codec_table(bit_len)
+        mask = (1 << bit_len) - 1
+        padded = bytes(inp) + b'\x00'*(-len(inp) % group_len)
+        values = []
+        for i in xrange(0, len(padded), group_len):
+            acc = int(hexlify(padded[i:i+group_len]), 16)
+            values.extend([(acc >> shift) & mask for shift in shifts])
+        values = values[:num]
+    out = bytearray(out_len)
+    out[:num*out_width] = _pack_elements(values, out_width)
+    return out
+
+def _compress_array_table(inp, out_len, bit_len, byte_pad):
+    in_width = (bit_len+7)/8 + byte_pad
+    mask = (1 << bit_len) - 1
+    num = len(inp)/in_width
+    values = [v & mask for v in _unpack_elements(inp, num, in_width)]
+    if bit_len % 8 == 0:
+        return _pack_elements(values, bit_len/8)[:out_len]
+    group_len, shifts = _codec_table(bit_len)
+    values.extend([0] * (-num % len(shifts)))
+    out = []
+    for i in xrange(0, len(values), len(shifts)):
+        acc = 0
+        for value, shift in zip(values[i:i+len(shifts)], shifts):
+            acc |= value << shift
+        out.append('%0*x' % (2*group_len, acc))
+    return bytearray(unhexlify(''.join(out))[:out_len])
+
+def _expand_array_numpy(inp, out_len, bit_len, byte_pad):
+    out_width = (bit_len+7)/8 + byte_pad
+    num = 8*len(inp)/bit_len
+    bits = np.unpackbits(np.frombuffer(bytes(inp), dtype=np.uint8))
+    out_bits = np.zeros((num, 8*out_width), dtype=np.uint8)
+    out_bits[:, 8*out_width-bit_len:] = bits[:num*bit_len].reshape(num, bit_len)
+    out = bytearray(out_len)
+    out[:num*out_width] = np.packbits(out_bits).tostring()
+    return out
+
+def _compress_array_numpy(inp, out_len, bit_len, byte_pad):
+    in_width = (bit_len+7)/8 + byte_pad
+    num = len(inp)/in_width
+    bits = np.unpackbits(np.frombuffer(bytes(inp[:num*in_width]), dtype=np.uint8))
+    bits = bits.reshape(num, 8*in_width)[:, 8*in_width-bit_len:]
+    return bytearray(np.packbits(bits.ravel()).tostring()[:out_len])
+
+def expand_array(inp, out_len, bit_len, byte_pad=0):
+    # Solutions deserialized by mininode are lists of ints
+    inp = bytearray(inp)
+    assert bit_len >= 8 and word_size >= 7+bit_len
+    out_width = (bit_len+7)/8 + byte_pad
+    assert out_len == 8*out_width*len(inp)/bit_len
+    if np is not None:
+        return _expand_array_numpy(inp, out_len, bit_len, byte_pad)
+    if bit_len in FAST_BIT_LENS and out_width <= 4:
+        return _expand_array_table(inp, out_len, bit_len, byte_pad)
+    return _expand_array_loop(inp, out_len, bit_len, byte_pad)
+
+def compress_array(inp, out_len, bit_len, byte_pad=0):
+    # Solutions deserialized by mininode are lists of ints
+    inp = bytearray(inp)
+    assert bit_len >= 8 and word_size >= 7+bit_len
+    in_width = (bit_len+7)/8 + byte_pad
+    assert out_len == bit_len*len(inp)/(8*in_width)
+    if np is not None:
+        return _compress_array_numpy(inp, out_len, bit_len, byte_pad)
+    if bit_len in FAST_BIT_LENS and in_width <= 4:
+        return _compress_array_table(inp, out_len, bit_len, byte_pad)
+    return _compress_array_loop(inp, out_len, bit_len, byte_pad)
+
 def get_indices_from_minimal(minimal, bit_len):
     eh_index_size = 4
     assert (bit_len+7)/8 <= eh_index_size
     len_indices = 8*eh_index_size*len(minimal)/bit_len
     byte_pad = eh_index_size - (bit_len+7)/8
     expanded = expand_array(minimal, len_indices, bit_len, byte_pad)
-    return [struct.unpack('>I', expanded[i:i+4])[0] for i in range(0, len_indices, eh_index_size)]
+    num_indices = len_indices/eh_index_size
+    return list(struct.unpack('>%dI' % num_indices, bytes(expanded[:num_indices*eh_index_size])))
 
 def get_minimal_from_indices(indices, bit_len):
     eh_index_size = 4
@@ -92,7 +219,7 @@ def get_minimal_from_indices(indices, bit_len):
     len_indices = len(indices)*eh_index_size
     min_len = bit_len*len_indices/(8*eh_index_size)
     byte_pad = eh_index_size - (bit_len+7)/8
-    byte_indices = bytearray(''.join([struct.pack('>I', i) for i in indices]))
+    byte_indices = bytearray(struct.pack('>%dI' % len(indices), *indices))
     return compress_array(byte_indices, min_len, bit_len, byte_pad)
 
 
@@ -114,42 +241,107 @@ def count_zeroes(h):
     return (h+'1').index('1')
 
 def has_collision(ha, hb, i, l):
-    res = [ha[j] == hb[j] for j in range((i-1)*l/8, i*l/8)]
-    return reduce(lambda x, y: x and y, res)
+    return ha[(i-1)*l/8:i*l/8] == hb[(i-1)*l/8:i*l/8]
 
 def distinct_indices(a, b):
-    for i in a:
-        for j in b:
-            if i == j:
-                return False
-    return True
+    return set(a).isdisjoint(b)
 
 def xor(ha, hb):
     return bytearray(a^b for a,b in zip(ha,hb))
 
-def gbp_basic(digest, n, k):
-    '''Implementation of Basic Wagner's algorithm for the GBP.'''
+class IndexHashTable(object):
+    '''LRU cache of the expanded first-round rows X_i = H(I||V||x_i).
+
+    Tables are keyed on (n, k) and the state of the I||V digest, and hold all
+    2^(n/(k+1)+1) rows back to back, each hash_length bytes long. Solvers
+    build a table for every nonce they try, but only put it in the cache
+    once that nonce has produced a solution, so that validating the
+    solution straight afterwards does not hash the indices again. At most
+    max_entries tables are kept.
+    '''
+
+    def __init__(self, max_entries=2):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, digest, n, k):
+        # digest() does not modify the state, and identifies it uniquely
+        return (n, k, digest.digest())
+
+    def lookup(self, digest, n, k):
+        '''Returns the cached table for this digest, or None.'''
+        key = self._key(digest, n, k)
+        with self._lock:
+            table = self._tables.pop(key, None)
+            if table is None:
+                return None
+            self._tables[key] = table
+            self.hits += 1
+            return table
+
+    def get(self, digest, n, k):
+        '''Returns the table for this digest, building it without caching
+        it if necessary.'''
+        table = self.lookup(digest, n, k)
+        if table is not None:
+            return table
+        with self._lock:
+            self.misses += 1
+        return self._build(digest, n, k)
+
+    def put(self, digest, n, k, table):
+        '''Caches the table for this digest, evicting the least recently
+        used table if the cache is full.'''
+        key = self._key(digest, n, k)
+        with self._lock:
+            self._tables.pop(key, None)
+            self._tables[key] = table
+            while len(self._tables) > self.max_entries:
+                self._tables.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+    def _build(self, digest, n, k):
+        collision_length = n/(k+1)
+        hash_length = (k+1)*((collision_length+7)//8)
+        indices_per_hash_output = 512/n
+        num_rows = 2**(collision_length+1)
+        hashes = []
+        for g in range((num_rows + indices_per_hash_output - 1)/indices_per_hash_output):
+            # X_i = H(I||V||x_i)
+            curr_digest = digest.copy()
+            hash_xi(curr_digest, g)
+            hashes.append(curr_digest.digest())
+        # Each index takes n bits of the concatenated hash outputs, which
+        # expand to (k+1) chunks of collision_length bits.
+        return expand_array(bytearray(b''.join(hashes)[:num_rows*n/8]),
+                            num_rows*hash_length, collision_length)
+
+# Shared by the solvers and the validator
+index_hash_table = IndexHashTable()
+
+def gbp_basic_iter(digest, n, k):
+    '''Implementation of Basic Wagner's algorithm for the GBP.
+
+    Yields minimal solutions in the same order as gbp_basic returns them.
+    The final round yields each solution as soon as the set of rows it was
+    found in has been checked, so callers can stop at the first acceptable
+    one without checking the remaining sets.
+    '''
     validate_params(n, k)
     collision_length = n/(k+1)
     hash_length = (k+1)*((collision_length+7)//8)
-    indices_per_hash_output = 512/n
 
     # 1) Generate first list
     if DEBUG: print 'Generating first list'
-    X = []
-    tmp_hash = ''
-    for i in range(0, 2**(collision_length+1)):
-        r = i % indices_per_hash_output
-        if r == 0:
-            # X_i = H(I||V||x_i)
-            curr_digest = digest.copy()
-            hash_xi(curr_digest, i/indices_per_hash_output)
-            tmp_hash = curr_digest.digest()
-        X.append((
-            expand_array(bytearray(tmp_hash[r*n/8:(r+1)*n/8]),
-                         hash_length, collision_length),
-            (i,)
-        ))
+    table = index_hash_table.get(digest, n, k)
+    X = [(table[i*hash_length:(i+1)*hash_length], (i,))
+         for i in range(2**(collision_length+1))]
 
     # 3) Repeat step 2 until 2n/(k+1) bits remain
     for i in range(1, k):
@@ -184,9 +376,7 @@ def gbp_basic(digest, n, k):
                         Xc.append((xor(X[-1-l][0], X[-1-m][0]), concat))
 
             # 2d) Drop this set
-            while j > 0:
-                X.pop(-1)
-                j -= 1
+            del X[-j:]
         # 2e) Replace previous list with new list
         X = Xc
 
@@ -199,7 +389,6 @@ def gbp_basic(digest, n, k):
         for Xi in X[-32:]:
             print '%s %s' % (print_hash(Xi[0]), Xi[1])
     if DEBUG: print '- Finding collisions'
-    solns = []
     while len(X) > 0:
         j = 1
         while j < len(X):
@@ -208,6 +397,7 @@ def gbp_basic(digest, n, k):
                 break
             j += 1
 
+        solns = []
         for l in range(0, j-1):
             for m in range(l+1, j):
                 res = xor(X[-1-l][0], X[-1-m][0])
@@ -222,61 +412,326 @@ def gbp_basic(digest, n, k):
                         solns.append(list(X[-1-m][1] + X[-1-l][1]))
 
         # 2d) Drop this set
-        while j > 0:
-            X.pop(-1)
-            j -= 1
-    return [get_minimal_from_indices(soln, collision_length+1) for soln in solns]
+        del X[-j:]
 
-def gbp_validate(digest, minimal, n, k):
+        if solns:
+            # Keep the rows for validating the solutions
+            index_hash_table.put(digest, n, k, table)
+        for soln in solns:
+            yield get_minimal_from_indices(soln, collision_length+1)
+
+def gbp_basic(digest, n, k):
+    '''Implementation of Basic Wagner's algorithm for the GBP.'''
+    return list(gbp_basic_iter(digest, n, k))
+
+def _np_sort_order(H, first_col, collision_length):
+    # Stable sort on columns first_col.. of H, which compares rows the same
+    # way as sorting the expanded hashes. Columns are packed big-endian into
+    # as few uint64 sort keys as possible.
+    per_word = 64 // collision_length
+    keys = []
+    for c in range(first_col, H.shape[1], per_word):
+        key = np.zeros(H.shape[0], dtype=np.uint64)
+        for col in range(c, min(c+per_word, H.shape[1])):
+            key = (key << np.uint64(collision_length)) | H[:, col]
+        keys.append(key)
+    if len(keys) == 1:
+        return np.argsort(keys[0], kind='mergesort')
+    # lexsort uses the last key as the primary key
+    return np.lexsort(keys[::-1])
+
+def _np_collision_pairs(keys):
+    # Returns the (A, B) row pairs within each run of equal keys, in the order
+    # gbp_basic visits them: runs from last to first, and within a run each
+    # (l, m) pair counting backwards from the end of the run.
+    empty = np.zeros(0, dtype=np.intp)
+    if len(keys) < 2:
+        return empty, empty
+    starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    sizes = np.diff(np.append(starts, len(keys)))
+    A, B, group, pos = [], [], [], []
+    for s in np.unique(sizes[sizes > 1]):
+        gids = np.flatnonzero(sizes == s)
+        ls, ms = np.triu_indices(s, 1)
+        A.append((starts[gids][:, None] + (s-1-ls)).ravel())
+        B.append((starts[gids][:, None] + (s-1-ms)).ravel())
+        group.append(np.repeat(gids, len(ls)))
+        pos.append(np.tile(np.arange(len(ls)), len(gids)))
+    if not A:
+        return empty, empty
+    A, B = np.concatenate(A), np.concatenate(B)
+    order = np.lexsort((np.concatenate(pos), -np.concatenate(group)))
+    return A[order], B[order]
+
+def _np_join(H, I, A, B):
+    # Combine row pairs (A, B), dropping pairs that share an index and
+    # ordering each index tree by its first index.
+    IA, IB = I[A], I[B]
+    joined = np.hstack((IA, IB))
+    distinct = (np.diff(np.sort(joined, axis=1), axis=1) != 0).all(axis=1)
+    swap = IB[:, 0] < IA[:, 0]
+    joined[swap] = np.hstack((IB[swap], IA[swap]))
+    return (H[A] ^ H[B])[distinct], joined[distinct]
+
+def gbp_numpy(digest, n, k):
+    '''Vectorized implementation of Basic Wagner's algorithm for the GBP.
+
+    Yields the same minimal solutions, in the same order, as gbp_basic_iter.
+    Rows are held in two NumPy arrays: H has one column per collision
+    chunk of the hash, and I holds the index tree of each row. The final
+    round finds every colliding pair at once, but checks and encodes them
+    one at a time as they are consumed.
+    '''
+    if np is None:
+        raise ImportError('gbp_numpy requires NumPy')
     validate_params(n, k)
     collision_length = n/(k+1)
+    num_rows = 2**(collision_length+1)
+
+    # 1) Generate first list
+    rows = index_hash_table.get(digest, n, k)
+    table = np.frombuffer(rows, dtype=np.uint8)
+    table = table.reshape(num_rows, k+1, -1).astype(np.uint32)
+    H = np.zeros((num_rows, k+1), dtype=np.uint32)
+    for b in range(table.shape[2]):
+        H = (H << np.uint32(8)) | table[:, :, b]
+    I = np.arange(num_rows, dtype=np.uint32).reshape(num_rows, 1)
+
+    # 2) Find collisions on each chunk in turn
+    for i in range(1, k):
+        order = _np_sort_order(H, i-1, collision_length)
+        H, I = H[order], I[order]
+        A, B = _np_collision_pairs(H[:, i-1])
+        H, I = _np_join(H, I, A, B)
+
+    # k+1) Find a collision on the last two chunks
+    order = _np_sort_order(H, k-1, collision_length)
+    H, I = H[order], I[order]
+    keys = (H[:, k-1].astype(np.uint64) << np.uint64(collision_length)) | H[:, k]
+    A, B = _np_collision_pairs(keys)
+    zero = (H[A] == H[B]).all(axis=1)
+    kept = False
+    for a, b in zip(A[zero].tolist(), B[zero].tolist()):
+        left, right = I[a].tolist(), I[b].tolist()
+        if not distinct_indices(left, right):
+            continue
+        if right[0] < left[0]:
+            left, right = right, left
+        if not kept:
+            # Keep the rows for validating the solutions
+            index_hash_table.put(digest, n, k, rows)
+            kept = True
+        yield get_minimal_from_indices(left + right, collision_length+1)
+
+# The fastest solver backend available in this environment. Both backends
+# are generators, so callers can stop at the first acceptable solution.
+gbp_default = gbp_numpy if np is not None else gbp_basic_iter
+
+def _batch_indices(minimals, n, k):
+    # Expands the minimal encodings of a batch of solutions, which all have
+    # the expected length, into one list of indices per solution.
+    collision_length = n/(k+1)
+    num_indices = 1 << k
+    expanded = get_indices_from_minimal(bytearray().join(minimals), collision_length+1)
+    return [expanded[j*num_indices:(j+1)*num_indices] for j in range(len(minimals))]
+
+def _batch_rows(digests, indices, n, k):
+    # Expands H(I||V||x_i) for the indices of each solution in a batch, and
+    # returns the rows of each solution back to back. Rows come from the
+    # shared table if the solver has already built it for that digest.
+    # Otherwise each BLAKE2b output block is hashed once per batch, and the
+    # rows of every such solution are expanded in a single pass.
+    collision_length = n/(k+1)
     hash_length = (k+1)*((collision_length+7)//8)
     indices_per_hash_output = 512/n
-    solution_width = (1 << k)*(collision_length+1)//8
-
-    if len(minimal) != solution_width:
-        print 'Invalid solution length: %d (expected %d)' % \
-            (len(minimal), solution_width)
-        return False
-
-    X = []
-    for i in get_indices_from_minimal(minimal, collision_length+1):
-        r = i % indices_per_hash_output
-        # X_i = H(I||V||x_i)
-        curr_digest = digest.copy()
-        hash_xi(curr_digest, i/indices_per_hash_output)
-        tmp_hash = curr_digest.digest()
-        X.append((
-            expand_array(bytearray(tmp_hash[r*n/8:(r+1)*n/8]),
-                         hash_length, collision_length),
-            (i,)
-        ))
+    rows = [None]*len(digests)
+    outputs = {}
+    packed = []
+    missing = []
+    for j, (digest, solution) in enumerate(zip(digests, indices)):
+        table = index_hash_table.lookup(digest, n, k)
+        if table is not None:
+            rows[j] = bytearray().join(table[i*hash_length:(i+1)*hash_length]
+                                       for i in solution)
+            continue
+        state = digest.digest()
+        for i in solution:
+            g = i/indices_per_hash_output
+            output = outputs.get((state, g))
+            if output is None:
+                # X_i = H(I||V||x_i)
+                curr_digest = digest.copy()
+                hash_xi(curr_digest, g)
+                output = outputs[(state, g)] = curr_digest.digest()
+            r = i % indices_per_hash_output
+            packed.append(output[r*n/8:(r+1)*n/8])
+        missing.append(j)
+    if missing:
+        size = hash_length*len(indices[missing[0]])
+        expanded = expand_array(bytearray(b''.join(packed)),
+                                size*len(missing), collision_length)
+        for m, j in enumerate(missing):
+            rows[j] = expanded[m*size:(m+1)*size]
+    return rows
+
+def _gbp_check_rows(rows, indices, n, k):
+    # Returns None if the index rows of a solution form a valid solution, or
+    # the reason they do not.
+    collision_length = n/(k+1)
+    hash_length = (k+1)*((collision_length+7)//8)
+    X = [(rows[j*hash_length:(j+1)*hash_length], (i,)) for j, i in enumerate(indices)]
 
     for r in range(1, k+1):
         Xc = []
         for i in range(0, len(X), 2):
             if not has_collision(X[i][0], X[i+1][0], r, collision_length):
-                print 'Invalid solution: invalid collision length between StepRows'
-                return False
+                return 'Invalid solution: invalid collision length between StepRows'
             if X[i+1][1][0] < X[i][1][0]:
-                print 'Invalid solution: Index tree incorrectly ordered'
-                return False
+                return 'Invalid solution: Index tree incorrectly ordered'
             if not distinct_indices(X[i][1], X[i+1][1]):
-                print 'Invalid solution: duplicate indices'
-                return False
+                return 'Invalid solution: duplicate indices'
             Xc.append((xor(X[i][0], X[i+1][0]), X[i][1] + X[i+1][1]))
         X = Xc
 
     if len(X) != 1:
-        print 'Invalid solution: incorrect length after end of rounds: %d' % len(X)
-        return False
+        return 'Invalid solution: incorrect length after end of rounds: %d' % len(X)
 
     if count_zeroes(X[0][0]) != 8*hash_length:
-        print 'Invalid solution: incorrect number of zeroes: %d' % count_zeroes(X[0][0])
-        return False
+        return 'Invalid solution: incorrect number of zeroes: %d' % count_zeroes(X[0][0])
+
+    return None
+
+def _np_batch_failures(rows, indices, n, k):
+    # Runs the checks of _gbp_check_rows on a whole batch at once, and
+    # returns a boolean array marking the solutions that fail any of them.
+    # Collision chunks must be whole bytes, so that comparing chunks is the
+    # same as comparing the bytes has_collision looks at.
+    collision_length = n/(k+1)
+    chunk_bytes = collision_length/8
+    num = len(rows)
+    table = np.frombuffer(bytes(bytearray().join(rows)), dtype=np.uint8)
+    table = table.reshape(num, 1 << k, k+1, chunk_bytes).astype(np.uint32)
+    H = np.zeros((num, 1 << k, k+1), dtype=np.uint32)
+    for b in range(chunk_bytes):
+        H = (H << np.uint32(8)) | table[:, :, :, b]
+    I = np.array(indices, dtype=np.uint32).reshape(num, 1 << k, 1)
+    failed = np.zeros(num, dtype=bool)
+    for r in range(1, k+1):
+        HL, HR = H[:, 0::2], H[:, 1::2]
+        IL, IR = I[:, 0::2], I[:, 1::2]
+        joined = np.concatenate((IL, IR), axis=2)
+        # Duplicates within either half were caught in an earlier round
+        duplicate = (np.diff(np.sort(joined, axis=2), axis=2) == 0).any(axis=2)
+        failed |= ((HL[:, :, r-1] != HR[:, :, r-1]) |
+                   (IR[:, :, 0] < IL[:, :, 0]) |
+                   duplicate).any(axis=1)
+        H, I = HL ^ HR, joined
+    failed |= (H[:, 0, :] != 0).any(axis=1)
+    return failed
+
+def _gbp_check_batch(digests, minimals, n, k):
+    # Returns, for each solution, None if it is valid or the reason it is
+    # invalid.
+    validate_params(n, k)
+    collision_length = n/(k+1)
+    solution_width = (1 << k)*(collision_length+1)//8
 
+    reasons = [None]*len(digests)
+    todo = []
+    for j, minimal in enumerate(minimals):
+        if len(minimal) != solution_width:
+            reasons[j] = 'Invalid solution length: %d (expected %d)' % \
+                (len(minimal), solution_width)
+        else:
+            todo.append(j)
+    if not todo:
+        return reasons
+
+    indices = _batch_indices([bytearray(minimals[j]) for j in todo], n, k)
+    rows = _batch_rows([digests[j] for j in todo], indices, n, k)
+    if np is not None and collision_length % 8 == 0 and len(todo) > 1:
+        # Only the solutions that fail are checked again, for the reason
+        failed = _np_batch_failures(rows, indices, n, k)
+        checks = np.flatnonzero(failed)
+    else:
+        checks = range(len(todo))
+    for m in checks:
+        reasons[todo[m]] = _gbp_check_rows(rows[m], indices[m], n, k)
+    return reasons
+
+def _gbp_check(digest, minimal, n, k):
+    # Returns None if the solution is valid, or the reason it is invalid.
+    return _gbp_check_batch([digest], [minimal], n, k)[0]
+
+def gbp_validate(digest, minimal, n, k):
+    reason = _gbp_check(digest, minimal, n, k)
+    if reason is not None:
+        print reason
+        return False
     return True
 
+def header_digest(header, n, k):
+    '''Returns the BLAKE2b state after absorbing I||V, which are the first
+    140 bytes of a serialized block header.'''
+    digest = blake2b(digest_size=(512/n)*n/8, person=zcash_person(n, k))
+    digest.update(bytes(header[:140]))
+    return digest
+
+def _batch_digests(headers, n, k):
+    # Like header_digest for each header given as bytes, but I is absorbed
+    # only once for all of the headers that share it and differ only in V.
+    prefixes = {}
+    digests = []
+    for header in headers:
+        if isinstance(header, (bytes, bytearray)):
+            header = bytes(header[:140])
+            prefix = prefixes.get(header[:108])
+            if prefix is None:
+                prefix = blake2b(digest_size=(512/n)*n/8, person=zcash_person(n, k))
+                prefix.update(header[:108])
+                prefixes[header[:108]] = prefix
+            digest = prefix.copy()
+            digest.update(header[108:])
+            header = digest
+        digests.append(header)
+    return digests
+
+def _gbp_check_chunk(args):
+    headers, n, k = args
+    return _gbp_check_batch(_batch_digests([h for (h, _) in headers], n, k),
+                            [s for (_, s) in headers], n, k)
+
+def gbp_validate_many(headers, n, k, pool=None, workers=None):
+    '''Validates a batch of (header, solution) pairs.
+
+    Each header is either the first 140 bytes of a serialized block header
+    or a BLAKE2b digest that has already absorbed them (see header_digest).
+    Returns a list of (valid, reason) tuples in the same order as headers,
+    where reason is None for valid solutions.
+
+    The whole batch shares one pass over the BLAKE2b outputs and one
+    expansion of the index rows, and with NumPy the rounds are checked for
+    all solutions at once. If a multiprocessing pool is given, owned by the
+    caller, the batch is split into one chunk per worker and the chunks are
+    checked in the pool. workers is the number of processes in the pool,
+    and is read from the pool if not given. Digests cannot be sent to other
+    processes, so in that case the headers must be given as bytes.
+    '''
+    validate_params(n, k)
+    headers = list(headers)
+    if pool is not None and len(headers) > 1:
+        for (header, _) in headers:
+            if not isinstance(header, (bytes, bytearray)):
+                raise TypeError('headers must be bytes when using a process pool')
+        if workers is None:
+            workers = getattr(pool, '_processes', None) or multiprocessing.cpu_count()
+        size = -(-len(headers) // workers)
+        chunks = [(headers[i:i+size], n, k) for i in range(0, len(headers), size)]
+        reasons = sum(pool.map(_gbp_check_chunk, chunks), [])
+    else:
+        reasons = _gbp_check_chunk((headers, n, k))
+    return [(reason is None, reason) for reason in reasons]
+
 def zcash_person(n, k):
     return b'ZcashPoW' + struct.pack('<II', n, k)
 
@@ -22,22 +22,29 @@ import socket
 import asyncore
 import binascii
 import time
+import atexit
 import sys
 import random
 import cStringIO
+import errno
+import fcntl
 import hashlib
+import multiprocessing
+import os
+from threading import Condition
 from threading import RLock
 from threading import Thread
 import logging
-import copy
+from collections import deque
 from pyblake2 import blake2b
 
 from .equihash import (
-    gbp_basic,
+    gbp_default,
     gbp_validate,
     hash_nonce,
     zcash_person,
 )
+from .solutioncache import default_solution_cache
 
 BIP0031_VERSION = 60000
 MY_VERSION = 170002  # past bip-31 for ping/pong
@@ -52,6 +59,8 @@ COIN = 100000000 # 1 zec in zatoshis
 # ourselves (to workaround an issue with closing an asyncore socket when
 # using select)
 mininode_socket_map = dict()
+# NetworkWaker for the networking thread, created below
+mininode_waker = None
 
 # One lock for synchronizing all data access between the networking thread (see
 # NetworkThread below) and the thread running the test logic.  For simplicity,
@@ -61,6 +70,18 @@ mininode_socket_map = dict()
 # access to any data shared with the NodeConnCB or NodeConn.
 mininode_lock = RLock()
 
+# Notified, with mininode_lock held, after each message is delivered to a
+# NodeConnCB and after each connection closes, so that the test logic can
+# wait for a condition on callback state instead of polling it.
+mininode_event = Condition(mininode_lock)
+
+def notify_waiters():
+    with mininode_lock:
+        mininode_event.notify_all()
+
+# Passed as CBlock.solve's cache argument to use default_solution_cache()
+DEFAULT_SOLUTION_CACHE = object()
+
 # Serialization/deserialization tools
 def sha256(s):
     return hashlib.new('sha256', s).digest()
@@ -70,49 +91,89 @@ def hash256(s):
     return sha256(sha256(s))
 
 
-def deser_string(f):
-    nit = struct.unpack("<B", f.read(1))[0]
+# Precompiled formats for fixed-width fields
+struct_uint8 = struct.Struct("<B")
+struct_uint16 = struct.Struct("<H")
+struct_int32 = struct.Struct("<i")
+struct_uint32 = struct.Struct("<I")
+struct_int64 = struct.Struct("<q")
+struct_uint64 = struct.Struct("<Q")
+struct_uint256 = struct.Struct("<4Q")
+
+
+# A bytearray-backed stream that serialize_to() methods write into, so that
+# an object and everything nested in it are serialized into one buffer
+# instead of through a chain of intermediate strings.
+class BytesWriter(object):
+    __slots__ = ("buf", "write")
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.write = self.buf.extend
+
+    def getvalue(self):
+        return str(self.buf)
+
+
+# Base for objects that serialize themselves into a BytesWriter
+class Serializable(object):
+    __slots__ = ()
+
+    def serialize(self):
+        w = BytesWriter()
+        self.serialize_to(w)
+        return w.getvalue()
+
+
+def ser_compact_size(n):
+    if n < 253:
+        return chr(n)
+    elif n < 0x10000:
+        return chr(253) + struct_uint16.pack(n)
+    elif n < 0x100000000L:
+        return chr(254) + struct_uint32.pack(n)
+    return chr(255) + struct_uint64.pack(n)
+
+
+def deser_compact_size(f):
+    nit = ord(f.read(1))
     if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
+        nit = struct_uint16.unpack(f.read(2))[0]
     elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
+        nit = struct_uint32.unpack(f.read(4))[0]
     elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
+        nit = struct_uint64.unpack(f.read(8))[0]
+    return nit
+
+
+def deser_string(f):
+    nit = deser_compact_size(f)
     return f.read(nit)
 
 
 def ser_string(s):
-    if len(s) < 253:
-        return chr(len(s)) + s
-    elif len(s) < 0x10000:
-        return chr(253) + struct.pack("<H", len(s)) + s
-    elif len(s) < 0x100000000L:
-        return chr(254) + struct.pack("<I", len(s)) + s
-    return chr(255) + struct.pack("<Q", len(s)) + s
+    return ser_compact_size(len(s)) + s
+
+
+def ser_string_to(w, s):
+    w.write(ser_compact_size(len(s)))
+    w.write(s)
 
 
 def deser_uint256(f):
-    r = 0L
-    for i in xrange(8):
-        t = struct.unpack("<I", f.read(4))[0]
-        r += t << (i * 32)
-    return r
+    return uint256_from_str(f.read(32))
 
 
 def ser_uint256(u):
-    rs = ""
-    for i in xrange(8):
-        rs += struct.pack("<I", u & 0xFFFFFFFFL)
-        u >>= 32
-    return rs
+    return struct_uint256.pack(u & 0xFFFFFFFFFFFFFFFFL,
+                               (u >> 64) & 0xFFFFFFFFFFFFFFFFL,
+                               (u >> 128) & 0xFFFFFFFFFFFFFFFFL,
+                               (u >> 192) & 0xFFFFFFFFFFFFFFFFL)
 
 
 def uint256_from_str(s):
-    r = 0L
-    t = struct.unpack("<IIIIIIII", s[:32])
-    for i in xrange(8):
-        r += t[i] << (i * 32)
-    return r
+    (a, b, c, d) = struct_uint256.unpack_from(s)
+    return long(a) | (b << 64) | (c << 128) | (d << 192)
 
 
 def uint256_from_compact(c):
@@ -122,13 +183,7 @@ def uint256_from_compact(c):
 
 
 def deser_vector(f, c):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
+    nit = deser_compact_size(f)
     r = []
     for i in xrange(nit):
         t = c()
@@ -138,58 +193,46 @@ def deser_vector(f, c):
 
 
 def ser_vector(l):
-    r = ""
-    if len(l) < 253:
-        r = chr(len(l))
-    elif len(l) < 0x10000:
-        r = chr(253) + struct.pack("<H", len(l))
-    elif len(l) < 0x100000000L:
-        r = chr(254) + struct.pack("<I", len(l))
-    else:
-        r = chr(255) + struct.pack("<Q", len(l))
+    return ser_compact_size(len(l)) + "".join(i.serialize() for i in l)
+
+
+def ser_vector_to(w, l):
+    w.write(ser_compact_size(len(l)))
     for i in l:
-        r += i.serialize()
+        i.serialize_to(w)
+
+
+def read_exactly(f, n):
+    r = f.read(n)
+    if len(r) != n:
+        raise struct.error("expected %d bytes, got %d" % (n, len(r)))
     return r
 
 
+# Decodes the whole vector with one struct.unpack call
 def deser_uint256_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    r = []
-    for i in xrange(nit):
-        t = deser_uint256(f)
-        r.append(t)
-    return r
+    nit = deser_compact_size(f)
+    words = struct.unpack("<%dQ" % (4 * nit), read_exactly(f, 32 * nit))
+    return [long(words[i]) | (words[i+1] << 64) | (words[i+2] << 128) |
+            (words[i+3] << 192) for i in xrange(0, 4 * nit, 4)]
+
+
+# deser_vector(f, CInv), but decoding the whole vector with one struct.unpack
+# call
+def deser_inv_vector(f):
+    nit = deser_compact_size(f)
+    fields = struct.unpack("<" + "i4Q" * nit, read_exactly(f, 36 * nit))
+    return [CInv(fields[i], long(fields[i+1]) | (fields[i+2] << 64) |
+                 (fields[i+3] << 128) | (fields[i+4] << 192))
+            for i in xrange(0, 5 * nit, 5)]
 
 
 def ser_uint256_vector(l):
-    r = ""
-    if len(l) < 253:
-        r = chr(len(l))
-    elif len(l) < 0x10000:
-        r = chr(253) + struct.pack("<H", len(l))
-    elif len(l) < 0x100000000L:
-        r = chr(254) + struct.pack("<I", len(l))
-    else:
-        r = chr(255) + struct.pack("<Q", len(l))
-    for i in l:
-        r += ser_uint256(i)
-    return r
+    return ser_compact_size(len(l)) + "".join(ser_uint256(i) for i in l)
 
 
 def deser_string_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
+    nit = deser_compact_size(f)
     r = []
     for i in xrange(nit):
         t = deser_string(f)
@@ -198,147 +241,124 @@ def deser_string_vector(f):
 
 
 def ser_string_vector(l):
-    r = ""
-    if len(l) < 253:
-        r = chr(len(l))
-    elif len(l) < 0x10000:
-        r = chr(253) + struct.pack("<H", len(l))
-    elif len(l) < 0x100000000L:
-        r = chr(254) + struct.pack("<I", len(l))
-    else:
-        r = chr(255) + struct.pack("<Q", len(l))
+    return ser_compact_size(len(l)) + "".join(ser_string(sv) for sv in l)
+
+
+def ser_string_vector_to(w, l):
+    w.write(ser_compact_size(len(l)))
     for sv in l:
-        r += ser_string(sv)
-    return r
+        ser_string_to(w, sv)
 
 
 def deser_int_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
+    nit = deser_compact_size(f)
     r = []
     for i in xrange(nit):
-        t = struct.unpack("<i", f.read(4))[0]
+        t = struct_int32.unpack(f.read(4))[0]
         r.append(t)
     return r
 
 
 def ser_int_vector(l):
-    r = ""
-    if len(l) < 253:
-        r = chr(len(l))
-    elif len(l) < 0x10000:
-        r = chr(253) + struct.pack("<H", len(l))
-    elif len(l) < 0x100000000L:
-        r = chr(254) + struct.pack("<I", len(l))
-    else:
-        r = chr(255) + struct.pack("<Q", len(l))
+    return ser_compact_size(len(l)) + "".join(struct_int32.pack(i) for i in l)
+
+
+def ser_int_vector_to(w, l):
+    w.write(ser_compact_size(len(l)))
     for i in l:
-        r += struct.pack("<i", i)
-    return r
+        w.write(struct_int32.pack(i))
 
 
 def deser_char_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    r = []
-    for i in xrange(nit):
-        t = struct.unpack("<B", f.read(1))[0]
-        r.append(t)
-    return r
+    nit = deser_compact_size(f)
+    return list(bytearray(f.read(nit)))
 
 
 def ser_char_vector(l):
-    r = ""
-    if len(l) < 253:
-        r = chr(len(l))
-    elif len(l) < 0x10000:
-        r = chr(253) + struct.pack("<H", len(l))
-    elif len(l) < 0x100000000L:
-        r = chr(254) + struct.pack("<I", len(l))
-    else:
-        r = chr(255) + struct.pack("<Q", len(l))
-    for i in l:
-        r += chr(i)
-    return r
+    return ser_compact_size(len(l)) + str(bytearray(l))
+
+
+def ser_char_vector_to(w, l):
+    w.write(ser_compact_size(len(l)))
+    w.write(bytearray(l))
 
 
 # Objects that map to bitcoind objects, which can be serialized/deserialized
 
-class CAddress(object):
+class CAddress(Serializable):
+    __slots__ = ("nServices", "pchReserved", "ip", "port")
+
     def __init__(self):
         self.nServices = 1
         self.pchReserved = "\x00" * 10 + "\xff" * 2
         self.ip = "0.0.0.0"
         self.port = 0
 
+    def copy(self):
+        r = CAddress()
+        r.nServices = self.nServices
+        r.pchReserved = self.pchReserved
+        r.ip = self.ip
+        r.port = self.port
+        return r
+
     def deserialize(self, f):
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
+        self.nServices = struct_uint64.unpack(f.read(8))[0]
         self.pchReserved = f.read(12)
         self.ip = socket.inet_ntoa(f.read(4))
         self.port = struct.unpack(">H", f.read(2))[0]
 
-    def serialize(self):
-        r = ""
-        r += struct.pack("<Q", self.nServices)
-        r += self.pchReserved
-        r += socket.inet_aton(self.ip)
-        r += struct.pack(">H", self.port)
-        return r
+    def serialize_to(self, w):
+        w.write(struct_uint64.pack(self.nServices))
+        w.write(self.pchReserved)
+        w.write(socket.inet_aton(self.ip))
+        w.write(struct.pack(">H", self.port))
 
     def __repr__(self):
         return "CAddress(nServices=%i ip=%s port=%i)" % (self.nServices,
                                                          self.ip, self.port)
 
 
-class CInv(object):
+class CInv(Serializable):
     typemap = {
         0: "Error",
         1: "TX",
         2: "Block"}
 
+    __slots__ = ("type", "hash")
+
     def __init__(self, t=0, h=0L):
         self.type = t
         self.hash = h
 
+    def copy(self):
+        return CInv(self.type, self.hash)
+
     def deserialize(self, f):
-        self.type = struct.unpack("<i", f.read(4))[0]
+        self.type = struct_int32.unpack(f.read(4))[0]
         self.hash = deser_uint256(f)
 
-    def serialize(self):
-        r = ""
-        r += struct.pack("<i", self.type)
-        r += ser_uint256(self.hash)
-        return r
+    def serialize_to(self, w):
+        w.write(struct_int32.pack(self.type))
+        w.write(ser_uint256(self.hash))
 
     def __repr__(self):
         return "CInv(type=%s hash=%064x)" \
             % (self.typemap[self.type], self.hash)
 
 
-class CBlockLocator(object):
+class CBlockLocator(Serializable):
     def __init__(self):
         self.nVersion = MY_VERSION
         self.vHave = []
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = struct_int32.unpack(f.read(4))[0]
         self.vHave = deser_uint256_vector(f)
 
-    def serialize(self):
-        r = ""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256_vector(self.vHave)
-        return r
+    def serialize_to(self, w):
+        w.write(struct_int32.pack(self.nVersion))
+        w.write(ser_uint256_vector(self.vHave))
 
     def __repr__(self):
         return "CBlockLocator(nVersion=%i vHave=%s)" \
@@ -348,7 +368,10 @@ class CBlockLocator(object):
 G1_PREFIX_MASK = 0x02
 G2_PREFIX_MASK = 0x0a
 
-class ZCProof(object):
+class ZCProof(Serializable):
+    __slots__ = ("g_A", "g_A_prime", "g_B", "g_B_prime", "g_C", "g_C_prime",
+                 "g_K", "g_H")
+
     def __init__(self):
         self.g_A = None
         self.g_A_prime = None
@@ -360,14 +383,14 @@ class ZCProof(object):
         self.g_H = None
 
     def deserialize(self, f):
-        def deser_g1(self, f):
-            leadingByte = struct.unpack("<B", f.read(1))[0]
+        def deser_g1(f):
+            leadingByte = struct_uint8.unpack(f.read(1))[0]
             return {
                 'y_lsb': leadingByte & 1,
                 'x': f.read(32),
             }
-        def deser_g2(self, f):
-            leadingByte = struct.unpack("<B", f.read(1))[0]
+        def deser_g2(f):
+            leadingByte = struct_uint8.unpack(f.read(1))[0]
             return {
                 'y_gt': leadingByte & 1,
                 'x': f.read(64),
@@ -381,22 +404,29 @@ class ZCProof(object):
         self.g_K = deser_g1(f)
         self.g_H = deser_g1(f)
 
-    def serialize(self):
-        def ser_g1(self, p):
-            return chr(G1_PREFIX_MASK | p['y_lsb']) + p['x']
-        def ser_g2(self, p):
-            return chr(G2_PREFIX_MASK | p['y_gt']) + p['x']
-        r = ""
-        r += ser_g1(self.g_A)
-        r += ser_g1(self.g_A_prime)
-        r += ser_g2(self.g_B)
-        r += ser_g1(self.g_B_prime)
-        r += ser_g1(self.g_C)
-        r += ser_g1(self.g_C_prime)
-        r += ser_g1(self.g_K)
-        r += ser_g1(self.g_H)
+    def copy(self):
+        r = ZCProof()
+        for name in self.__slots__:
+            p = getattr(self, name)
+            setattr(r, name, None if p is None else dict(p))
         return r
 
+    def serialize_to(self, w):
+        def ser_g1(p):
+            w.write(chr(G1_PREFIX_MASK | p['y_lsb']))
+            w.write(p['x'])
+        def ser_g2(p):
+            w.write(chr(G2_PREFIX_MASK | p['y_gt']))
+            w.write(p['x'])
+        ser_g1(self.g_A)
+        ser_g1(self.g_A_prime)
+        ser_g2(self.g_B)
+        ser_g1(self.g_B_prime)
+        ser_g1(self.g_C)
+        ser_g1(self.g_C_prime)
+        ser_g1(self.g_K)
+        ser_g1(self.g_H)
+
     def __repr__(self):
         return "ZCProof(g_A=%s g_A_prime=%s g_B=%s g_B_prime=%s g_C=%s g_C_prime=%s g_K=%s g_H=%s)" \
             % (repr(self.g_A), repr(self.g_A_prime),
@@ -429,7 +459,10 @@ ZC_NOTECIPHERTEXT_SIZE = (
   NOTEENCRYPTION_AUTH_BYTES
 )
 
-class JSDescription(object):
+class JSDescription(Serializable):
+    __slots__ = ("vpub_old", "vpub_new", "anchor", "nullifiers", "commitments",
+                 "onetimePubKey", "randomSeed", "macs", "proof", "ciphertexts")
+
     def __init__(self):
         self.vpub_old = 0
         self.vpub_new = 0
@@ -443,8 +476,8 @@ class JSDescription(object):
         self.ciphertexts = [None] * ZC_NUM_JS_OUTPUTS
 
     def deserialize(self, f):
-        self.vpub_old = struct.unpack("<q", f.read(8))[0]
-        self.vpub_new = struct.unpack("<q", f.read(8))[0]
+        self.vpub_old = struct_int64.unpack(f.read(8))[0]
+        self.vpub_new = struct_int64.unpack(f.read(8))[0]
         self.anchor = deser_uint256(f)
 
         self.nullifiers = []
@@ -469,23 +502,35 @@ class JSDescription(object):
         for i in range(ZC_NUM_JS_OUTPUTS):
             self.ciphertexts.append(f.read(ZC_NOTECIPHERTEXT_SIZE))
 
-    def serialize(self):
-        r = ""
-        r += struct.pack("<q", self.vpub_old)
-        r += struct.pack("<q", self.vpub_new)
-        r += ser_uint256(self.anchor)
+    def copy(self):
+        r = JSDescription()
+        r.vpub_old = self.vpub_old
+        r.vpub_new = self.vpub_new
+        r.anchor = self.anchor
+        r.nullifiers = list(self.nullifiers)
+        r.commitments = list(self.commitments)
+        r.onetimePubKey = self.onetimePubKey
+        r.randomSeed = self.randomSeed
+        r.macs = list(self.macs)
+        r.proof = None if self.proof is None else self.proof.copy()
+        r.ciphertexts = list(self.ciphertexts)
+        return r
+
+    def serialize_to(self, w):
+        w.write(struct_int64.pack(self.vpub_old))
+        w.write(struct_int64.pack(self.vpub_new))
+        w.write(ser_uint256(self.anchor))
         for i in range(ZC_NUM_JS_INPUTS):
-            r += ser_uint256(self.nullifiers[i])
+            w.write(ser_uint256(self.nullifiers[i]))
         for i in range(ZC_NUM_JS_OUTPUTS):
-            r += ser_uint256(self.commitments[i])
-        r += ser_uint256(self.onetimePubKey)
-        r += ser_uint256(self.randomSeed)
+            w.write(ser_uint256(self.commitments[i]))
+        w.write(ser_uint256(self.onetimePubKey))
+        w.write(ser_uint256(self.randomSeed))
         for i in range(ZC_NUM_JS_INPUTS):
-            r += ser_uint256(self.macs[i])
-        r += self.proof.serialize()
+            w.write(ser_uint256(self.macs[i]))
+        self.proof.serialize_to(w)
         for i in range(ZC_NUM_JS_OUTPUTS):
-            r += ser_uint256(self.ciphertexts[i])
-        return r
+            w.write(self.ciphertexts[i])
 
     def __repr__(self):
         return "JSDescription(vpub_old=%i.%08i vpub_new=%i.%08i anchor=%064x onetimePubKey=%064x randomSeed=%064x proof=%s)" \
@@ -493,26 +538,31 @@ class JSDescription(object):
                self.onetimePubKey, self.randomSeed, repr(self.proof))
 
 
-class COutPoint(object):
+class COutPoint(Serializable):
+    __slots__ = ("hash", "n")
+
     def __init__(self, hash=0, n=0):
         self.hash = hash
         self.n = n
 
+    def copy(self):
+        return COutPoint(self.hash, self.n)
+
     def deserialize(self, f):
         self.hash = deser_uint256(f)
-        self.n = struct.unpack("<I", f.read(4))[0]
+        self.n = struct_uint32.unpack(f.read(4))[0]
 
-    def serialize(self):
-        r = ""
-        r += ser_uint256(self.hash)
-        r += struct.pack("<I", self.n)
-        return r
+    def serialize_to(self, w):
+        w.write(ser_uint256(self.hash))
+        w.write(struct_uint32.pack(self.n))
 
     def __repr__(self):
         return "COutPoint(hash=%064x n=%i)" % (self.hash, self.n)
 
 
-class CTxIn(object):
+class CTxIn(Serializable):
+    __slots__ = ("prevout", "scriptSig", "nSequence")
+
     def __init__(self, outpoint=None, scriptSig="", nSequence=0):
         if outpoint is None:
             self.prevout = COutPoint()
@@ -521,18 +571,19 @@ class CTxIn(object):
         self.scriptSig = scriptSig
         self.nSequence = nSequence
 
+    def copy(self):
+        return CTxIn(self.prevout.copy(), self.scriptSig, self.nSequence)
+
     def deserialize(self, f):
         self.prevout = COutPoint()
         self.prevout.deserialize(f)
         self.scriptSig = deser_string(f)
-        self.nSequence = struct.unpack("<I", f.read(4))[0]
+        self.nSequence = struct_uint32.unpack(f.read(4))[0]
 
-    def serialize(self):
-        r = ""
-        r += self.prevout.serialize()
-        r += ser_string(self.scriptSig)
-        r += struct.pack("<I", self.nSequence)
-        return r
+    def serialize_to(self, w):
+        self.prevout.serialize_to(w)
+        ser_string_to(w, self.scriptSig)
+        w.write(struct_uint32.pack(self.nSequence))
 
     def __repr__(self):
         return "CTxIn(prevout=%s scriptSig=%s nSequence=%i)" \
@@ -540,20 +591,23 @@ class CTxIn(object):
                self.nSequence)
 
 
-class CTxOut(object):
+class CTxOut(Serializable):
+    __slots__ = ("nValue", "scriptPubKey")
+
     def __init__(self, nValue=0, scriptPubKey=""):
         self.nValue = nValue
         self.scriptPubKey = scriptPubKey
 
+    def copy(self):
+        return CTxOut(self.nValue, self.scriptPubKey)
+
     def deserialize(self, f):
-        self.nValue = struct.unpack("<q", f.read(8))[0]
+        self.nValue = struct_int64.unpack(f.read(8))[0]
         self.scriptPubKey = deser_string(f)
 
-    def serialize(self):
-        r = ""
-        r += struct.pack("<q", self.nValue)
-        r += ser_string(self.scriptPubKey)
-        return r
+    def serialize_to(self, w):
+        w.write(struct_int64.pack(self.nValue))
+        ser_string_to(w, self.scriptPubKey)
 
     def __repr__(self):
         return "CTxOut(nValue=%i.%08i scriptPubKey=%s)" \
@@ -561,7 +615,7 @@ class CTxOut(object):
                binascii.hexlify(self.scriptPubKey))
 
 
-class CTransaction(object):
+class CTransaction(Serializable):
     def __init__(self, tx=None):
         if tx is None:
             self.nVersion = 1
@@ -575,49 +629,78 @@ class CTransaction(object):
             self.hash = None
         else:
             self.nVersion = tx.nVersion
-            self.vin = copy.deepcopy(tx.vin)
-            self.vout = copy.deepcopy(tx.vout)
+            self.vin = [txin.copy() for txin in tx.vin]
+            self.vout = [txout.copy() for txout in tx.vout]
             self.nLockTime = tx.nLockTime
-            self.vjoinsplit = copy.deepcopy(tx.vjoinsplit)
+            self.vjoinsplit = [js.copy() for js in tx.vjoinsplit]
             self.joinSplitPubKey = tx.joinSplitPubKey
             self.joinSplitSig = tx.joinSplitSig
             self.sha256 = None
             self.hash = None
+        # Serialization cached by freeze(), and the number of times this
+        # transaction has actually been serialized
+        self._serialized = None
+        self.serialize_count = 0
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = struct_int32.unpack(f.read(4))[0]
         self.vin = deser_vector(f, CTxIn)
         self.vout = deser_vector(f, CTxOut)
-        self.nLockTime = struct.unpack("<I", f.read(4))[0]
+        self.nLockTime = struct_uint32.unpack(f.read(4))[0]
         if self.nVersion >= 2:
             self.vjoinsplit = deser_vector(f, JSDescription)
             if len(self.vjoinsplit) > 0:
                 self.joinSplitPubKey = deser_uint256(f)
                 self.joinSplitSig = f.read(64)
+        self._serialized = None
         self.sha256 = None
         self.hash = None
 
     def serialize(self):
-        r = ""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        r += struct.pack("<I", self.nLockTime)
+        if self._serialized is not None:
+            return self._serialized
+        return super(CTransaction, self).serialize()
+
+    def serialize_to(self, w):
+        if self._serialized is not None:
+            w.write(self._serialized)
+            return
+        self.serialize_count += 1
+        w.write(struct_int32.pack(self.nVersion))
+        ser_vector_to(w, self.vin)
+        ser_vector_to(w, self.vout)
+        w.write(struct_uint32.pack(self.nLockTime))
         if self.nVersion >= 2:
-            r += ser_vector(self.vjoinsplit)
+            ser_vector_to(w, self.vjoinsplit)
             if len(self.vjoinsplit) > 0:
-                r += ser_uint256(self.joinSplitPubKey)
-                r += self.joinSplitSig
-        return r
+                w.write(ser_uint256(self.joinSplitPubKey))
+                w.write(self.joinSplitSig)
+
+    # Cache the serialization, so that hashing, merkle root computation and
+    # sending the transaction all reuse it. Changes made to a frozen
+    # transaction are not serialized or hashed until rehash() is called, so
+    # only freeze transactions that the caller owns and has finished
+    # building. serialized, if given, must be the bytes the transaction was
+    # just deserialized from. Transactions parsed from a CLazyBlock are
+    # frozen this way (see deser_frozen_tx).
+    def freeze(self, serialized=None):
+        self._serialized = None
+        if serialized is None:
+            serialized = self.serialize()
+        self._serialized = serialized
+        return self
 
     def rehash(self):
+        if self._serialized is not None:
+            self.freeze()
         self.sha256 = None
         self.calc_sha256()
 
     def calc_sha256(self):
+        h = hash256(self.serialize())
         if self.sha256 is None:
-            self.sha256 = uint256_from_str(hash256(self.serialize()))
-        self.hash = hash256(self.serialize())[::-1].encode('hex_codec')
+            self.sha256 = uint256_from_str(h)
+        self.hash = h[::-1].encode('hex_codec')
 
     def is_valid(self):
         self.calc_sha256()
@@ -638,7 +721,29 @@ class CTransaction(object):
         return r
 
 
-class CBlockHeader(object):
+# Deserializes tx in place, and freezes it with the bytes it was read from.
+# If f cannot seek back over those bytes, tx is frozen with a fresh
+# serialization instead.
+def deser_frozen_tx(f, tx=None):
+    if tx is None:
+        tx = CTransaction()
+    try:
+        start = f.tell()
+    except (AttributeError, IOError):
+        tx.deserialize(f)
+        return tx.freeze()
+    tx.deserialize(f)
+    end = f.tell()
+    f.seek(start)
+    return tx.freeze(f.read(end - start))
+
+
+def deser_frozen_tx_vector(f):
+    nit = deser_compact_size(f)
+    return [deser_frozen_tx(f) for i in xrange(nit)]
+
+
+class CBlockHeader(Serializable):
     def __init__(self, header=None):
         if header is None:
             self.set_null()
@@ -668,42 +773,43 @@ class CBlockHeader(object):
         self.hash = None
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = struct_int32.unpack(f.read(4))[0]
         self.hashPrevBlock = deser_uint256(f)
         self.hashMerkleRoot = deser_uint256(f)
         self.hashReserved = deser_uint256(f)
-        self.nTime = struct.unpack("<I", f.read(4))[0]
-        self.nBits = struct.unpack("<I", f.read(4))[0]
+        self.nTime = struct_uint32.unpack(f.read(4))[0]
+        self.nBits = struct_uint32.unpack(f.read(4))[0]
         self.nNonce = deser_uint256(f)
         self.nSolution = deser_char_vector(f)
         self.sha256 = None
         self.hash = None
 
+    def serialize_header_to(self, w):
+        w.write(struct_int32.pack(self.nVersion))
+        w.write(ser_uint256(self.hashPrevBlock))
+        w.write(ser_uint256(self.hashMerkleRoot))
+        w.write(ser_uint256(self.hashReserved))
+        w.write(struct_uint32.pack(self.nTime))
+        w.write(struct_uint32.pack(self.nBits))
+        w.write(ser_uint256(self.nNonce))
+        ser_char_vector_to(w, self.nSolution)
+
+    def serialize_to(self, w):
+        self.serialize_header_to(w)
+
+    # Serializes only the header, also when called on a CBlock
     def serialize(self):
-        r = ""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256(self.hashPrevBlock)
-        r += ser_uint256(self.hashMerkleRoot)
-        r += ser_uint256(self.hashReserved)
-        r += struct.pack("<I", self.nTime)
-        r += struct.pack("<I", self.nBits)
-        r += ser_uint256(self.nNonce)
-        r += ser_char_vector(self.nSolution)
-        return r
+        w = BytesWriter()
+        self.serialize_header_to(w)
+        return w.getvalue()
 
     def calc_sha256(self):
         if self.sha256 is None:
-            r = ""
-            r += struct.pack("<i", self.nVersion)
-            r += ser_uint256(self.hashPrevBlock)
-            r += ser_uint256(self.hashMerkleRoot)
-            r += ser_uint256(self.hashReserved)
-            r += struct.pack("<I", self.nTime)
-            r += struct.pack("<I", self.nBits)
-            r += ser_uint256(self.nNonce)
-            r += ser_char_vector(self.nSolution)
-            self.sha256 = uint256_from_str(hash256(r))
-            self.hash = hash256(r)[::-1].encode('hex_codec')
+            w = BytesWriter()
+            self.serialize_header_to(w)
+            h = hash256(w.buf)
+            self.sha256 = uint256_from_str(h)
+            self.hash = h[::-1].encode('hex_codec')
 
     def rehash(self):
         self.sha256 = None
@@ -726,10 +832,11 @@ class CBlock(CBlockHeader):
         self.vtx = deser_vector(f, CTransaction)
 
     def serialize(self):
-        r = ""
-        r += super(CBlock, self).serialize()
-        r += ser_vector(self.vtx)
-        return r
+        return Serializable.serialize(self)
+
+    def serialize_to(self, w):
+        self.serialize_header_to(w)
+        ser_vector_to(w, self.vtx)
 
     def calc_merkle_root(self):
         hashes = []
@@ -749,7 +856,7 @@ class CBlock(CBlockHeader):
         digest = blake2b(digest_size=(512/n)*n/8, person=zcash_person(n, k))
         digest.update(super(CBlock, self).serialize()[:108])
         hash_nonce(digest, self.nNonce)
-        if not gbp_validate(self.nSolution, digest, n, k):
+        if not gbp_validate(digest, self.nSolution, n, k):
             return False
         self.calc_sha256()
         target = uint256_from_compact(self.nBits)
@@ -762,25 +869,54 @@ class CBlock(CBlockHeader):
             return False
         return True
 
-    def solve(self, n=48, k=5):
+    # Finds the lowest nonce with a solution that meets the target. With
+    # workers > 1, nonces are solved in the shared solver pool (see
+    # start_solver_pool), keeping one nonce in flight per worker; the result
+    # is the same as solving them one after another.
+    # cache is a SolutionCache to look solutions up in and add them to, or
+    # None to always mine. By default the shared on-disk cache from
+    # default_solution_cache() is used if ZCASH_SOLUTION_CACHE is set.
+    def solve(self, n=48, k=5, workers=1, cache=DEFAULT_SOLUTION_CACHE):
         target = uint256_from_compact(self.nBits)
-        # H(I||...
-        digest = blake2b(digest_size=(512/n)*n/8, person=zcash_person(n, k))
-        digest.update(super(CBlock, self).serialize()[:108])
-        self.nNonce = 0
-        while True:
-            # H(I||V||...
-            curr_digest = digest.copy()
-            hash_nonce(curr_digest, self.nNonce)
-            # (x_1, x_2, ...) = A(I, V, n, k)
-            solns = gbp_basic(curr_digest, n, k)
-            for soln in solns:
-                assert(gbp_validate(curr_digest, soln, n, k))
-                self.nSolution = soln
-                self.rehash()
-                if self.sha256 <= target:
-                    return
-            self.nNonce += 1
+        header = super(CBlock, self).serialize()[:108]
+        if cache is DEFAULT_SOLUTION_CACHE:
+            cache = default_solution_cache()
+        result = None
+        if cache is not None:
+            result = cache.get(header, n, k)
+            if result is not None and not check_solution(header, result[0], result[1], n, k, target):
+                result = None
+        if result is not None:
+            (self.nNonce, self.nSolution) = result
+            self.rehash()
+            return
+        if workers > 1:
+            pool = solver_pool(workers)
+            pending = deque(pool.apply_async(solve_nonce, ((header, nonce, n, k, target),))
+                            for nonce in range(workers))
+            next_nonce = workers
+            # Results are taken in nonce order. Once a solution is found, the
+            # at most workers-1 nonces still in flight are waited for, so that
+            # no work is left running in the pool when solve() returns.
+            try:
+                while True:
+                    result = pending.popleft().get()
+                    if result is not None:
+                        break
+                    pending.append(pool.apply_async(solve_nonce, ((header, next_nonce, n, k, target),)))
+                    next_nonce += 1
+            finally:
+                for leftover in pending:
+                    leftover.wait()
+        else:
+            nonce = 0
+            while result is None:
+                result = solve_nonce((header, nonce, n, k, target))
+                nonce += 1
+        (self.nNonce, self.nSolution) = result
+        self.rehash()
+        if cache is not None:
+            cache.put(header, n, k, self.nNonce, self.nSolution)
 
     def __repr__(self):
         return "CBlock(nVersion=%i hashPrevBlock=%064x hashMerkleRoot=%064x hashReserved=%064x nTime=%s nBits=%08x nNonce=%064x nSolution=%s vtx=%s)" \
@@ -789,7 +925,124 @@ class CBlock(CBlockHeader):
                self.nNonce, repr(self.nSolution), repr(self.vtx))
 
 
-class CUnsignedAlert(object):
+_solver_pool = None
+_solver_pool_workers = 0
+
+# Starts the process pool used by CBlock.solve(workers=...), and returns the
+# number of workers to pass to solve(). By default the CPUs are shared out
+# between the tests that rpc-tests.py runs at once, which it exports as
+# ZCASH_RPC_TEST_JOBS.
+# The workers are forked with every file descriptor and all of the mininode
+# state the test has at that point, so tests that mine with workers > 1 must
+# call this in their setup, before opening any connections. No pool is
+# started if there is only one worker. The pool is stopped by
+# stop_solver_pool, or when the test exits.
+def start_solver_pool(workers=None):
+    global _solver_pool, _solver_pool_workers
+    stop_solver_pool()
+    if workers is None:
+        jobs = int(os.environ.get("ZCASH_RPC_TEST_JOBS", 1))
+        workers = max(1, multiprocessing.cpu_count() // jobs)
+    if workers > 1:
+        _solver_pool = multiprocessing.Pool(workers)
+        _solver_pool_workers = workers
+    return workers
+
+def stop_solver_pool():
+    global _solver_pool, _solver_pool_workers
+    if _solver_pool is not None:
+        _solver_pool.terminate()
+        _solver_pool.join()
+        _solver_pool = None
+        _solver_pool_workers = 0
+
+atexit.register(stop_solver_pool)
+
+# Returns the solver pool. It is never started on demand, as forking in the
+# middle of a test would copy its open sockets into the workers.
+def solver_pool(workers):
+    if _solver_pool is None:
+        raise RuntimeError("solve(workers=%d) needs start_solver_pool() to be "
+                           "called before any connections are opened" % workers)
+    return _solver_pool
+
+
+# Solves the Equihash instance for one nonce of a 108-byte block header
+# prefix. Returns (nonce, solution) for the first solution whose block hash
+# meets the target, or None. This is a module-level function so that
+# CBlock.solve can run it in worker processes.
+def solve_nonce(args):
+    (header, nonce, n, k, target) = args
+    # H(I||...
+    digest = blake2b(digest_size=(512/n)*n/8, person=zcash_person(n, k))
+    digest.update(header)
+    # H(I||V||...
+    hash_nonce(digest, nonce)
+    # (x_1, x_2, ...) = A(I, V, n, k)
+    for soln in gbp_default(digest, n, k):
+        assert(gbp_validate(digest, soln, n, k))
+        blockhash = hash256(header + ser_uint256(nonce) + ser_char_vector(soln))
+        if uint256_from_str(blockhash) <= target:
+            return (nonce, soln)
+    return None
+
+
+# Checks that soln is a valid Equihash solution for the header prefix and
+# nonce, and that the resulting block hash meets the target.
+def check_solution(header, nonce, soln, n, k, target):
+    digest = blake2b(digest_size=(512/n)*n/8, person=zcash_person(n, k))
+    digest.update(header)
+    hash_nonce(digest, nonce)
+    if not gbp_validate(digest, soln, n, k):
+        return False
+    blockhash = hash256(header + ser_uint256(nonce) + ser_char_vector(soln))
+    return uint256_from_str(blockhash) <= target
+
+
+# A CBlock that parses only the header when deserialized, and keeps the
+# serialized transactions until vtx is first accessed. Until then, serialize()
+# returns the original transaction bytes without re-encoding them. The
+# transactions are read up to the end of the stream, so this is only suitable
+# for streams that contain a single block, such as a msg_block payload.
+# The transactions in vtx are frozen (see CTransaction.freeze), as received
+# and stored blocks are normally only hashed and relayed; call rehash() on a
+# transaction after changing it.
+class CLazyBlock(CBlock):
+    def __init__(self, header=None):
+        self.raw_vtx = None
+        super(CLazyBlock, self).__init__(header)
+
+    @property
+    def vtx(self):
+        if self.raw_vtx is not None:
+            self._vtx = deser_frozen_tx_vector(cStringIO.StringIO(self.raw_vtx))
+            self.raw_vtx = None
+        return self._vtx
+
+    @vtx.setter
+    def vtx(self, vtx):
+        self._vtx = vtx
+        self.raw_vtx = None
+
+    def deserialize(self, f):
+        CBlockHeader.deserialize(self, f)
+        self._vtx = []
+        self.raw_vtx = f.read()
+
+    def serialize(self):
+        if self.raw_vtx is None:
+            return super(CLazyBlock, self).serialize()
+        return CBlockHeader.serialize(self) + self.raw_vtx
+
+    def serialize_to(self, w):
+        if self.raw_vtx is None:
+            super(CLazyBlock, self).serialize_to(w)
+        else:
+            self.serialize_header_to(w)
+            w.write(self.raw_vtx)
+
+
+class CUnsignedAlert(Serializable):
     def __init__(self):
         self.nVersion = 1
         self.nRelayUntil = 0
@@ -806,36 +1059,34 @@ class CUnsignedAlert(object):
         self.strReserved = ""
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
-        self.nRelayUntil = struct.unpack("<q", f.read(8))[0]
-        self.nExpiration = struct.unpack("<q", f.read(8))[0]
-        self.nID = struct.unpack("<i", f.read(4))[0]
-        self.nCancel = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = struct_int32.unpack(f.read(4))[0]
+        self.nRelayUntil = struct_int64.unpack(f.read(8))[0]
+        self.nExpiration = struct_int64.unpack(f.read(8))[0]
+        self.nID = struct_int32.unpack(f.read(4))[0]
+        self.nCancel = struct_int32.unpack(f.read(4))[0]
         self.setCancel = deser_int_vector(f)
-        self.nMinVer = struct.unpack("<i", f.read(4))[0]
-        self.nMaxVer = struct.unpack("<i", f.read(4))[0]
+        self.nMinVer = struct_int32.unpack(f.read(4))[0]
+        self.nMaxVer = struct_int32.unpack(f.read(4))[0]
         self.setSubVer = deser_string_vector(f)
-        self.nPriority = struct.unpack("<i", f.read(4))[0]
+        self.nPriority = struct_int32.unpack(f.read(4))[0]
         self.strComment = deser_string(f)
         self.strStatusBar = deser_string(f)
         self.strReserved = deser_string(f)
 
-    def serialize(self):
-        r = ""
-        r += struct.pack("<i", self.nVersion)
-        r += struct.pack("<q", self.nRelayUntil)
-        r += struct.pack("<q", self.nExpiration)
-        r += struct.pack("<i", self.nID)
-        r += struct.pack("<i", self.nCancel)
-        r += ser_int_vector(self.setCancel)
-        r += struct.pack("<i", self.nMinVer)
-        r += struct.pack("<i", self.nMaxVer)
-        r += ser_string_vector(self.setSubVer)
-        r += struct.pack("<i", self.nPriority)
-        r += ser_string(self.strComment)
-        r += ser_string(self.strStatusBar)
-        r += ser_string(self.strReserved)
-        return r
+    def serialize_to(self, w):
+        w.write(struct_int32.pack(self.nVersion))
+        w.write(struct_int64.pack(self.nRelayUntil))
+        w.write(struct_int64.pack(self.nExpiration))
+        w.write(struct_int32.pack(self.nID))
+        w.write(struct_int32.pack(self.nCancel))
+        ser_int_vector_to(w, self.setCancel)
+        w.write(struct_int32.pack(self.nMinVer))
+        w.write(struct_int32.pack(self.nMaxVer))
+        ser_string_vector_to(w, self.setSubVer)
+        w.write(struct_int32.pack(self.nPriority))
+        ser_string_to(w, self.strComment)
+        ser_string_to(w, self.strStatusBar)
+        ser_string_to(w, self.strReserved)
 
     def __repr__(self):
         return "CUnsignedAlert(nVersion %d, nRelayUntil %d, nExpiration %d, nID %d, nCancel %d, nMinVer %d, nMaxVer %d, nPriority %d, strComment %s, strStatusBar %s, strReserved %s)" \
@@ -844,7 +1095,7 @@ class CUnsignedAlert(object):
                self.strComment, self.strStatusBar, self.strReserved)
 
 
-class CAlert(object):
+class CAlert(Serializable):
     def __init__(self):
         self.vchMsg = ""
         self.vchSig = ""
@@ -853,11 +1104,9 @@ class CAlert(object):
         self.vchMsg = deser_string(f)
         self.vchSig = deser_string(f)
 
-    def serialize(self):
-        r = ""
-        r += ser_string(self.vchMsg)
-        r += ser_string(self.vchSig)
-        return r
+    def serialize_to(self, w):
+        ser_string_to(w, self.vchMsg)
+        ser_string_to(w, self.vchSig)
 
     def __repr__(self):
         return "CAlert(vchMsg.sz %d, vchSig.sz %d)" \
@@ -865,7 +1114,7 @@ class CAlert(object):
 
 
 # Objects that correspond to messages on the wire
-class msg_version(object):
+class msg_version(Serializable):
     command = "version"
 
     def __init__(self):
@@ -879,20 +1128,20 @@ class msg_version(object):
         self.nStartingHeight = -1
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = struct_int32.unpack(f.read(4))[0]
         if self.nVersion == 10300:
             self.nVersion = 300
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
-        self.nTime = struct.unpack("<q", f.read(8))[0]
+        self.nServices = struct_uint64.unpack(f.read(8))[0]
+        self.nTime = struct_int64.unpack(f.read(8))[0]
         self.addrTo = CAddress()
         self.addrTo.deserialize(f)
         if self.nVersion >= 106:
             self.addrFrom = CAddress()
             self.addrFrom.deserialize(f)
-            self.nNonce = struct.unpack("<Q", f.read(8))[0]
+            self.nNonce = struct_uint64.unpack(f.read(8))[0]
             self.strSubVer = deser_string(f)
             if self.nVersion >= 209:
-                self.nStartingHeight = struct.unpack("<i", f.read(4))[0]
+                self.nStartingHeight = struct_int32.unpack(f.read(4))[0]
             else:
                 self.nStartingHeight = None
         else:
@@ -901,17 +1150,15 @@ class msg_version(object):
             self.strSubVer = None
             self.nStartingHeight = None
 
-    def serialize(self):
-        r = ""
-        r += struct.pack("<i", self.nVersion)
-        r += struct.pack("<Q", self.nServices)
-        r += struct.pack("<q", self.nTime)
-        r += self.addrTo.serialize()
-        r += self.addrFrom.serialize()
-        r += struct.pack("<Q", self.nNonce)
-        r += ser_string(self.strSubVer)
-        r += struct.pack("<i", self.nStartingHeight)
-        return r
+    def serialize_to(self, w):
+        w.write(struct_int32.pack(self.nVersion))
+        w.write(struct_uint64.pack(self.nServices))
+        w.write(struct_int64.pack(self.nTime))
+        self.addrTo.serialize_to(w)
+        self.addrFrom.serialize_to(w)
+        w.write(struct_uint64.pack(self.nNonce))
+        ser_string_to(w, self.strSubVer)
+        w.write(struct_int32.pack(self.nStartingHeight))
 
     def __repr__(self):
         return 'msg_version(nVersion=%i nServices=%i nTime=%s addrTo=%s addrFrom=%s nNonce=0x%016X strSubVer=%s nStartingHeight=%i)' \
@@ -936,7 +1183,7 @@ class msg_verack(object):
         return "msg_verack()"
 
 
-class msg_addr(object):
+class msg_addr(Serializable):
     command = "addr"
 
     def __init__(self):
@@ -945,14 +1192,14 @@ class msg_addr(object):
     def deserialize(self, f):
         self.addrs = deser_vector(f, CAddress)
 
-    def serialize(self):
-        return ser_vector(self.addrs)
+    def serialize_to(self, w):
+        ser_vector_to(w, self.addrs)
 
     def __repr__(self):
         return "msg_addr(addrs=%s)" % (repr(self.addrs))
 
 
-class msg_alert(object):
+class msg_alert(Serializable):
     command = "alert"
 
     def __init__(self):
@@ -962,16 +1209,14 @@ class msg_alert(object):
         self.alert = CAlert()
         self.alert.deserialize(f)
 
-    def serialize(self):
-        r = ""
-        r += self.alert.serialize()
-        return r
+    def serialize_to(self, w):
+        self.alert.serialize_to(w)
 
     def __repr__(self):
         return "msg_alert(alert=%s)" % (repr(self.alert), )
 
 
-class msg_inv(object):
+class msg_inv(Serializable):
     command = "inv"
 
     def __init__(self, inv=None):
@@ -981,32 +1226,32 @@ class msg_inv(object):
             self.inv = inv
 
     def deserialize(self, f):
-        self.inv = deser_vector(f, CInv)
+        self.inv = deser_inv_vector(f)
 
-    def serialize(self):
-        return ser_vector(self.inv)
+    def serialize_to(self, w):
+        ser_vector_to(w, self.inv)
 
     def __repr__(self):
         return "msg_inv(inv=%s)" % (repr(self.inv))
 
 
-class msg_getdata(object):
+class msg_getdata(Serializable):
     command = "getdata"
 
     def __init__(self):
         self.inv = []
 
     def deserialize(self, f):
-        self.inv = deser_vector(f, CInv)
+        self.inv = deser_inv_vector(f)
 
-    def serialize(self):
-        return ser_vector(self.inv)
+    def serialize_to(self, w):
+        ser_vector_to(w, self.inv)
 
     def __repr__(self):
         return "msg_getdata(inv=%s)" % (repr(self.inv))
 
 
-class msg_getblocks(object):
+class msg_getblocks(Serializable):
     command = "getblocks"
 
     def __init__(self):
@@ -1018,11 +1263,9 @@ class msg_getblocks(object):
         self.locator.deserialize(f)
         self.hashstop = deser_uint256(f)
 
-    def serialize(self):
-        r = ""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
+    def serialize_to(self, w):
+        self.locator.serialize_to(w)
+        w.write(ser_uint256(self.hashstop))
 
     def __repr__(self):
         return "msg_getblocks(locator=%s hashstop=%064x)" \
@@ -1055,6 +1298,8 @@ class msg_block(object):
             self.block = block
 
     def deserialize(self, f):
+        # Transactions are parsed when block.vtx is first accessed
+        self.block = CLazyBlock()
         self.block.deserialize(f)
 
     def serialize(self):
@@ -1096,37 +1341,33 @@ class msg_ping_prebip31(object):
         return "msg_ping() (pre-bip31)"
 
 
-class msg_ping(object):
+class msg_ping(Serializable):
     command = "ping"
 
     def __init__(self, nonce=0L):
         self.nonce = nonce
 
     def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = struct_uint64.unpack(f.read(8))[0]
 
-    def serialize(self):
-        r = ""
-        r += struct.pack("<Q", self.nonce)
-        return r
+    def serialize_to(self, w):
+        w.write(struct_uint64.pack(self.nonce))
 
     def __repr__(self):
         return "msg_ping(nonce=%08x)" % self.nonce
 
 
-class msg_pong(object):
+class msg_pong(Serializable):
     command = "pong"
 
     def __init__(self, nonce=0L):
         self.nonce = nonce
 
     def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = struct_uint64.unpack(f.read(8))[0]
 
-    def serialize(self):
-        r = ""
-        r += struct.pack("<Q", self.nonce)
-        return r
+    def serialize_to(self, w):
+        w.write(struct_uint64.pack(self.nonce))
 
     def __repr__(self):
         return "msg_pong(nonce=%08x)" % self.nonce
@@ -1152,7 +1393,7 @@ class msg_mempool(object):
 # number of entries
 # vector of hashes
 # hash_stop (hash of last desired block header, 0 to get as many as possible)
-class msg_getheaders(object):
+class msg_getheaders(Serializable):
     command = "getheaders"
 
     def __init__(self):
@@ -1164,11 +1405,9 @@ class msg_getheaders(object):
         self.locator.deserialize(f)
         self.hashstop = deser_uint256(f)
 
-    def serialize(self):
-        r = ""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
+    def serialize_to(self, w):
+        self.locator.serialize_to(w)
+        w.write(ser_uint256(self.hashstop))
 
     def __repr__(self):
         return "msg_getheaders(locator=%s, stop=%064x)" \
@@ -1177,7 +1416,7 @@ class msg_getheaders(object):
 
 # headers message has
 # <count> <vector of block headers>
-class msg_headers(object):
+class msg_headers(Serializable):
     command = "headers"
 
     def __init__(self):
@@ -1189,15 +1428,18 @@ class msg_headers(object):
         for x in blocks:
             self.headers.append(CBlockHeader(x))
 
-    def serialize(self):
-        blocks = [CBlock(x) for x in self.headers]
-        return ser_vector(blocks)
+    def serialize_to(self, w):
+        # Headers are serialized as blocks without transactions
+        w.write(ser_compact_size(len(self.headers)))
+        for header in self.headers:
+            header.serialize_header_to(w)
+            w.write("\x00")
 
     def __repr__(self):
         return "msg_headers(headers=%s)" % repr(self.headers)
 
 
-class msg_reject(object):
+class msg_reject(Serializable):
     command = "reject"
 
     def __init__(self):
@@ -1208,18 +1450,17 @@ class msg_reject(object):
 
     def deserialize(self, f):
         self.message = deser_string(f)
-        self.code = struct.unpack("<B", f.read(1))[0]
+        self.code = struct_uint8.unpack(f.read(1))[0]
         self.reason = deser_string(f)
         if (self.message == "block" or self.message == "tx"):
             self.data = deser_uint256(f)
 
-    def serialize(self):
-        r = ser_string(self.message)
-        r += struct.pack("<B", self.code)
-        r += ser_string(self.reason)
+    def serialize_to(self, w):
+        ser_string_to(w, self.message)
+        w.write(struct_uint8.pack(self.code))
+        ser_string_to(w, self.reason)
         if (self.message == "block" or self.message == "tx"):
-            r += ser_uint256(self.data)
-        return r
+            w.write(ser_uint256(self.data))
 
     def __repr__(self):
         return "msg_reject: %s %d %s [%064x]" \
@@ -1261,6 +1502,7 @@ class NodeConnCB(object):
             except:
                 print "ERROR delivering %s (%s)" % (repr(message),
                                                     sys.exc_info()[0])
+            mininode_event.notify_all()
 
     def on_version(self, conn, message):
         if message.nVersion >= 209:
@@ -1326,14 +1568,25 @@ class NodeConn(asyncore.dispatcher):
         "regtest": "\xaa\xe8\x3f\x5f"    # regtest
     }
 
+    # Received data is read into a preallocated bytearray, which is grown to
+    # fit the largest message seen. Messages are parsed in place, and the
+    # buffer is only compacted when it runs out of space at the end.
+    RECV_BUFFER_SIZE = 256 * 1024
+    # Queued messages are sent straight from their serialized strings, but
+    # small ones are coalesced to avoid a send() call per message.
+    SEND_COALESCE_SIZE = 64 * 1024
+
     def __init__(self, dstaddr, dstport, rpc, callback, net="regtest"):
         asyncore.dispatcher.__init__(self, map=mininode_socket_map)
         self.log = logging.getLogger("NodeConn(%s:%d)" % (dstaddr, dstport))
         self.dstaddr = dstaddr
         self.dstport = dstport
         self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sendbuf = ""
-        self.recvbuf = ""
+        self.sendbuf = deque()
+        self.send_offset = 0
+        self.recvbuf = bytearray(self.RECV_BUFFER_SIZE)
+        self.recv_start = 0
+        self.recv_end = 0
         self.ver_send = 209
         self.ver_recv = 209
         self.last_sent = 0
@@ -1357,6 +1610,7 @@ class NodeConn(asyncore.dispatcher):
         except:
             self.handle_close()
         self.rpc = rpc
+        mininode_waker.wake()
 
     def show_debug_msg(self, msg):
         self.log.debug(msg)
@@ -1369,19 +1623,56 @@ class NodeConn(asyncore.dispatcher):
         self.show_debug_msg("MiniNode: Closing Connection to %s:%d... "
                             % (self.dstaddr, self.dstport))
         self.state = "closed"
-        self.recvbuf = ""
-        self.sendbuf = ""
+        self.recvbuf = bytearray()
+        self.recv_start = self.recv_end = 0
+        with mininode_lock:
+            self.sendbuf.clear()
+            self.send_offset = 0
         try:
             self.close()
         except:
             pass
         self.cb.on_close(self)
+        notify_waiters()
+
+    def recv_into(self, buf):
+        # Like asyncore.dispatcher.recv, but without copying into a string
+        try:
+            nbytes = self.socket.recv_into(buf)
+            if nbytes == 0:
+                self.handle_close()
+            return nbytes
+        except socket.error, why:
+            if why.args[0] in asyncore._DISCONNECTED:
+                self.handle_close()
+                return 0
+            raise
+
+    def reserve_recv_space(self, size):
+        # Ensure the buffer can hold size bytes from the start of the
+        # unparsed data, moving that data to the front if necessary.
+        if self.recv_start + size <= len(self.recvbuf):
+            return
+        pending = self.recv_end - self.recv_start
+        if size <= len(self.recvbuf):
+            self.recvbuf[:pending] = self.recvbuf[self.recv_start:self.recv_end]
+        else:
+            # A new buffer rather than resizing in place, which is not
+            # allowed while a memoryview of the old one is still alive.
+            recvbuf = bytearray(max(size, 2 * len(self.recvbuf)))
+            recvbuf[:pending] = self.recvbuf[self.recv_start:self.recv_end]
+            self.recvbuf = recvbuf
+        self.recv_start = 0
+        self.recv_end = pending
 
     def handle_read(self):
         try:
-            t = self.recv(8192)
-            if len(t) > 0:
-                self.recvbuf += t
+            if self.recv_end == len(self.recvbuf):
+                self.reserve_recv_space(self.recv_end - self.recv_start +
+                                        self.RECV_BUFFER_SIZE)
+            nbytes = self.recv_into(memoryview(self.recvbuf)[self.recv_end:])
+            if nbytes > 0:
+                self.recv_end += nbytes
                 self.got_data()
         except:
             pass
@@ -1396,70 +1687,104 @@ class NodeConn(asyncore.dispatcher):
 
     def handle_write(self):
         with mininode_lock:
+            # asyncore may call this right after handle_read closed the
+            # connection and emptied sendbuf
+            if not self.sendbuf:
+                return
+            chunk = self.sendbuf[0]
+            if (len(chunk) - self.send_offset < self.SEND_COALESCE_SIZE and
+                    len(self.sendbuf) > 1):
+                chunks = [chunk[self.send_offset:]]
+                size = len(chunks[0])
+                self.sendbuf.popleft()
+                while (self.sendbuf and
+                       size + len(self.sendbuf[0]) <= self.SEND_COALESCE_SIZE):
+                    size += len(self.sendbuf[0])
+                    chunks.append(self.sendbuf.popleft())
+                chunk = "".join(chunks)
+                self.sendbuf.appendleft(chunk)
+                self.send_offset = 0
             try:
-                sent = self.send(self.sendbuf)
+                sent = self.send(buffer(chunk, self.send_offset))
             except:
                 self.handle_close()
                 return
-            self.sendbuf = self.sendbuf[sent:]
+            self.send_offset += sent
+            if self.send_offset == len(chunk):
+                self.sendbuf.popleft()
+                self.send_offset = 0
 
     def got_data(self):
         while True:
-            if len(self.recvbuf) < 4:
+            start = self.recv_start
+            available = self.recv_end - start
+            if available < 4:
                 return
-            if self.recvbuf[:4] != self.MAGIC_BYTES[self.network]:
-                raise ValueError("got garbage %s" % repr(self.recvbuf))
+            if self.recvbuf[start:start+4] != self.MAGIC_BYTES[self.network]:
+                raise ValueError("got garbage %s"
+                                 % repr(bytes(self.recvbuf[start:self.recv_end])))
             if self.ver_recv < 209:
-                if len(self.recvbuf) < 4 + 12 + 4:
+                headerlen = 4 + 12 + 4
+                if available < headerlen:
                     return
-                command = self.recvbuf[4:4+12].split("\x00", 1)[0]
-                msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
+                command, msglen = struct.unpack_from("<12si", self.recvbuf, start + 4)
                 checksum = None
-                if len(self.recvbuf) < 4 + 12 + 4 + msglen:
-                    return
-                msg = self.recvbuf[4+12+4:4+12+4+msglen]
-                self.recvbuf = self.recvbuf[4+12+4+msglen:]
             else:
-                if len(self.recvbuf) < 4 + 12 + 4 + 4:
-                    return
-                command = self.recvbuf[4:4+12].split("\x00", 1)[0]
-                msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
-                checksum = self.recvbuf[4+12+4:4+12+4+4]
-                if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
+                headerlen = 4 + 12 + 4 + 4
+                if available < headerlen:
                     return
-                msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
+                command, msglen, checksum = struct.unpack_from("<12si4s", self.recvbuf, start + 4)
+            command = command.split("\x00", 1)[0]
+            if available < headerlen + msglen:
+                self.reserve_recv_space(headerlen + msglen)
+                return
+            # The payload is checked and deserialized in place; the view must
+            # not outlive this iteration, so that the buffer can be compacted.
+            msg = memoryview(self.recvbuf)[start+headerlen:start+headerlen+msglen]
+            if checksum is not None:
                 th = sha256(msg)
                 h = sha256(th)
                 if checksum != h[:4]:
-                    raise ValueError("got bad checksum " + repr(self.recvbuf))
-                self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
+                    raise ValueError("got bad checksum " +
+                                     repr(bytes(self.recvbuf[start:self.recv_end])))
+            self.recv_start += headerlen + msglen
+            if self.recv_start == self.recv_end:
+                self.recv_start = self.recv_end = 0
             if command in self.messagemap:
                 f = cStringIO.StringIO(msg)
                 t = self.messagemap[command]()
                 t.deserialize(f)
+                del f, msg
                 self.got_message(t)
             else:
-                self.show_debug_msg("Unknown command: '" + command + "' " +
-                                    repr(msg))
+                if self.log.isEnabledFor(logging.DEBUG):
+                    self.show_debug_msg("Unknown command: '" + command + "' " +
+                                        repr(msg.tobytes()))
+                del msg
 
     def send_message(self, message, pushbuf=False):
         if self.state != "connected" and not pushbuf:
             return
-        self.show_debug_msg("Send %s" % repr(message))
+        # Formatting a message parses all of it, including the transactions
+        # of a CLazyBlock, so only do that when it will be logged.
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.show_debug_msg("Send %s" % repr(message))
         command = message.command
         data = message.serialize()
         tmsg = self.MAGIC_BYTES[self.network]
-        tmsg += command
-        tmsg += "\x00" * (12 - len(command))
-        tmsg += struct.pack("<I", len(data))
+        tmsg += struct.pack("<12sI", command, len(data))
         if self.ver_send >= 209:
             th = sha256(data)
             h = sha256(th)
             tmsg += h[:4]
-        tmsg += data
         with mininode_lock:
-            self.sendbuf += tmsg
+            # The header and payload are queued separately so that large
+            # payloads are never copied.
+            self.sendbuf.append(tmsg)
+            if data:
+                self.sendbuf.append(data)
             self.last_sent = time.time()
+        mininode_waker.wake()
 
     def got_message(self, message):
         if message.command == "version":
@@ -1467,25 +1792,72 @@ class NodeConn(asyncore.dispatcher):
                 self.messagemap['ping'] = msg_ping_prebip31
         if self.last_sent + 30 * 60 < time.time():
             self.send_message(self.messagemap['ping']())
-        self.show_debug_msg("Recv %s" % repr(message))
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.show_debug_msg("Recv %s" % repr(message))
         self.cb.deliver(self, message)
 
     def disconnect_node(self):
         self.disconnect = True
+        mininode_waker.disconnects.append(self)
+        mininode_waker.wake()
+
+
+# A pipe that NetworkThread polls alongside the connections, so that the
+# thread running the test logic can wake it as soon as there is data to send,
+# a new connection or a connection to close.
+class NetworkWaker(asyncore.file_dispatcher):
+    def __init__(self):
+        read_fd, self.wake_fd = os.pipe()
+        # file_dispatcher polls a duplicate of read_fd
+        asyncore.file_dispatcher.__init__(self, read_fd, map={})
+        os.close(read_fd)
+        flags = fcntl.fcntl(self.wake_fd, fcntl.F_GETFL, 0)
+        fcntl.fcntl(self.wake_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        # NodeConns waiting for NetworkThread to close them
+        self.disconnects = deque()
+
+    def wake(self):
+        try:
+            os.write(self.wake_fd, "\x00")
+        except OSError as e:
+            # If the pipe is full, a wakeup is already pending
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            os.read(self._fileno, 4096)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+mininode_waker = NetworkWaker()
 
 
 class NetworkThread(Thread):
+    # Sends, connects and disconnects wake the thread, so this is only an
+    # upper bound on how long it can miss a state change by.
+    POLL_TIMEOUT = 1.0
+
     def run(self):
-        while mininode_socket_map:
-            # We check for whether to disconnect outside of the asyncore
-            # loop to workaround the behavior of asyncore when using
-            # select
-            disconnected = []
-            for fd, obj in mininode_socket_map.items():
-                if obj.disconnect:
-                    disconnected.append(obj)
-            [ obj.handle_close() for obj in disconnected ]
-            asyncore.loop(0.1, use_poll=True, map=mininode_socket_map, count=1)
+        while True:
+            # We close connections outside of the asyncore loop to
+            # workaround the behavior of asyncore when using select
+            while mininode_waker.disconnects:
+                obj = mininode_waker.disconnects.popleft()
+                if obj.state != "closed":
+                    obj.handle_close()
+            if not mininode_socket_map:
+                break
+            poll_map = dict(mininode_socket_map)
+            poll_map[mininode_waker._fileno] = mininode_waker
+            asyncore.poll2(self.POLL_TIMEOUT, poll_map)
 
 
 # An exception we can raise if we detect a potential disconnect
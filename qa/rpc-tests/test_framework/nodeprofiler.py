@@ -0,0 +1,141 @@
+# Copyright (c) 2017 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# NodeProfiler: samples the CPU, memory, disk I/O and file descriptor usage
+#               of the bitcoinds in util.bitcoind_processes from /proc while
+#               a test runs (Linux only)
+#
+
+import json
+import os
+import threading
+import time
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+# Values that are summed over a node's processes rather than summarized by
+# peak and mean, because they only ever grow
+CUMULATIVE = ('cpu_s', 'read_bytes', 'write_bytes')
+GAUGES = ('rss_kb', 'threads', 'fds')
+
+def read_proc_sample(pid):
+    """
+    Return the current resource usage of process pid, or None if it has
+    exited
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # The command name may contain spaces, so split after it
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/%d/status' % pid) as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        fds = len(os.listdir('/proc/%d/fd' % pid))
+    except (IOError, OSError):
+        return None
+    sample = {
+        'cpu_s': float(int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+        'threads': int(fields[17]),
+        'rss_kb': int(status.get('VmRSS', '0 kB').split()[0]),
+        'fds': fds,
+    }
+    # /proc/<pid>/io is not readable in some containers
+    try:
+        with open('/proc/%d/io' % pid) as f:
+            io = dict(line.split(':', 1) for line in f if ':' in line)
+        sample['read_bytes'] = int(io['read_bytes'])
+        sample['write_bytes'] = int(io['write_bytes'])
+    except (IOError, OSError, KeyError):
+        pass
+    return sample
+
+class NodeProfiler(object):
+    """
+    Polls the processes in a dict of node index to Popen (normally
+    util.bitcoind_processes) every interval seconds, from a daemon thread
+    started by start(). Nodes that are restarted during the test keep their
+    index, and each sample records the pid it was taken from.
+    """
+    def __init__(self, processes, interval=0.5):
+        self.processes = processes
+        self.interval = interval
+        self.samples = {}
+        self._start = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._start = time.time()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self.interval):
+                break
+
+    def sample(self):
+        t = time.time() - self._start
+        for (i, process) in list(self.processes.items()):
+            sample = read_proc_sample(process.pid)
+            if sample is None:
+                continue
+            sample['t'] = t
+            sample['pid'] = process.pid
+            with self._lock:
+                self.samples.setdefault(i, []).append(sample)
+
+    @staticmethod
+    def _summarize(samples):
+        summary = {'samples': len(samples)}
+        for key in GAUGES:
+            values = [s[key] for s in samples]
+            summary['peak_' + key] = max(values)
+            summary['mean_' + key] = float(sum(values)) / len(values)
+        # Each process's counters start from zero, so add up the last
+        # sample of each
+        last = {}
+        for s in samples:
+            last[s['pid']] = s
+        for key in CUMULATIVE:
+            if all(key in s for s in last.values()):
+                summary[key] = sum(s[key] for s in last.values())
+        return summary
+
+    def to_json(self):
+        with self._lock:
+            return {
+                'interval_s': self.interval,
+                'nodes': dict((str(i), {'summary': self._summarize(samples),
+                                        'samples': samples})
+                              for (i, samples) in self.samples.items()),
+            }
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_json(), f, indent=2, sort_keys=True)
+
+    def summary(self):
+        """
+        A table of the peak and mean usage of each node
+        """
+        lines = ['%-5s %8s %12s %12s %9s %6s %8s %12s %12s' % (
+            'node', 'samples', 'peak RSS kB', 'mean RSS kB', 'threads',
+            'fds', 'cpu s', 'read B', 'written B')]
+        for (i, stats) in sorted(self.to_json()['nodes'].items(), key=lambda item: int(item[0])):
+            s = stats['summary']
+            lines.append('%-5s %8d %12d %12d %9d %6d %8.2f %12s %12s' % (
+                i, s['samples'], s['peak_rss_kb'], s['mean_rss_kb'],
+                s['peak_threads'], s['peak_fds'], s['cpu_s'],
+                s.get('read_bytes', '-'), s.get('write_bytes', '-')))
+        return '\n'.join(lines)
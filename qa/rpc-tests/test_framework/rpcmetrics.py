@@ -0,0 +1,75 @@
+# Copyright (c) 2017 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# RPCMetrics: collects per-method latency and payload statistics for the
+#             RPC calls made through AuthServiceProxy (see
+#             authproxy.set_metrics_hook)
+#
+
+from array import array
+import json
+import threading
+
+class MethodStats(object):
+    def __init__(self):
+        self.latencies = array('d')
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+
+    def percentile(self, p):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def to_json(self):
+        return {
+            'calls': len(self.latencies),
+            'total_s': sum(self.latencies),
+            'p50_ms': 1000 * self.percentile(0.50),
+            'p99_ms': 1000 * self.percentile(0.99),
+            'max_ms': 1000 * max(self.latencies),
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'retries': self.retries,
+        }
+
+class RPCMetrics(object):
+    def __init__(self):
+        self.methods = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, elapsed, request_bytes, response_bytes, retries):
+        with self._lock:
+            stats = self.methods.get(method)
+            if stats is None:
+                stats = self.methods[method] = MethodStats()
+            stats.latencies.append(elapsed)
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            stats.retries += retries
+
+    def to_json(self):
+        with self._lock:
+            return dict((method, stats.to_json())
+                        for (method, stats) in self.methods.items())
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_json(), f, indent=2, sort_keys=True)
+
+    def summary(self):
+        """
+        A table of the RPC methods that were called, slowest in total first
+        """
+        rows = sorted(self.to_json().items(), key=lambda item: -item[1]['total_s'])
+        lines = ['%-28s %7s %9s %9s %9s %11s %11s %7s' % (
+            'method', 'calls', 'total s', 'p50 ms', 'p99 ms',
+            'sent B', 'received B', 'retries')]
+        for (method, stats) in rows:
+            lines.append('%-28s %7d %9.2f %9.2f %9.2f %11d %11d %7d' % (
+                method, stats['calls'], stats['total_s'], stats['p50_ms'],
+                stats['p99_ms'], stats['request_bytes'],
+                stats['response_bytes'], stats['retries']))
+        return '\n'.join(lines)
@@ -14,7 +14,7 @@ Functionality to build scripts, as well as SignatureHash().
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from test_framework.mininode import CTransaction, CTxOut, hash256
+from test_framework.mininode import BytesWriter, CTransaction, CTxOut, hash256
 
 import sys
 bchr = chr
@@ -888,9 +888,10 @@ def SignatureHash(script, txTo, inIdx, hashtype):
         txtmp.vin = []
         txtmp.vin.append(tmp)
 
-    s = txtmp.serialize()
-    s += struct.pack(b"<I", hashtype)
+    w = BytesWriter()
+    txtmp.serialize_to(w)
+    w.write(struct.pack(b"<I", hashtype))
 
-    hash = hash256(s)
+    hash = hash256(w.buf)
 
     return (hash, None)
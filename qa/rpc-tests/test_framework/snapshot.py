@@ -0,0 +1,204 @@
+# snapshot: cheap copies of the cached regtest datadirs, so that each test
+#           does not have to copy every block and database file it starts from
+#
+# Files that bitcoind never modifies in place are hardlinked. Everything else
+# is cloned with a reflink where the filesystem supports it, copied in the
+# kernel with copy_file_range where that is available, and copied normally
+# otherwise.
+#
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+
+# LevelDB table files are written once and then only ever deleted. Block
+# files are appended to until the next one is started, so all but the last
+# are immutable too. Undo files are not: undo data is written to the rev file
+# numbered like the block's blk file, so connecting an old block (after a
+# reorg, or with -reindex) appends to an old rev file.
+IMMUTABLE_FILE = re.compile(r'.*\.(ldb|sst)$')
+BLOCK_FILE = re.compile(r'^blk(\d+)\.dat$')
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+# Errors meaning that a way of copying is not supported for a given pair of
+# files, so the next one should be tried
+UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL,
+               errno.ENOSYS, errno.EPERM)
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+try:
+    _copy_file_range = _libc.copy_file_range
+    _copy_file_range.restype = ctypes.c_ssize_t
+    _copy_file_range.argtypes = [ctypes.c_int, ctypes.c_void_p,
+                                 ctypes.c_int, ctypes.c_void_p,
+                                 ctypes.c_size_t, ctypes.c_uint]
+except AttributeError:
+    # glibc older than 2.27
+    _copy_file_range = None
+
+COPY_CHUNK = 1 << 30
+
+class CloneStats(object):
+    def __init__(self):
+        self.linked = 0
+        self.reflinked = 0
+        self.kernel_copied = 0
+        self.copied = 0
+
+    def __repr__(self):
+        return "CloneStats(linked=%d reflinked=%d kernel_copied=%d copied=%d)" \
+            % (self.linked, self.reflinked, self.kernel_copied, self.copied)
+
+def _reflink(src, dst):
+    try:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except IOError as e:
+        if e.errno in UNSUPPORTED:
+            return False
+        raise
+
+def _kernel_copy(src, dst):
+    if _copy_file_range is None:
+        return False
+    remaining = os.fstat(src.fileno()).st_size
+    while remaining > 0:
+        n = _copy_file_range(src.fileno(), None, dst.fileno(), None,
+                             min(remaining, COPY_CHUNK), 0)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in UNSUPPORTED and remaining == os.fstat(src.fileno()).st_size:
+                return False
+            raise OSError(err, os.strerror(err))
+        if n == 0:
+            break
+        remaining -= n
+    return True
+
+def clone_file(src, dst, stats=None):
+    """
+    Copy the file src to dst, sharing its blocks with src if the filesystem
+    supports it
+    """
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            if _reflink(fsrc, fdst):
+                kind = 'reflinked'
+            elif _kernel_copy(fsrc, fdst):
+                kind = 'kernel_copied'
+            else:
+                # Nothing was written yet, so start the copy from scratch
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+                shutil.copyfileobj(fsrc, fdst, 1 << 20)
+                kind = 'copied'
+    shutil.copystat(src, dst)
+    if stats is not None:
+        setattr(stats, kind, getattr(stats, kind) + 1)
+
+def _immutable_files(names):
+    # The highest-numbered block file is still being appended to
+    numbers = [int(m.group(1)) for m in map(BLOCK_FILE.match, names) if m]
+    last = max(numbers) if numbers else None
+    immutable = set()
+    for name in names:
+        m = BLOCK_FILE.match(name)
+        if m and int(m.group(1)) < last:
+            immutable.add(name)
+        elif IMMUTABLE_FILE.match(name):
+            immutable.add(name)
+    return immutable
+
+def clone_tree(src, dst, stats=None):
+    """
+    Recreate the directory tree src at dst, like shutil.copytree, with
+    immutable files hardlinked and the rest cloned with clone_file
+    """
+    names = os.listdir(src)
+    os.makedirs(dst)
+    immutable = _immutable_files(names)
+    for name in names:
+        srcname = os.path.join(src, name)
+        dstname = os.path.join(dst, name)
+        if os.path.islink(srcname):
+            os.symlink(os.readlink(srcname), dstname)
+        elif os.path.isdir(srcname):
+            clone_tree(srcname, dstname, stats)
+        elif name in immutable:
+            try:
+                os.link(srcname, dstname)
+                if stats is not None:
+                    stats.linked += 1
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                clone_file(srcname, dstname, stats)
+        else:
+            clone_file(srcname, dstname, stats)
+    shutil.copystat(src, dst)
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class CacheVersion(object):
+    """
+    Identifies the bitcoind binary and chain parameters that a cache
+    directory was built with, so that a stale cache is rebuilt rather than
+    reused. The binary's digest is stored along with its size and mtime, and
+    is only recomputed when those change.
+    """
+    FILENAME = "VERSION"
+
+    def __init__(self, cachedir, binary, params):
+        self.path = os.path.join(cachedir, self.FILENAME)
+        self.binary = binary
+        self.params = params
+
+    def _binary_info(self):
+        if self.binary is None or not os.path.isfile(self.binary):
+            return None
+        st = os.stat(self.binary)
+        return {'size': st.st_size, 'mtime': st.st_mtime}
+
+    def _stored(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _current(self, stored):
+        info = self._binary_info()
+        if info is None:
+            digest = None
+        elif stored is not None and stored.get('binary') == info:
+            digest = stored.get('binary_sha256')
+        else:
+            digest = file_digest(self.binary)
+        return {'binary': info, 'binary_sha256': digest, 'params': self.params}
+
+    def is_current(self):
+        stored = self._stored()
+        if stored is None:
+            return False
+        current = self._current(stored)
+        return (stored.get('binary_sha256') == current['binary_sha256'] and
+                stored.get('params') == current['params'])
+
+    def write(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self._current(None), f, indent=2, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
@@ -0,0 +1,191 @@
+# SolutionCache: a persistent map from block header templates to Equihash
+#                solutions, so that tests which mine the same deterministic
+#                blocks on every run only have to solve them once
+#
+
+import anydbm
+import atexit
+import fcntl
+import os
+import struct
+
+# Entries are keyed by the 108-byte header prefix that precedes nNonce, plus
+# the Equihash parameters. Values are the last-used clock, the 32-byte nonce
+# and the solution.
+ENTRY_HEADER = struct.Struct("<Q")
+PARAMS = struct.Struct("<II")
+META = struct.Struct("<QQ")
+META_KEY = "\x00meta"
+# A uint256 nonce, as serialized in a block header
+NONCE = struct.Struct("<4Q")
+
+DEFAULT_MAX_ENTRIES = 10000
+
+def _ser_nonce(nonce):
+    return NONCE.pack(nonce & 0xFFFFFFFFFFFFFFFFL,
+                      (nonce >> 64) & 0xFFFFFFFFFFFFFFFFL,
+                      (nonce >> 128) & 0xFFFFFFFFFFFFFFFFL,
+                      (nonce >> 192) & 0xFFFFFFFFFFFFFFFFL)
+
+def _deser_nonce(s):
+    (a, b, c, d) = NONCE.unpack(s)
+    return long(a) | (b << 64) | (c << 128) | (d << 192)
+
+class SolutionCache(object):
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Loaded from the database on first use: key -> [clock, value]
+        self._entries = None
+        self._clock = 0
+        # Keys used or added since the last flush, in the order they were used
+        self._dirty = []
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    # The database is only opened to load it and to flush changes to it,
+    # while holding an exclusive lock, because test scripts running in
+    # parallel may share the cache.
+    def _open(self):
+        lockfile = open(self.path + ".lock", "a")
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            return (lockfile, anydbm.open(self.path, 'c'))
+        except:
+            lockfile.close()
+            raise
+
+    def _close(self, handle):
+        (lockfile, db) = handle
+        try:
+            db.close()
+        finally:
+            lockfile.close()
+
+    @staticmethod
+    def _key(header, n, k):
+        assert len(header) == 108
+        return str(header) + PARAMS.pack(n, k)
+
+    @staticmethod
+    def _meta(db):
+        try:
+            return META.unpack(db[META_KEY])
+        except KeyError:
+            return (0, 0)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        handle = self._open()
+        try:
+            db = handle[1]
+            self._clock = self._meta(db)[0]
+            self._entries = {}
+            for key in db.keys():
+                if key != META_KEY:
+                    value = db[key]
+                    clock = ENTRY_HEADER.unpack(value[:ENTRY_HEADER.size])[0]
+                    self._entries[key] = [clock, value[ENTRY_HEADER.size:]]
+        finally:
+            self._close(handle)
+
+    def _touch(self, key):
+        self._clock += 1
+        self._entries[key][0] = self._clock
+        self._dirty.append(key)
+
+    # Returns (nNonce, nSolution) for the given header prefix, or None.
+    def get(self, header, n, k):
+        key = self._key(header, n, k)
+        self._load()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._touch(key)
+        self.hits += 1
+        value = entry[1]
+        return (_deser_nonce(value[:32]), bytearray(value[32:]))
+
+    def put(self, header, n, k, nonce, solution):
+        key = self._key(header, n, k)
+        self._load()
+        self._entries[key] = [0, _ser_nonce(nonce) + str(solution)]
+        self._touch(key)
+
+    # Writes the entries used or added since the last flush to the database,
+    # merging them with those other processes have written meanwhile.
+    def flush(self):
+        if not self._dirty:
+            return
+        handle = self._open()
+        try:
+            db = handle[1]
+            (clock, count) = self._meta(db)
+            dirty = sorted(set(self._dirty), key=lambda key: self._entries[key][0])
+            for key in dirty:
+                clock += 1
+                if not db.has_key(key):
+                    count += 1
+                db[key] = ENTRY_HEADER.pack(clock) + self._entries[key][1]
+            if count > self.max_entries:
+                count = self._evict(db)
+            db[META_KEY] = META.pack(clock, count)
+        finally:
+            self._close(handle)
+        self._dirty = []
+
+    # Flushes the cache. It is loaded again if it is used after this.
+    def close(self):
+        self.flush()
+        self._entries = None
+
+    # Drops the least recently used entries until the cache is at 90% of its
+    # capacity, so that eviction does not run on every insertion once full.
+    def _evict(self, db):
+        keep = self.max_entries * 9 // 10
+        entries = []
+        for key in db.keys():
+            if key != META_KEY:
+                clock = ENTRY_HEADER.unpack(db[key][:ENTRY_HEADER.size])[0]
+                entries.append((clock, key))
+        entries.sort()
+        for (clock, key) in entries[:max(0, len(entries) - keep)]:
+            del db[key]
+        return min(len(entries), keep)
+
+    def __len__(self):
+        self.flush()
+        handle = self._open()
+        try:
+            return self._meta(handle[1])[1]
+        finally:
+            self._close(handle)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+
+_default_cache = None
+_default_cache_loaded = False
+
+# The cache shared by CBlock.solve(), or None. It is only used if
+# ZCASH_SOLUTION_CACHE is set to the path of the database, which is created
+# if needed. It is loaded once per process, and flushed when the process
+# exits.
+def default_solution_cache():
+    global _default_cache, _default_cache_loaded
+    if not _default_cache_loaded:
+        path = os.environ.get("ZCASH_SOLUTION_CACHE")
+        if path:
+            _default_cache = SolutionCache(path)
+            atexit.register(_default_cache.close)
+        _default_cache_loaded = True
+    return _default_cache
@@ -13,11 +13,14 @@ import shutil
 import tempfile
 import traceback
 
-from authproxy import JSONRPCException
+from authproxy import JSONRPCException, set_metrics_hook
+from nodeprofiler import NodeProfiler
+from rpcmetrics import RPCMetrics
 from util import assert_equal, check_json_precision, \
     initialize_chain, initialize_chain_clean, \
     start_nodes, connect_nodes_bi, stop_nodes, \
-    sync_blocks, sync_mempools, wait_bitcoinds
+    sync_blocks, sync_mempools, wait_bitcoinds, PortSeed, \
+    node_phase_times, node_phase_summary, bitcoind_processes
 
 
 class BitcoinTestFramework(object):
@@ -99,6 +102,16 @@ class BitcoinTestFramework(object):
                           help="Root directory for datadirs")
         parser.add_option("--tracerpc", dest="trace_rpc", default=False, action="store_true",
                           help="Print out all RPC calls as they are made")
+        parser.add_option("--portseed", dest="port_seed", default=os.getpid(), type='int',
+                          help="The seed to use for assigning port numbers (default: current process id)")
+        parser.add_option("--nodetimes", dest="node_times", default=False, action="store_true",
+                          help="Print the time spent starting and stopping nodes")
+        parser.add_option("--rpcmetrics-json", dest="rpcmetrics_json", default=None,
+                          help="Print per-method RPC timing and payload statistics, and write them to this JSON file")
+        parser.add_option("--profile-nodes", dest="profile_nodes", default=None,
+                          help="Sample the CPU, memory, disk I/O and file descriptors of each bitcoind, print them with the node start/stop times, and write them to this JSON file")
+        parser.add_option("--profile-interval", dest="profile_interval", default=0.5, type='float',
+                          help="Seconds between samples taken by --profile-nodes (default: %default)")
         self.add_options(parser)
         (self.options, self.args) = parser.parse_args()
 
@@ -106,10 +119,22 @@ class BitcoinTestFramework(object):
             import logging
             logging.basicConfig(level=logging.DEBUG)
 
+        PortSeed.n = self.options.port_seed
+
         os.environ['PATH'] = self.options.srcdir+":"+os.environ['PATH']
 
         check_json_precision()
 
+        rpc_metrics = None
+        if self.options.rpcmetrics_json:
+            rpc_metrics = RPCMetrics()
+            set_metrics_hook(rpc_metrics)
+
+        profiler = None
+        if self.options.profile_nodes:
+            profiler = NodeProfiler(bitcoind_processes, self.options.profile_interval)
+            profiler.start()
+
         success = False
         try:
             if not os.path.isdir(self.options.tmpdir):
@@ -139,10 +164,28 @@ class BitcoinTestFramework(object):
         else:
             print("Note: bitcoinds were not stopped and may still be running")
 
+        if profiler is not None:
+            profiler.stop()
+
         if not self.options.nocleanup and not self.options.noshutdown:
             print("Cleaning up")
             shutil.rmtree(self.options.tmpdir)
 
+        # Metrics are only reported when asked for, to keep test logs short
+        if rpc_metrics is not None:
+            set_metrics_hook(None)
+            if rpc_metrics.methods:
+                print("RPC calls:")
+                print(rpc_metrics.summary())
+            rpc_metrics.write_json(self.options.rpcmetrics_json)
+        if (self.options.node_times or profiler is not None) and node_phase_times:
+            print("Node start/stop times:")
+            print(node_phase_summary())
+        if profiler is not None:
+            print("Node resource usage:")
+            print(profiler.summary())
+            profiler.write_json(self.options.profile_nodes)
+
         if success:
             print("Tests successful")
             sys.exit(0)
@@ -9,24 +9,48 @@
 
 # Add python-bitcoinrpc to module search path:
 import os
-import sys
 
 from binascii import hexlify, unhexlify
 from base64 import b64encode
+from collections import OrderedDict
 from decimal import Decimal, ROUND_DOWN
+from distutils.spawn import find_executable
+import cStringIO
+import errno
 import json
 import random
 import shutil
 import subprocess
+import threading
 import time
 import re
 
-from authproxy import AuthServiceProxy
+from authproxy import AuthServiceProxy, JSONRPCException
+from blocktools import create_block, create_miner_coinbase
+from mininode import CTransaction, start_solver_pool, stop_solver_pool
+from snapshot import CacheVersion, clone_tree
+
+# The maximum number of nodes a single test can spawn
+MAX_NODES = 8
+# Don't assign rpc or p2p ports lower than this
+PORT_MIN = 11000
+# The number of ports to "reserve" for p2p and rpc, each
+PORT_RANGE = 5000
+# Port seeds 0 to PORT_SEEDS-1 give disjoint port ranges; larger seeds wrap
+# around onto them
+PORT_SEEDS = (PORT_RANGE - 1 - MAX_NODES) // MAX_NODES
+
+class PortSeed:
+    # Tests running at the same time must use different seeds, which gives
+    # them disjoint port ranges. Test scripts take it from --portseed.
+    n = os.getpid()
 
 def p2p_port(n):
-    return 11000 + n + os.getpid()%999
+    assert(n < MAX_NODES)
+    return PORT_MIN + n + (MAX_NODES * PortSeed.n) % (PORT_RANGE - 1 - MAX_NODES)
 def rpc_port(n):
-    return 12000 + n + os.getpid()%999
+    assert(n < MAX_NODES)
+    return PORT_MIN + PORT_RANGE + n + (MAX_NODES * PortSeed.n) % (PORT_RANGE - 1 - MAX_NODES)
 
 def check_json_precision():
     """Make sure json library being used does not lose precision converting BTC values"""
@@ -44,22 +68,32 @@ def hex_str_to_bytes(hex_str):
 def str_to_b64str(string):
     return b64encode(string.encode('utf-8')).decode('ascii')
 
+def backoff_intervals(initial=0.01, maximum=1):
+    """
+    Sleep intervals for polling: start short, so that conditions which are
+    already nearly true are noticed quickly, and double up to maximum
+    """
+    interval = min(initial, maximum)
+    while True:
+        yield interval
+        interval = min(interval * 2, maximum)
+
 def sync_blocks(rpc_connections, wait=1):
     """
     Wait until everybody has the same block count
     """
-    while True:
+    for interval in backoff_intervals(maximum=wait):
         counts = [ x.getblockcount() for x in rpc_connections ]
         if counts == [ counts[0] ]*len(counts):
             break
-        time.sleep(wait)
+        time.sleep(interval)
 
 def sync_mempools(rpc_connections, wait=1):
     """
     Wait until everybody has the same transactions in their memory
     pools
     """
-    while True:
+    for interval in backoff_intervals(maximum=wait):
         pool = set(rpc_connections[0].getrawmempool())
         num_match = 1
         for i in range(1, len(rpc_connections)):
@@ -67,10 +101,22 @@ def sync_mempools(rpc_connections, wait=1):
                 num_match = num_match+1
         if num_match == len(rpc_connections):
             break
-        time.sleep(wait)
+        time.sleep(interval)
 
 bitcoind_processes = {}
 
+# Total seconds spent in each phase of starting and stopping nodes, and the
+# number of nodes involved, for the report printed by BitcoinTestFramework
+node_phase_times = OrderedDict()
+
+def record_node_phase(phase, elapsed, num_nodes):
+    (total, count) = node_phase_times.get(phase, (0.0, 0))
+    node_phase_times[phase] = (total + elapsed, count + num_nodes)
+
+def node_phase_summary():
+    return '\n'.join("  %-8s %8.2f s (%d nodes)" % (phase, total, count)
+                     for (phase, (total, count)) in node_phase_times.items())
+
 def initialize_datadir(dirname, n):
     datadir = os.path.join(dirname, "node"+str(n))
     if not os.path.isdir(datadir):
@@ -85,6 +131,90 @@ def initialize_datadir(dirname, n):
         f.write("listenonion=0\n");
     return datadir
 
+# Everything besides the bitcoind binary that determines the contents of the
+# cached chain. The cache is rebuilt when any of these change.
+CACHE_NODES = 4
+CACHE_CHAIN_PARAMS = {
+    'nodes': CACHE_NODES,
+    'rounds': 2,
+    'blocks_per_peer': 25,
+    'start_time': 1388534400,
+    'block_interval': 10*60,
+    'args': [ "-keypool=1", "-discover=0" ],
+}
+
+def coinbase_script(rpc, blockhash):
+    """
+    Return the scriptPubKey that the coinbase of a block mined by rpc's
+    wallet pays to
+    """
+    txid = rpc.getblock(blockhash)['tx'][0]
+    tx = CTransaction()
+    tx.deserialize(cStringIO.StringIO(unhexlify(rpc.gettransaction(txid)['hex'])))
+    return tx.vout[0].scriptPubKey
+
+def build_cache_chain(rpcs, workers=1):
+    """
+    Create a 200-block-long chain; each of the 4 nodes
+    gets 25 mature blocks and 25 immature.
+    Blocks are created with timestamps 10 minutes apart, starting
+    at 1 Jan 2014, as generate(1) creates them when the mocktime of
+    every node is stepped 10 minutes per block.
+    Each node's first block is mined with generate(1), which shows the
+    script that its wallet pays coinbases to (generate returns the key
+    to the keypool). The node's other blocks pay to the same script,
+    are solved here with the given number of solver workers, and are
+    submitted in one RPC batch that steps the node's mocktime to each
+    block's time before submitting it.
+    """
+    start = time.time()
+    interval = CACHE_CHAIN_PARAMS['block_interval']
+    block_time = CACHE_CHAIN_PARAMS['start_time']
+    scripts = [ None ] * len(rpcs)
+    bits = None
+    for i in range(CACHE_CHAIN_PARAMS['rounds']):
+        for peer in range(len(rpcs)):
+            count = CACHE_CHAIN_PARAMS['blocks_per_peer']
+            if scripts[peer] is None:
+                set_node_times(rpcs, block_time)
+                blockhash = rpcs[peer].generate(1)[0]
+                scripts[peer] = coinbase_script(rpcs[peer], blockhash)
+                block_time += interval
+                count -= 1
+            tip = rpcs[peer].getblock(rpcs[peer].getbestblockhash())
+            if bits is None:
+                # Regtest difficulty never changes
+                bits = int(tip['bits'], 16)
+            blocks = []
+            hashprev = int(tip['hash'], 16)
+            for height in range(tip['height'] + 1, tip['height'] + 1 + count):
+                block = create_block(hashprev, create_miner_coinbase(height, scripts[peer]),
+                                     block_time, bits)
+                block.solve(workers=workers)
+                blocks.append(block)
+                hashprev = block.sha256
+                block_time += interval
+            # The other nodes only relay the blocks; give them the time of
+            # the last one, as stepping them would have
+            set_node_times(rpcs[:peer] + rpcs[peer+1:], block_time - interval)
+            with rpcs[peer].batch() as batch:
+                results = []
+                for block in blocks:
+                    batch.setmocktime(block.nTime)
+                    results.append(batch.submitblock(hexlify(block.serialize())))
+            for (block, result) in zip(blocks, results):
+                if result.result() is not None:
+                    raise AssertionError("submitblock rejected block %s: %s"
+                                         % (block.hash, result.result()))
+            # Must sync before next peer starts generating blocks
+            sync_blocks(rpcs)
+    print "Built cache chain of %d blocks in %.1f s" % (
+        rpcs[0].getblockcount(), time.time() - start)
+
+def cache_version():
+    binary = find_executable(os.getenv("BITCOIND", "bitcoind"))
+    return CacheVersion("cache", binary, CACHE_CHAIN_PARAMS)
+
 def initialize_chain(test_dir):
     """
     Create (or copy from cache) a 200-block-long chain and
@@ -92,58 +222,51 @@ def initialize_chain(test_dir):
     bitcoind and bitcoin-cli must be in search path.
     """
 
+    version = cache_version()
+    if os.path.isdir(os.path.join("cache", "node0")) and not version.is_current():
+        print "Rebuilding stale cache"
+        for i in range(CACHE_NODES):
+            shutil.rmtree(os.path.join("cache", "node"+str(i)), ignore_errors=True)
+
     if not os.path.isdir(os.path.join("cache", "node0")):
-        devnull = open("/dev/null", "w+")
         # Create cache directories, run bitcoinds:
-        for i in range(4):
+        for i in range(CACHE_NODES):
             datadir=initialize_datadir("cache", i)
-            args = [ os.getenv("BITCOIND", "bitcoind"), "-keypool=1", "-datadir="+datadir, "-discover=0" ]
+            args = [ os.getenv("BITCOIND", "bitcoind"), "-datadir="+datadir ] + CACHE_CHAIN_PARAMS['args']
             if i > 0:
                 args.append("-connect=127.0.0.1:"+str(p2p_port(0)))
             bitcoind_processes[i] = subprocess.Popen(args)
-            if os.getenv("PYTHON_DEBUG", ""):
-                print "initialize_chain: bitcoind started, calling bitcoin-cli -rpcwait getblockcount"
-            subprocess.check_call([ os.getenv("BITCOINCLI", "bitcoin-cli"), "-datadir="+datadir,
-                                    "-rpcwait", "getblockcount"], stdout=devnull)
-            if os.getenv("PYTHON_DEBUG", ""):
-                print "initialize_chain: bitcoin-cli -rpcwait getblockcount completed"
-        devnull.close()
+        # Blocks are solved in parallel, by workers forked before any
+        # connections are opened
+        workers = start_solver_pool()
+        if os.getenv("PYTHON_DEBUG", ""):
+            print "initialize_chain: bitcoinds started, waiting for RPC"
         rpcs = []
-        for i in range(4):
-            try:
-                url = "http://rt:rt@127.0.0.1:%d"%(rpc_port(i),)
-                rpcs.append(AuthServiceProxy(url))
-            except:
-                sys.stderr.write("Error connecting to "+url+"\n")
-                sys.exit(1)
-
-        # Create a 200-block-long chain; each of the 4 nodes
-        # gets 25 mature blocks and 25 immature.
-        # blocks are created with timestamps 10 minutes apart, starting
-        # at 1 Jan 2014
-        block_time = 1388534400
-        for i in range(2):
-            for peer in range(4):
-                for j in range(25):
-                    set_node_times(rpcs, block_time)
-                    rpcs[peer].generate(1)
-                    block_time += 10*60
-                # Must sync before next peer starts generating blocks
-                sync_blocks(rpcs)
+        for i in range(CACHE_NODES):
+            rpcs.append(AuthServiceProxy(rpc_url(i)))
+            wait_for_bitcoind_start(bitcoind_processes[i], rpcs[i])
+        if os.getenv("PYTHON_DEBUG", ""):
+            print "initialize_chain: RPC ready"
+
+        try:
+            build_cache_chain(rpcs, workers)
+        finally:
+            stop_solver_pool()
 
         # Shut them down, and clean up cache directories:
         stop_nodes(rpcs)
         wait_bitcoinds()
-        for i in range(4):
+        for i in range(CACHE_NODES):
             os.remove(log_filename("cache", i, "debug.log"))
             os.remove(log_filename("cache", i, "db.log"))
             os.remove(log_filename("cache", i, "peers.dat"))
             os.remove(log_filename("cache", i, "fee_estimates.dat"))
+        version.write()
 
-    for i in range(4):
+    for i in range(CACHE_NODES):
         from_dir = os.path.join("cache", "node"+str(i))
         to_dir = os.path.join(test_dir,  "node"+str(i))
-        shutil.copytree(from_dir, to_dir)
+        clone_tree(from_dir, to_dir)
         initialize_datadir(test_dir, i) # Overwrite port/rpcport in zcash.conf
 
 def initialize_chain_clean(test_dir, num_nodes):
@@ -155,29 +278,44 @@ def initialize_chain_clean(test_dir, num_nodes):
         initialize_datadir(test_dir, i)
 
 
-def _rpchost_to_args(rpchost):
-    '''Convert optional IP:port spec to rpcconnect/rpcport args'''
+def rpc_url(i, rpchost=None):
+    '''Return the RPC URL of node i, given an optional IP:port spec'''
     if rpchost is None:
-        return []
+        return "http://rt:rt@127.0.0.1:%d" % (rpc_port(i),)
 
     match = re.match('(\[[0-9a-fA-f:]+\]|[^:]+)(?::([0-9]+))?$', rpchost)
     if not match:
         raise ValueError('Invalid RPC host spec ' + rpchost)
 
     rpcconnect = match.group(1)
-    rpcport = match.group(2)
-
-    if rpcconnect.startswith('['): # remove IPv6 [...] wrapping
-        rpcconnect = rpcconnect[1:-1]
+    rpcport = match.group(2) or rpc_port(i)
+    return "http://rt:rt@%s:%d" % (rpcconnect, int(rpcport))
 
-    rv = ['-rpcconnect=' + rpcconnect]
-    if rpcport:
-        rv += ['-rpcport=' + rpcport]
-    return rv
-
-def start_node(i, dirname, extra_args=None, rpchost=None, timewait=None, binary=None):
+def wait_for_bitcoind_start(process, proxy):
     """
-    Start a bitcoind and return RPC connection to it
+    Wait until bitcoind's RPC interface is accessible and initialized,
+    polling with exponential backoff. Raise an exception if bitcoind exits
+    during initialization.
+    """
+    for interval in backoff_intervals(maximum=0.5):
+        if process.poll() is not None:
+            raise Exception("bitcoind exited with status %i during initialization" % process.returncode)
+        try:
+            proxy.getblockcount()
+            return
+        except IOError as e:
+            # Port not yet open?
+            if e.errno not in (errno.ECONNREFUSED, errno.ECONNRESET):
+                raise
+        except JSONRPCException as e:
+            # RPC in warmup?
+            if e.error['code'] != -28:
+                raise
+        time.sleep(interval)
+
+def launch_node(i, dirname, extra_args=None, binary=None):
+    """
+    Start a bitcoind without waiting for it to be ready
     """
     datadir = os.path.join(dirname, "node"+str(i))
     if binary is None:
@@ -185,43 +323,83 @@ def start_node(i, dirname, extra_args=None, rpchost=None, timewait=None, binary=
     args = [ binary, "-datadir="+datadir, "-keypool=1", "-discover=0", "-rest" ]
     if extra_args is not None: args.extend(extra_args)
     bitcoind_processes[i] = subprocess.Popen(args)
-    devnull = open("/dev/null", "w+")
-    if os.getenv("PYTHON_DEBUG", ""):
-        print "start_node: bitcoind started, calling bitcoin-cli -rpcwait getblockcount"
-    subprocess.check_call([ os.getenv("BITCOINCLI", "bitcoin-cli"), "-datadir="+datadir] +
-                          _rpchost_to_args(rpchost)  +
-                          ["-rpcwait", "getblockcount"], stdout=devnull)
-    if os.getenv("PYTHON_DEBUG", ""):
-        print "start_node: calling bitcoin-cli -rpcwait getblockcount returned"
-    devnull.close()
-    url = "http://rt:rt@%s:%d" % (rpchost or '127.0.0.1', rpc_port(i))
+
+def node_proxy(i, rpchost=None, timewait=None):
+    """
+    Wait for bitcoind i to be ready, and return an RPC connection to it
+    """
+    url = rpc_url(i, rpchost)
     if timewait is not None:
         proxy = AuthServiceProxy(url, timeout=timewait)
     else:
         proxy = AuthServiceProxy(url)
+    if os.getenv("PYTHON_DEBUG", ""):
+        print "start_node: bitcoind started, waiting for RPC"
+    wait_for_bitcoind_start(bitcoind_processes[i], proxy)
+    if os.getenv("PYTHON_DEBUG", ""):
+        print "start_node: RPC ready"
     proxy.url = url # store URL on proxy for info
     return proxy
 
+def start_node(i, dirname, extra_args=None, rpchost=None, timewait=None, binary=None):
+    """
+    Start a bitcoind and return RPC connection to it
+    """
+    start = time.time()
+    launch_node(i, dirname, extra_args, binary)
+    proxy = node_proxy(i, rpchost, timewait)
+    record_node_phase("start", time.time() - start, 1)
+    return proxy
+
 def start_nodes(num_nodes, dirname, extra_args=None, rpchost=None, binary=None):
     """
     Start multiple bitcoinds, return RPC connections to them
     """
     if extra_args is None: extra_args = [ None for i in range(num_nodes) ]
     if binary is None: binary = [ None for i in range(num_nodes) ]
-    return [ start_node(i, dirname, extra_args[i], rpchost, binary=binary[i]) for i in range(num_nodes) ]
+    # Launch every node before waiting for any of them, so that they load
+    # in parallel
+    start = time.time()
+    for i in range(num_nodes):
+        launch_node(i, dirname, extra_args[i], binary[i])
+    proxies = [ node_proxy(i, rpchost) for i in range(num_nodes) ]
+    record_node_phase("start", time.time() - start, num_nodes)
+    return proxies
 
 def log_filename(dirname, n_node, logname):
     return os.path.join(dirname, "node"+str(n_node), "regtest", logname)
 
 def stop_node(node, i):
+    start = time.time()
     node.stop()
+    node.close()
     bitcoind_processes[i].wait()
     del bitcoind_processes[i]
+    record_node_phase("stop", time.time() - start, 1)
 
 def stop_nodes(nodes):
-    for node in nodes:
-        node.stop()
-    del nodes[:] # Emptying array closes connections as a side effect
+    # Ask every node to stop before waiting for any; wait_bitcoinds then
+    # waits for them to exit together
+    start = time.time()
+    errors = []
+    def stop(node):
+        try:
+            node.stop()
+        except Exception as e:
+            errors.append(e)
+    threads = [ threading.Thread(target=stop, args=(node,)) for node in nodes ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for node in nodes:
+            node.close()
+    finally:
+        record_node_phase("stop", time.time() - start, len(nodes))
+        del nodes[:]
+    if errors:
+        raise errors[0]
 
 def set_node_times(nodes, t):
     for node in nodes:
@@ -229,8 +407,10 @@ def set_node_times(nodes, t):
 
 def wait_bitcoinds():
     # Wait for all bitcoinds to cleanly exit
+    start = time.time()
     for bitcoind in bitcoind_processes.values():
         bitcoind.wait()
+    record_node_phase("exit", time.time() - start, len(bitcoind_processes))
     bitcoind_processes.clear()
 
 def connect_nodes(from_connection, node_num):
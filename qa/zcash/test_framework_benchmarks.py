@@ -0,0 +1,1270 @@
+#!/usr/bin/env python2
+# Copyright (c) 2017 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# Benchmarks for the Python RPC test framework in qa/rpc-tests.
+#
+# To use:
+# - ./qa/zcash/test_framework_benchmarks.py            (run all benchmarks)
+# - ./qa/zcash/test_framework_benchmarks.py equihash   (run one benchmark)
+#
+
+import argparse
+import BaseHTTPServer
+import cStringIO
+import decimal
+import json
+import multiprocessing
+import os
+import random
+import resource
+import select
+import shutil
+import socket
+import SocketServer
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+REPOROOT = os.path.dirname(
+    os.path.dirname(
+        os.path.dirname(
+            os.path.abspath(__file__)
+        )
+    )
+)
+
+sys.path.insert(0, os.path.join(REPOROOT, 'qa', 'rpc-tests'))
+
+from test_framework import authproxy, equihash, mininode
+from test_framework.authproxy import AuthServiceProxy, JSONRPCException
+from test_framework.rpcmetrics import RPCMetrics
+from test_framework.snapshot import CacheVersion, CloneStats, clone_tree
+from test_framework.solutioncache import SolutionCache
+
+
+def timed(f, *args):
+    start = time.time()
+    result = f(*args)
+    return result, time.time() - start
+
+def equihash_header(nonce):
+    # I||V for an all-zero 108-byte header prefix
+    return b'\x00' * 108 + struct.pack('<8I', *[(nonce >> (32*i)) & 0xFFFFFFFF for i in range(8)])
+
+def equihash_digest(n, k, nonce):
+    return equihash.header_digest(equihash_header(nonce), n, k)
+
+def equihash_solutions(n, k, count):
+    solutions = []
+    nonce = 0
+    while len(solutions) < count:
+        for soln in equihash.gbp_default(equihash_digest(n, k, nonce), n, k):
+            solutions.append((equihash_header(nonce), soln))
+        nonce += 1
+    return solutions[:count]
+
+
+#
+# Benchmarks
+#
+
+def bench_equihash(args):
+    if equihash.np is None:
+        print('NumPy is not installed; skipping gbp_numpy benchmark.')
+        return True
+    ret = True
+    for (n, k, nonces) in [(48, 5, args.nonces), (96, 5, 1)]:
+        basic_time = numpy_time = 0.0
+        num_solns = 0
+        for nonce in range(nonces):
+            digest = equihash_digest(n, k, nonce)
+            equihash.index_hash_table.clear()
+            basic, elapsed = timed(equihash.gbp_basic, digest, n, k)
+            basic_time += elapsed
+            equihash.index_hash_table.clear()
+            fast, elapsed = timed(list, equihash.gbp_numpy(digest, n, k))
+            numpy_time += elapsed
+            num_solns += len(basic)
+            if fast != basic:
+                print('FAIL: n=%d k=%d nonce=%d: gbp_numpy differs from gbp_basic'
+                      % (n, k, nonce))
+                ret = False
+        print('n=%d k=%d: %d nonces, %d solutions' % (n, k, nonces, num_solns))
+        print('  gbp_basic: %8.1f ms/nonce' % (1000 * basic_time / nonces))
+        print('  gbp_numpy: %8.1f ms/nonce (%.1fx)'
+              % (1000 * numpy_time / nonces, basic_time / numpy_time))
+    return ret
+
+
+def bench_solve(args):
+    workers = max(2, multiprocessing.cpu_count())
+    times = {}
+    nonces = []
+    ret = True
+    # As a test would, start the pool before anything else
+    mininode.start_solver_pool(workers)
+    for w in [1, workers]:
+        blocks = []
+        for i in range(args.solve_blocks):
+            block = mininode.CBlock()
+            block.nTime = i
+            block.nBits = 0x200f0f0f # regtest
+            block.vtx.append(simple_tx(i))
+            block.hashMerkleRoot = block.calc_merkle_root()
+            blocks.append(block)
+        equihash.index_hash_table.clear()
+        start = time.time()
+        for block in blocks:
+            block.solve(workers=w, cache=None)
+        times[w] = time.time() - start
+        if not all(block.is_valid() for block in blocks):
+            print('FAIL: solve(workers=%d) produced an invalid block' % w)
+            ret = False
+        nonces.append([(block.nNonce, block.nSolution) for block in blocks])
+    mininode.stop_solver_pool()
+    if nonces[0] != nonces[1]:
+        print('FAIL: solve(workers=%d) found different solutions' % workers)
+        ret = False
+    print('%d regtest blocks, mean nonce %.1f (%d CPUs):'
+          % (args.solve_blocks,
+             sum(nonce for (nonce, _) in nonces[0]) / float(args.solve_blocks),
+             multiprocessing.cpu_count()))
+    for w in [1, workers]:
+        print('  workers=%-2d %8.1f ms/block' % (w, 1000 * times[w] / args.solve_blocks))
+    return ret
+
+
+def first_solution(args):
+    # Runs in a fresh worker process, so that ru_maxrss reflects the solver
+    (solver, n, k, early) = args
+    with open('/proc/self/statm') as f:
+        start_rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    start = time.time()
+    nonce = 0
+    while True:
+        solns = getattr(equihash, solver)(equihash_digest(n, k, nonce), n, k)
+        if not early:
+            solns = list(solns)
+        soln = next(iter(solns), None)
+        if soln is not None:
+            break
+        nonce += 1
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return (nonce, soln, elapsed, peak_rss - start_rss)
+
+def bench_firstsolution(args):
+    # Each generator backend is timed both stopping at its first solution,
+    # and collecting all of the solutions for the nonce first.
+    solvers = [('gbp_basic_iter', False), ('gbp_basic_iter', True)]
+    if equihash.np is not None:
+        solvers += [('gbp_numpy', False), ('gbp_numpy', True)]
+    ret = True
+    for (n, k) in [(48, 5), (96, 5)]:
+        results = {}
+        for (solver, early) in solvers:
+            pool = multiprocessing.Pool(1)
+            try:
+                results[(solver, early)] = pool.apply(first_solution, [(solver, n, k, early)])
+            finally:
+                pool.close()
+                pool.join()
+        if len(set((nonce, bytes(soln)) for (nonce, soln, _, _) in results.values())) != 1:
+            print('FAIL: n=%d k=%d: solvers disagree on the first solution' % (n, k))
+            ret = False
+        print('n=%d k=%d: first solution at nonce %d' % (n, k, results[solvers[0]][0]))
+        for (solver, early) in solvers:
+            (_, _, elapsed, peak) = results[(solver, early)]
+            print('  %-15s %-5s %9.1f ms, peak RSS +%6.1f MiB'
+                  % (solver, 'first' if early else 'all', 1000 * elapsed, peak / 1048576.0))
+    return ret
+
+
+def bench_validate(args):
+    n, k = 48, 5
+    batch = equihash_solutions(n, k, args.blocks)
+    # Corrupt every tenth solution so that failure reasons are exercised
+    for i in range(0, len(batch), 10):
+        header, soln = batch[i]
+        soln = bytearray(soln)
+        soln[-1] ^= 1
+        batch[i] = (header, soln)
+    expected = [i % 10 != 0 for i in range(len(batch))]
+
+    def serial():
+        return [equihash._gbp_check(equihash.header_digest(h, n, k), s, n, k) is None
+                for (h, s) in batch]
+    # The solver has left the index hash tables for these headers cached
+    warm, warm_time = timed(equihash.gbp_validate_many, batch, n, k)
+    equihash.index_hash_table.clear()
+    verdicts, serial_time = timed(serial)
+    many, many_time = timed(equihash.gbp_validate_many, batch, n, k)
+    processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        pooled, pool_time = timed(equihash.gbp_validate_many, batch, n, k, pool)
+    finally:
+        pool.close()
+        pool.join()
+
+    ret = True
+    for (name, result) in [('one at a time', verdicts),
+                           ('gbp_validate_many', [v for (v, _) in many]),
+                           ('gbp_validate_many (cached)', [v for (v, _) in warm]),
+                           ('gbp_validate_many (pool)', [v for (v, _) in pooled])]:
+        if result != expected:
+            print('FAIL: %s returned incorrect verdicts' % name)
+            ret = False
+    print('n=%d k=%d: %d blocks' % (n, k, len(batch)))
+    print('  one at a time:           %8.1f ms' % (1000 * serial_time))
+    print('  gbp_validate_many:       %8.1f ms' % (1000 * many_time))
+    print('  gbp_validate_many (x%2d): %8.1f ms' % (processes, 1000 * pool_time))
+    print('  after solving (cached):  %8.1f ms' % (1000 * warm_time))
+    return ret
+
+
+def codec_paths():
+    paths = [('loop', equihash._expand_array_loop, equihash._compress_array_loop),
+             ('table', equihash._expand_array_table, equihash._compress_array_table)]
+    if equihash.np is not None:
+        paths.append(('numpy', equihash._expand_array_numpy, equihash._compress_array_numpy))
+    return paths
+
+def check_codec():
+    # Compare each codec path against the original loops. compress_array is
+    # checked on index arrays, which always have zero padding bytes.
+    rand = random.Random(0)
+    ret = True
+    for bit_len in equihash.FAST_BIT_LENS:
+        index_pad = 4 - (bit_len+7)/8
+        for byte_pad in sorted(set([0, index_pad])):
+            width = (bit_len+7)/8 + byte_pad
+            for num_bytes in [bit_len, 4*bit_len + 3, 1000]:
+                inp = bytearray(rand.getrandbits(8) for _ in range(num_bytes))
+                out_len = 8*width*len(inp)/bit_len
+                expected = equihash._expand_array_loop(inp, out_len, bit_len, byte_pad)
+                for (name, expand, _) in codec_paths():
+                    if expand(inp, out_len, bit_len, byte_pad) != expected:
+                        print('FAIL: %s expand_array bit_len=%d byte_pad=%d'
+                              % (name, bit_len, byte_pad))
+                        ret = False
+        for num in [32, 512]:
+            inp = bytearray(struct.pack('>%dI' % num,
+                                        *[rand.getrandbits(bit_len) for _ in range(num)]))
+            out_len = bit_len*len(inp)/32
+            expected = equihash._compress_array_loop(inp, out_len, bit_len, index_pad)
+            for (name, _, compress) in codec_paths():
+                if compress(inp, out_len, bit_len, index_pad) != expected:
+                    print('FAIL: %s compress_array bit_len=%d' % (name, bit_len))
+                    ret = False
+            # Lists, as deserialized by mininode, must give the same result
+            if equihash.compress_array(list(inp), out_len, bit_len, index_pad) != expected:
+                print('FAIL: compress_array of a list bit_len=%d' % bit_len)
+                ret = False
+            if equihash.expand_array(list(expected), len(inp), bit_len, index_pad) != inp:
+                print('FAIL: expand_array of a list bit_len=%d' % bit_len)
+                ret = False
+
+    # A solved block must still be valid after a serialization round trip
+    block = mininode.CBlock()
+    block.nBits = 0x200f0f0f # regtest
+    block.vtx.append(simple_tx(0))
+    block.hashMerkleRoot = block.calc_merkle_root()
+    block.solve(cache=None)
+    received = mininode.CBlock()
+    received.deserialize(cStringIO.StringIO(block.serialize()))
+    if not received.is_valid():
+        print('FAIL: deserialized block is not valid')
+        ret = False
+    return ret
+
+def bench_codec(args):
+    ret = check_codec()
+    print('Compatibility with the original codec: %s' % ('PASS' if ret else 'FAIL'))
+    rand = random.Random(1)
+    for num_bytes in [36, 64*1024]:
+        print('%d-byte inputs (MB/s of packed data):' % num_bytes)
+        print('  %-26s %s' % ('', ' '.join('%9s' % name for (name, _, _) in codec_paths())))
+        # Collision lengths expand without padding; index widths are
+        # expanded to and compressed from 32-bit integers.
+        for (bit_len, byte_pad) in [(8, 0), (16, 0), (20, 0), (21, 0),
+                                    (9, 2), (17, 1), (21, 1), (22, 1)]:
+            width = (bit_len+7)/8 + byte_pad
+            packed = bytearray(rand.getrandbits(8) for _ in range(num_bytes))
+            out_len = 8*width*len(packed)/bit_len
+            expanded = equihash._expand_array_loop(packed, out_len, bit_len, byte_pad)
+            expanded = expanded[:len(expanded) - len(expanded) % width]
+            reps = max(1, 256*1024 / num_bytes)
+            compressed_len = bit_len*len(expanded)/(8*width)
+            for (op, data, arg_len) in [('expand', packed, out_len),
+                                        ('compress', expanded, compressed_len)]:
+                if op == 'compress' and byte_pad == 0:
+                    continue
+                rates = []
+                for (name, expand, compress) in codec_paths():
+                    f = expand if op == 'expand' else compress
+                    start = time.time()
+                    for _ in range(reps):
+                        f(data, arg_len, bit_len, byte_pad)
+                    rates.append(reps * num_bytes / (time.time() - start) / 1e6)
+                print('  %-8s bit_len=%2d pad=%d: %s'
+                      % (op, bit_len, byte_pad, ' '.join('%9.2f' % r for r in rates)))
+    return ret
+
+
+# MAX_BLOCK_SIZE in src/consensus/consensus.h
+MAX_BLOCK_SIZE = 2000000
+
+def max_size_block():
+    tx = mininode.CTransaction()
+    tx.vin.append(mininode.CTxIn())
+    tx.vout.append(mininode.CTxOut(0, ''))
+    block = mininode.CBlock()
+    block.vtx.append(tx)
+    tx.vin[0].scriptSig = '\x00' * (MAX_BLOCK_SIZE - len(block.serialize()) - 4)
+    assert len(block.serialize()) == MAX_BLOCK_SIZE
+    return block
+
+def frame_message(message):
+    data = message.serialize()
+    return (mininode.NodeConn.MAGIC_BYTES['regtest'] +
+            struct.pack('<12sI', message.command, len(data)) +
+            mininode.hash256(data)[:4] + data)
+
+def joinsplit_tx(i):
+    g1 = {'y_lsb': 0, 'x': b'\x00' * 32}
+    proof = mininode.ZCProof()
+    proof.g_A = proof.g_A_prime = proof.g_B_prime = proof.g_C = g1
+    proof.g_C_prime = proof.g_K = proof.g_H = g1
+    proof.g_B = {'y_gt': 0, 'x': b'\x00' * 64}
+    js = mininode.JSDescription()
+    js.proof = proof
+    js.ciphertexts = [b'\x00' * mininode.ZC_NOTECIPHERTEXT_SIZE] * mininode.ZC_NUM_JS_OUTPUTS
+    tx = mininode.CTransaction()
+    tx.nVersion = 2
+    tx.vin.append(mininode.CTxIn(mininode.COutPoint(i, 0)))
+    tx.vout.append(mininode.CTxOut(i, b'\x51'))
+    tx.vjoinsplit.append(js)
+    tx.joinSplitPubKey = i
+    tx.joinSplitSig = b'\x00' * 64
+    return tx
+
+def joinsplit_block(num_txs):
+    block = mininode.CBlock()
+    block.vtx = [joinsplit_tx(i) for i in range(num_txs)]
+    block.hashMerkleRoot = block.calc_merkle_root()
+    return block
+
+def simple_tx(i):
+    tx = mininode.CTransaction()
+    tx.vin.append(mininode.CTxIn(mininode.COutPoint(i, 0), b'\x00' * 72, 0xffffffff))
+    tx.vout.append(mininode.CTxOut(i, b'\x76\xa9\x14' + b'\x00' * 20 + b'\x88\xac'))
+    tx.vout.append(mininode.CTxOut(i, b'\x76\xa9\x14' + b'\x00' * 20 + b'\x88\xac'))
+    return tx
+
+def deep_getsizeof(obj, seen=None):
+    # Total size of obj and everything it references, counting shared
+    # objects once
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set)):
+        size += sum(deep_getsizeof(x, seen) for x in obj)
+    elif isinstance(obj, dict):
+        size += sum(deep_getsizeof(k, seen) + deep_getsizeof(v, seen)
+                    for (k, v) in obj.items())
+    if hasattr(obj, '__dict__'):
+        size += deep_getsizeof(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            if hasattr(obj, name):
+                size += deep_getsizeof(getattr(obj, name), seen)
+    return size
+
+class FramingCB(mininode.NodeConnCB):
+    def __init__(self, count):
+        mininode.NodeConnCB.__init__(self)
+        self.create_callback_map()
+        self.count = count
+        self.blocks = 0
+        self.done = threading.Event()
+
+    def on_version(self, conn, message): pass
+
+    def on_block(self, conn, message):
+        self.blocks += 1
+        if self.blocks == self.count:
+            self.done.set()
+
+def framing_pair(cb):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    conn = mininode.NodeConn('127.0.0.1', listener.getsockname()[1], None, cb)
+    peer, _ = listener.accept()
+    listener.close()
+    thread = mininode.NetworkThread()
+    thread.start()
+    while conn.state != 'connected':
+        time.sleep(0.01)
+    return conn, peer, thread
+
+def framing_close(conn, peer, thread):
+    conn.disconnect_node()
+    thread.join()
+    peer.close()
+
+def bench_framing(args):
+    block = mininode.msg_block(max_size_block())
+    frame = frame_message(block)
+    total = len(frame) * args.count
+    ret = True
+
+    # Receive: a raw socket streams pre-framed blocks into a NodeConn
+    cb = FramingCB(args.count)
+    conn, peer, thread = framing_pair(cb)
+    start = time.time()
+    for _ in range(args.count):
+        peer.sendall(frame)
+    cb.done.wait()
+    recv_time = time.time() - start
+    framing_close(conn, peer, thread)
+    if cb.blocks != args.count:
+        print('FAIL: received %d of %d blocks' % (cb.blocks, args.count))
+        ret = False
+
+    # Send: a NodeConn streams blocks into a raw socket, with at most 32 MB
+    # in flight so that the send queue does not hold every block at once
+    cb = FramingCB(args.count)
+    conn, peer, thread = framing_pair(cb)
+    received = [0]
+    def sink():
+        buf = bytearray(1024*1024)
+        while received[0] < total:
+            n = peer.recv_into(buf)
+            if n == 0:
+                break
+            received[0] += n
+    sink_thread = threading.Thread(target=sink)
+    version_len = len(frame_message(mininode.msg_version()))
+    total += version_len
+    sink_thread.start()
+    start = time.time()
+    for i in range(args.count):
+        while i * len(frame) + version_len - received[0] > 32*1024*1024:
+            time.sleep(0.001)
+        conn.send_message(block)
+    sink_thread.join()
+    send_time = time.time() - start
+    framing_close(conn, peer, thread)
+    if received[0] != total:
+        print('FAIL: sent %d of %d bytes' % (received[0], total))
+        ret = False
+
+    print('%d blocks of %d bytes' % (args.count, len(frame)))
+    print('  receive: %8.1f ms (%.1f MB/s)'
+          % (1000 * recv_time, len(frame) * args.count / recv_time / 1e6))
+    print('  send:    %8.1f ms (%.1f MB/s)'
+          % (1000 * send_time, len(frame) * args.count / send_time / 1e6))
+    return ret
+
+
+class EchoServer(threading.Thread):
+    # Echoes everything it receives back to every connection it accepts,
+    # until they have all been closed
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(512)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.listener, select.POLLIN)
+        conns = {self.listener.fileno(): self.listener}
+        while True:
+            for (fd, _) in poller.poll():
+                if fd == self.listener.fileno():
+                    conn, _ = self.listener.accept()
+                    conns[conn.fileno()] = conn
+                    poller.register(conn, select.POLLIN)
+                    continue
+                data = conns[fd].recv(65536)
+                if data:
+                    conns[fd].sendall(data)
+                else:
+                    poller.unregister(fd)
+                    conns.pop(fd).close()
+                    if len(conns) == 1:
+                        self.listener.close()
+                        return
+
+class RPCHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one segment, as bitcoind does
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.handlers.append((threading.current_thread(), self.connection))
+
+    def log_message(self, format, *args):
+        pass
+
+    def call(self, request):
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        try:
+            result = self.server.methods[request['method']](*request['params'])
+            error = None
+        except Exception as e:
+            result = None
+            error = {'code': -1, 'message': str(e)}
+        return {'result': result, 'error': error, 'id': request['id']}
+
+    def do_POST(self):
+        self.server.posts += 1
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        request = json.loads(body, parse_float=decimal.Decimal)
+        if isinstance(request, list):
+            response = [self.call(r) for r in request]
+        else:
+            response = self.call(request)
+        data = json.dumps(response, default=float)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class RPCServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # A JSON-RPC server on loopback that answers each call after latency
+    # seconds, standing in for a node
+    daemon_threads = True
+
+    def __init__(self, methods, latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), RPCHandler)
+        self.methods = methods
+        self.latency = latency
+        self.requests = 0
+        self.posts = 0
+        self.lock = threading.Lock()
+        self.handlers = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self):
+        return 'http://rt:rt@127.0.0.1:%d' % self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        pass
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        # Clients may still hold keep-alive connections open
+        with self.lock:
+            handlers = list(self.handlers)
+        for (thread, conn) in handlers:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            thread.join()
+
+def rpc_methods():
+    def fail(message):
+        raise ValueError(message)
+    return {
+        'echo': lambda *args: list(args),
+        'fail': fail,
+        'getblockhash': lambda height: '%064x' % height,
+    }
+
+def bench_rpcpool(args):
+    server = RPCServer(rpc_methods(), latency=0.002)
+    calls = 500
+    ret = True
+    try:
+        proxy = AuthServiceProxy(server.url())
+        if proxy.echo(decimal.Decimal('0.12345678')) != [decimal.Decimal('0.12345678')]:
+            print('FAIL: Decimal did not round-trip')
+            ret = False
+        expected = ['%064x' % i for i in range(calls)]
+        serial, serial_time = timed(lambda: [proxy.getblockhash(i) for i in range(calls)])
+        timings = []
+        for size in [1, 4, 8]:
+            pooled = AuthServiceProxy(server.url(), pool_size=size)
+            hashes, elapsed = timed(pooled.map, 'getblockhash', [[i] for i in range(calls)])
+            if hashes != expected:
+                print('FAIL: map(pool_size=%d) returned the wrong results' % size)
+                ret = False
+            timings.append((size, elapsed))
+            pooled.close()
+        try:
+            pooled.call_async('fail', 'expected').result()
+            print('FAIL: call_async did not raise the RPC error')
+            ret = False
+        except JSONRPCException:
+            pass
+        pooled.close()
+        if serial != expected:
+            print('FAIL: sequential calls returned the wrong results')
+            ret = False
+    finally:
+        server.stop()
+    print('%d getblockhash calls, %.0f ms server latency:' % (calls, 1000 * server.latency))
+    print('  sequential:      %7.1f ms' % (1000 * serial_time))
+    for (size, elapsed) in timings:
+        print('  map pool_size=%d: %7.1f ms' % (size, 1000 * elapsed))
+    return ret
+
+class ThreadHook(object):
+    # Records the thread that made each RPC request
+    def __init__(self):
+        self.threads = []
+
+    def record(self, method, elapsed, request_bytes, response_bytes, retries):
+        self.threads.append(threading.current_thread())
+
+def bench_rpcbatch(args):
+    server = RPCServer(rpc_methods())
+    calls = 10000
+    expected = ['%064x' % i for i in range(calls)]
+    ret = True
+    try:
+        proxy = AuthServiceProxy(server.url())
+        posts = server.posts
+        single, single_time = timed(lambda: [proxy.getblockhash(i) for i in range(calls)])
+        single_posts = server.posts - posts
+
+        def batched():
+            with proxy.batch() as b:
+                futures = [b.getblockhash(i) for i in range(calls)]
+                failed = b.fail('expected')
+            return [f.result() for f in futures], failed
+        posts = server.posts
+        (hashes, failed), batch_time = timed(batched)
+        batch_posts = server.posts - posts
+        proxy.close()
+
+        # A batch that fits in one request is sent from the calling thread
+        hook = ThreadHook()
+        authproxy.set_metrics_hook(hook)
+        try:
+            with proxy.batch() as b:
+                small = b.getblockhash(1)
+        finally:
+            authproxy.set_metrics_hook(None)
+        if small.result() != expected[1] or hook.threads != [threading.current_thread()]:
+            print('FAIL: single-request batch did not run inline')
+            ret = False
+
+        # Results cannot be read before the batch is sent, and calls in a
+        # batch whose with block raised fail instead of hanging
+        pending = proxy.batch()
+        early = pending.getblockhash(1)
+        try:
+            with proxy.batch() as b:
+                abandoned = b.getblockhash(1)
+                raise ValueError('expected')
+        except ValueError:
+            pass
+        for (name, future) in [('unexecuted', early), ('abandoned', abandoned)]:
+            try:
+                future.result()
+                print('FAIL: reading an %s batch result did not raise' % name)
+                ret = False
+            except RuntimeError:
+                pass
+    finally:
+        server.stop()
+    if single != expected or hashes != expected:
+        print('FAIL: getblockhash returned the wrong results')
+        ret = False
+    try:
+        failed.result()
+        print('FAIL: batch did not raise the RPC error')
+        ret = False
+    except JSONRPCException:
+        pass
+    print('%d getblockhash calls:' % calls)
+    print('  one per request: %7.1f ms, %5d HTTP requests' % (1000 * single_time, single_posts))
+    print('  batch():         %7.1f ms, %5d HTTP requests' % (1000 * batch_time, batch_posts))
+    return ret
+
+def bench_rpcmetrics(args):
+    server = RPCServer(rpc_methods())
+    calls = 2000
+    try:
+        proxy = AuthServiceProxy(server.url())
+        _, plain_time = timed(lambda: [proxy.getblockhash(i) for i in range(calls)])
+        metrics = RPCMetrics()
+        authproxy.set_metrics_hook(metrics)
+        try:
+            _, hooked_time = timed(lambda: [proxy.getblockhash(i) for i in range(calls)])
+            proxy.echo(*range(1000))
+            with proxy.batch() as b:
+                for i in range(10):
+                    b.getblockhash(i)
+        finally:
+            authproxy.set_metrics_hook(None)
+    finally:
+        server.stop()
+    stats = metrics.to_json()
+    ret = True
+    if (stats['getblockhash']['calls'] != calls or stats['echo']['calls'] != 1
+            or stats['batch']['calls'] != 1):
+        print('FAIL: wrong call counts recorded')
+        ret = False
+    print(metrics.summary())
+    print('%d getblockhash calls: %.1f ms without metrics, %.1f ms with'
+          % (calls, 1000 * plain_time, 1000 * hooked_time))
+    return ret
+
+def listunspent_fixture(count):
+    rng = random.Random(0)
+    # Wallets hold many outputs of the same few amounts
+    amounts = [rng.randint(1, 10**10) / 1e8 for i in range(1000)]
+    return json.dumps({'result': [{
+        'txid': '%064x' % rng.getrandbits(256),
+        'vout': rng.randint(0, 3),
+        'generated': False,
+        'address': 'tmA%032x' % i,
+        'account': '',
+        'scriptPubKey': '76a914%040x88ac' % rng.getrandbits(160),
+        'amount': rng.choice(amounts),
+        'confirmations': rng.randint(1, 10**5),
+        'spendable': True,
+    } for i in range(count)], 'error': None, 'id': 1})
+
+class FixtureConnection(object):
+    # Stands in for an HTTPConnection whose next response is body
+    def __init__(self, body):
+        self.body = body
+
+    def getresponse(self):
+        return self
+
+    def read(self):
+        return self.body
+
+def decode_listunspent(count):
+    # Runs in a fresh worker process, so that ru_maxrss reflects the decoding
+    conn = FixtureConnection(listunspent_fixture(count))
+    proxy = AuthServiceProxy('http://rt:rt@127.0.0.1:1')
+    with open('/proc/self/statm') as f:
+        start_rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    (response, _), elapsed = timed(proxy._get_response, conn)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    expected = json.loads(conn.body.decode('utf8'), parse_float=decimal.Decimal)
+    return (response == expected, len(conn.body), elapsed, peak_rss - start_rss)
+
+def bench_rpcdecode(args):
+    count = 200000
+    pool = multiprocessing.Pool(1)
+    try:
+        (same, size, elapsed, peak) = pool.apply(decode_listunspent, [count])
+    finally:
+        pool.close()
+        pool.join()
+    if not same:
+        print('FAIL: decoded listunspent response differs from json.loads')
+    print('listunspent with %d entries (%.1f MiB):' % (count, size / 1048576.0))
+    print('  decode: %7.1f ms, peak RSS +%6.1f MiB' % (1000 * elapsed, peak / 1048576.0))
+    return same
+
+class PingCB(mininode.NodeConnCB):
+    def __init__(self):
+        mininode.NodeConnCB.__init__(self)
+        self.create_callback_map()
+        self.pings = 0
+        self.cond = threading.Condition()
+
+    def on_version(self, conn, message): pass
+
+    def on_ping(self, conn, message):
+        with self.cond:
+            self.pings += 1
+            self.cond.notify()
+
+def bench_latency(args):
+    print('Ping round trips through a loopback echo server:')
+    for peers in sorted(set([1, args.peers])):
+        server = EchoServer()
+        server.start()
+        cb = PingCB()
+        conns = [mininode.NodeConn('127.0.0.1', server.port, None, cb)
+                 for _ in range(peers)]
+        thread = mininode.NetworkThread()
+        thread.start()
+        while any(c.state != 'connected' for c in conns):
+            time.sleep(0.01)
+        rounds = max(10, 100 / peers)
+        start = time.time()
+        for i in range(rounds):
+            for c in conns:
+                c.send_message(mininode.msg_ping(i))
+            with cb.cond:
+                while cb.pings < (i+1) * peers:
+                    cb.cond.wait()
+        elapsed = time.time() - start
+        start = time.time()
+        for c in conns:
+            c.disconnect_node()
+        thread.join()
+        close_time = time.time() - start
+        server.join()
+        print('  %3d peers: %8.2f ms/round trip, disconnect in %6.1f ms'
+              % (peers, 1000 * elapsed / rounds, 1000 * close_time))
+    return True
+
+
+class FlagCB(mininode.NodeConnCB):
+    def __init__(self):
+        mininode.NodeConnCB.__init__(self)
+        self.create_callback_map()
+        self.pongs = 0
+
+    def on_pong(self, conn, message):
+        self.pongs += 1
+
+class CountingRPC(object):
+    # Reports a block count that catches up with the target at ready_at
+    def __init__(self, ready_at):
+        self.ready_at = ready_at
+
+    def getblockcount(self):
+        return 1 if time.time() >= self.ready_at else 0
+
+def bench_wakeup(args):
+    # comptool needs the dbm module, which not every Python build has
+    from test_framework.comptool import wait_until
+    from test_framework.util import sync_blocks
+    delay = 0.02
+    rounds = 20
+    ret = True
+
+    cb = FlagCB()
+    wait_until_lag = 0.0
+    for i in range(rounds):
+        delivered = []
+        def deliver():
+            delivered.append(time.time())
+            cb.deliver(None, mininode.msg_pong(i))
+        timer = threading.Timer(delay, deliver)
+        timer.start()
+        if not wait_until(lambda: cb.pongs > i, timeout=10):
+            print('FAIL: wait_until timed out')
+            ret = False
+        wait_until_lag += time.time() - delivered[0]
+        timer.join()
+    _, timeout_time = timed(lambda: wait_until(lambda: False, timeout=0.2))
+    # The deprecated attempts count of 50ms polls, as the same bound
+    _, attempts_time = timed(wait_until, lambda: False, 4)
+
+    sync_lag = 0.0
+    for i in range(rounds):
+        ready_at = time.time() + delay
+        sync_blocks([CountingRPC(0), CountingRPC(ready_at)])
+        sync_lag += time.time() - ready_at
+
+    print('Wake-up delay after the condition becomes true (%d rounds):' % rounds)
+    print('  comptool.wait_until: %8.2f ms' % (1000 * wait_until_lag / rounds))
+    print('  util.sync_blocks:    %8.2f ms' % (1000 * sync_lag / rounds))
+    print('  wait_until(timeout=0.2) returned after %.0f ms' % (1000 * timeout_time))
+    print('  wait_until(attempts=4) returned after %.0f ms' % (1000 * attempts_time))
+    return ret
+
+
+def bench_blocks(args):
+    data = joinsplit_block(args.txs).serialize()
+
+    def receive(cls, use_vtx):
+        for _ in range(10):
+            block = cls()
+            block.deserialize(cStringIO.StringIO(data))
+            block.calc_sha256()
+            if use_vtx:
+                len(block.vtx)
+        return block
+
+    ret = True
+    print('Deserialize a block of %d JoinSplit transactions (%d bytes) and hash it:'
+          % (args.txs, len(data)))
+    for (name, cls, use_vtx) in [('CBlock', mininode.CBlock, False),
+                                 ('CLazyBlock', mininode.CLazyBlock, False),
+                                 ('CLazyBlock, vtx accessed', mininode.CLazyBlock, True)]:
+        block, elapsed = timed(receive, cls, use_vtx)
+        if block.serialize() != data:
+            print('FAIL: %s does not round-trip' % name)
+            ret = False
+        print('  %-26s %8.2f ms' % (name, 100 * elapsed))
+
+    def process(frozen):
+        if frozen == 'received':
+            # Transactions parsed from a received block are frozen
+            block = mininode.CLazyBlock()
+            block.deserialize(cStringIO.StringIO(data))
+        else:
+            block = joinsplit_block(args.txs)
+        for tx in block.vtx:
+            tx.sha256 = None
+            tx.serialize_count = 0
+        start = time.time()
+        for tx in block.vtx:
+            if frozen is True:
+                tx.freeze()
+            tx.calc_sha256()
+        block.calc_merkle_root()
+        for tx in block.vtx:
+            mininode.msg_tx(tx).serialize()
+        return (time.time() - start,
+                sum(tx.serialize_count for tx in block.vtx) / float(len(block.vtx)))
+
+    print('Hash each transaction, compute the merkle root and serialize each msg_tx:')
+    for (name, frozen) in [('unfrozen', False), ('frozen', True),
+                           ('received block', 'received')]:
+        elapsed, count = process(frozen)
+        print('  %-26s %8.2f ms, %.1f serializations/tx' % (name, 1000 * elapsed, count))
+    return ret
+
+
+def serialize_cases():
+    coinbase = mininode.CTransaction()
+    coinbase.vin.append(mininode.CTxIn(mininode.COutPoint(0, 0xffffffff), b'\x51\x51', 0xffffffff))
+    coinbase.vout.append(mininode.CTxOut(1250000000, b'\x51'))
+    many_inputs = simple_tx(0)
+    many_inputs.vin = [mininode.CTxIn(mininode.COutPoint(i, i), b'\x00' * 107, 0xffffffff)
+                       for i in range(1000)]
+    joinsplits = joinsplit_tx(0)
+    joinsplits.vjoinsplit = [js.copy() for js in joinsplits.vjoinsplit * 10]
+    block = joinsplit_block(1000)
+    headers = mininode.msg_headers()
+    headers.headers = [mininode.CBlockHeader(block) for _ in range(2000)]
+    for h in headers.headers:
+        h.nSolution = [0] * 1344
+    return [('coinbase-only tx', coinbase),
+            ('1000-input tx', many_inputs),
+            ('10-JoinSplit tx', joinsplits),
+            ('msg_block (1000 JoinSplit txs)', mininode.msg_block(block)),
+            ('msg_headers (2000 headers)', headers)]
+
+def bench_serialize(args):
+    print('Serialization time (us per object):')
+    for (name, obj) in serialize_cases():
+        reps = 1
+        while True:
+            start = time.time()
+            for _ in range(reps):
+                obj.serialize()
+            elapsed = time.time() - start
+            if elapsed > 0.2:
+                break
+            reps *= 2
+        print('  %-32s %10.1f us (%d bytes)'
+              % (name, 1e6 * elapsed / reps, len(obj.serialize())))
+    return True
+
+def deserializer(cls):
+    return lambda f: cls().deserialize(f)
+
+def deserialize_cases():
+    rand = random.Random(2)
+    inv = mininode.msg_inv([mininode.CInv(1, rand.getrandbits(256))
+                            for _ in range(mininode.MAX_INV_SZ)])
+    getheaders = mininode.msg_getheaders()
+    getheaders.locator.vHave = [rand.getrandbits(256) for _ in range(32)]
+    headers = dict(serialize_cases())['msg_headers (2000 headers)']
+    return [('uint256', mininode.deser_uint256,
+             mininode.ser_uint256(rand.getrandbits(256))),
+            ('msg_inv (50000 entries)', deserializer(mininode.msg_inv),
+             inv.serialize()),
+            ('msg_getheaders (32 hashes)', deserializer(mininode.msg_getheaders),
+             getheaders.serialize()),
+            ('msg_headers (2000 headers)', deserializer(mininode.msg_headers),
+             headers.serialize()),
+            ('CBlock (1000 JoinSplit txs)', deserializer(mininode.CBlock),
+             joinsplit_block(1000).serialize())]
+
+def bench_deserialize(args):
+    print('Deserialization time (us per object):')
+    for (name, deserialize, data) in deserialize_cases():
+        reps = 1
+        while True:
+            start = time.time()
+            for _ in range(reps):
+                deserialize(cStringIO.StringIO(data))
+            elapsed = time.time() - start
+            if elapsed > 0.2:
+                break
+            reps *= 2
+        print('  %-32s %10.2f us' % (name, 1e6 * elapsed / reps))
+    return True
+
+def bench_memory(args):
+    print('Memory used by a block of %d transactions (bytes/tx):' % args.memtxs)
+    for (name, make_tx) in [('1 input, 2 outputs', simple_tx),
+                            ('1 JoinSplit', joinsplit_tx)]:
+        block = mininode.CBlock()
+        block.vtx = [make_tx(i) for i in range(args.memtxs)]
+        # Count the objects a deserialized block holds, not the
+        # constructor arguments they happen to share.
+        data = block.serialize()
+        block = mininode.CBlock()
+        block.deserialize(cStringIO.StringIO(data))
+        serialized = len(data) / float(args.memtxs)
+        size = deep_getsizeof(block.vtx) / float(args.memtxs)
+        copies, elapsed = timed(lambda: [mininode.CTransaction(tx) for tx in block.vtx])
+        print('  %-20s %7.0f in memory, %6.0f serialized, %6.1f us/copy'
+              % (name, size, serialized, 1e6 * elapsed / args.memtxs))
+    return True
+
+
+def bench_blockstore(args):
+    # blockstore needs the dbm module, which not every Python build has
+    from test_framework.blockstore import BlockStore
+    datadir = tempfile.mkdtemp(prefix='blockstore')
+    try:
+        store = BlockStore(datadir)
+        prev = 0
+        hashes = []
+        for height in range(args.headers):
+            block = mininode.CBlock()
+            block.hashPrevBlock = prev
+            block.nTime = height
+            block.nSolution = [0] * 1344
+            block.vtx.append(simple_tx(height))
+            block.hashMerkleRoot = block.calc_merkle_root()
+            store.add_block(block)
+            prev = block.sha256
+            hashes.append(prev)
+
+        # A getheaders from a peer that has the first block
+        locator = mininode.CBlockLocator()
+        locator.vHave = [hashes[0]]
+        response, headers_time = timed(store.headers_for, locator, 0)
+        locator, locator_time = timed(store.get_locator)
+        store.close()
+        store, open_time = timed(BlockStore, datadir)
+        reopened = store.headers_for(mininode.CBlockLocator(), 0, hashes[1999])
+        store.close()
+    finally:
+        shutil.rmtree(datadir)
+
+    ret = True
+    if [h.sha256 for h in response.headers] != hashes[:2000]:
+        print('FAIL: headers_for returned the wrong headers')
+        ret = False
+    if [h.sha256 for h in reopened.headers] != hashes[:2000]:
+        print('FAIL: headers_for returned the wrong headers after reopening')
+        ret = False
+    if len(locator.vHave) == 0 or locator.vHave[0] != hashes[-2]:
+        print('FAIL: get_locator returned the wrong locator')
+        ret = False
+    print('Chain of %d blocks:' % args.headers)
+    print('  headers_for (2000 headers): %8.1f ms' % (1000 * headers_time))
+    print('  get_locator:                %8.1f ms' % (1000 * locator_time))
+    print('  reopen:                     %8.1f ms' % (1000 * open_time))
+    return ret
+
+
+def bench_solutioncache(args):
+    def make_blocks():
+        blocks = []
+        for i in range(args.solve_blocks):
+            block = mininode.CBlock()
+            block.nTime = i
+            block.nBits = 0x200f0f0f # regtest
+            block.vtx.append(simple_tx(i))
+            block.hashMerkleRoot = block.calc_merkle_root()
+            blocks.append(block)
+        return blocks
+
+    cachedir = tempfile.mkdtemp(prefix='solutioncache')
+    try:
+        runs = []
+        for run in ['cold', 'warm']:
+            # A new SolutionCache each run, as for separate test invocations
+            cache = SolutionCache(os.path.join(cachedir, 'solutions'))
+            blocks = make_blocks()
+            equihash.index_hash_table.clear()
+            start = time.time()
+            for block in blocks:
+                block.solve(cache=cache)
+            cache.close()
+            runs.append((run, time.time() - start, cache.hit_rate(),
+                         [(block.nNonce, block.nSolution) for block in blocks],
+                         all(block.is_valid() for block in blocks)))
+    finally:
+        shutil.rmtree(cachedir)
+
+    ret = True
+    if not all(valid for (_, _, _, _, valid) in runs):
+        print('FAIL: solve() produced an invalid block')
+        ret = False
+    if runs[0][3] != runs[1][3]:
+        print('FAIL: cached solutions differ from mined solutions')
+        ret = False
+    if runs[1][2] != 1.0:
+        print('FAIL: warm run missed the cache')
+        ret = False
+    print('%d regtest blocks:' % args.solve_blocks)
+    for (run, elapsed, hit_rate, _, _) in runs:
+        print('  %-4s %8.1f ms/block, hit rate %5.1f%%'
+              % (run, 1000 * elapsed / args.solve_blocks, 100 * hit_rate))
+    return ret
+
+
+def snapshot_fixture(root):
+    # The layout of a cached regtest datadir, with larger files
+    files = {}
+    for i in range(3):
+        files[os.path.join('regtest', 'blocks', 'blk%05d.dat' % i)] = 16 << 20
+        files[os.path.join('regtest', 'blocks', 'rev%05d.dat' % i)] = 2 << 20
+    for i in range(20):
+        files[os.path.join('regtest', 'blocks', 'index', '%06d.ldb' % i)] = 1 << 20
+        files[os.path.join('regtest', 'chainstate', '%06d.ldb' % i)] = 2 << 20
+    for name in ['CURRENT', 'LOG', 'MANIFEST-000001']:
+        files[os.path.join('regtest', 'chainstate', name)] = 1 << 10
+    files[os.path.join('regtest', 'wallet.dat')] = 1 << 20
+    files['zcash.conf'] = 1 << 7
+    for (name, size) in files.items():
+        path = os.path.join(root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+    return sorted(files)
+
+def bench_snapshot(args):
+    workdir = tempfile.mkdtemp(prefix='snapshot')
+    try:
+        src = os.path.join(workdir, 'cache')
+        names = snapshot_fixture(src)
+        size = sum(os.path.getsize(os.path.join(src, name)) for name in names)
+        copy_time = timed(shutil.copytree, src, os.path.join(workdir, 'copy'))[1]
+        stats = CloneStats()
+        clone_time = timed(clone_tree, src, os.path.join(workdir, 'clone'), stats)[1]
+
+        ret = True
+        for name in names:
+            with open(os.path.join(src, name), 'rb') as f:
+                expected = f.read()
+            with open(os.path.join(workdir, 'clone', name), 'rb') as f:
+                if f.read() != expected:
+                    print('FAIL: clone of %s differs' % name)
+                    ret = False
+        # Appending to the clone's last block file must not touch the cache
+        last = os.path.join('regtest', 'blocks', 'blk00002.dat')
+        with open(os.path.join(workdir, 'clone', last), 'ab') as f:
+            f.write(b'\x00')
+        if os.path.getsize(os.path.join(src, last)) != 16 << 20:
+            print('FAIL: writing to a clone modified the cache')
+            ret = False
+        # So must appending undo data to an old rev file, as connecting an
+        # old block after a reorg does
+        rev = os.path.join('regtest', 'blocks', 'rev00000.dat')
+        with open(os.path.join(workdir, 'clone', rev), 'ab') as f:
+            f.write(b'\x00')
+        if os.path.getsize(os.path.join(src, rev)) != 2 << 20:
+            print('FAIL: writing to a cloned rev file modified the cache')
+            ret = False
+
+        # A stand-in for the zcashd binary
+        binary = os.path.join(workdir, 'zcashd')
+        with open(binary, 'wb') as f:
+            f.write(os.urandom(64 << 20))
+        params = {'nodes': 4}
+        version = CacheVersion(src, binary, params)
+        version.write()
+        current, check_time = timed(version.is_current)
+        if not current:
+            print('FAIL: cache version does not match itself')
+            ret = False
+        if CacheVersion(src, binary, {'nodes': 5}).is_current():
+            print('FAIL: changed chain parameters were not detected')
+            ret = False
+        with open(binary, 'ab') as f:
+            f.write(b'\x00')
+        if version.is_current():
+            print('FAIL: changed binary was not detected')
+            ret = False
+    finally:
+        shutil.rmtree(workdir)
+
+    print('Datadir of %d files, %.1f MiB:' % (len(names), size / float(1 << 20)))
+    print('  copytree:   %8.1f ms' % (1000 * copy_time))
+    print('  clone_tree: %8.1f ms  %r' % (1000 * clone_time, stats))
+    print('  version check (64 MiB binary): %.1f ms' % (1000 * check_time))
+    return ret
+
+
+BENCHMARKS = {
+    'blocks': bench_blocks,
+    'blockstore': bench_blockstore,
+    'codec': bench_codec,
+    'deserialize': bench_deserialize,
+    'equihash': bench_equihash,
+    'firstsolution': bench_firstsolution,
+    'framing': bench_framing,
+    'latency': bench_latency,
+    'memory': bench_memory,
+    'rpcbatch': bench_rpcbatch,
+    'rpcdecode': bench_rpcdecode,
+    'rpcmetrics': bench_rpcmetrics,
+    'rpcpool': bench_rpcpool,
+    'serialize': bench_serialize,
+    'snapshot': bench_snapshot,
+    'solutioncache': bench_solutioncache,
+    'solve': bench_solve,
+    'validate': bench_validate,
+    'wakeup': bench_wakeup,
+}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nonces', type=int, default=20,
+                        help='Number of nonces to solve at n=48,k=5')
+    parser.add_argument('--solve-blocks', type=int, default=10,
+                        help='Number of regtest blocks to mine')
+    parser.add_argument('--blocks', type=int, default=500,
+                        help='Number of solutions to validate in a batch')
+    parser.add_argument('--txs', type=int, default=1000,
+                        help='Number of transactions in a deserialized block')
+    parser.add_argument('--memtxs', type=int, default=10000,
+                        help='Number of transactions in a block held in memory')
+    parser.add_argument('--headers', type=int, default=5000,
+                        help='Number of blocks in the BlockStore chain')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='Number of max-size blocks to push through a NodeConn')
+    parser.add_argument('--peers', type=int, default=200,
+                        help='Number of concurrent NodeConns to ping')
+    parser.add_argument('benchmark', nargs='*', default=sorted(BENCHMARKS),
+                        help='One of %s' % ', '.join(sorted(BENCHMARKS)))
+    args = parser.parse_args()
+
+    ret = True
+    for name in args.benchmark:
+        if name not in BENCHMARKS:
+            print('Unknown benchmark %s' % name)
+            sys.exit(1)
+        print('=== Benchmark %s ===' % name)
+        ret &= BENCHMARKS[name](args)
+    if not ret:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()